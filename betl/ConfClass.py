@@ -7,6 +7,10 @@ from betl.io import SqliteDatastore
 from betl.io import GsheetDatastore
 from betl.io import ExcelDatastore
 from betl.io import FileDatastore
+from betl.io import fileIO
+from betl.io import dbIO
+from betl.io import gsheetClient
+from betl.io import keyMapIO
 from betl.datamodel import DataLayer
 from betl.logger import Logger
 
@@ -189,6 +193,62 @@ class Conf():
         else:
             self.DATA_LIMIT_ROWS = None
             self.MONITOR_MEMORY_USAGE = True
+        # If set, the default bulk extract streams each source table to the
+        # EXT layer in chunks of this many rows, rather than all at once
+        if 'EXTRACT_CHUNK_SIZE' in appConfig['ctrl']:
+            self.EXTRACT_CHUNK_SIZE = \
+                int(appConfig['ctrl']['EXTRACT_CHUNK_SIZE'])
+        else:
+            self.EXTRACT_CHUNK_SIZE = None
+        # BINARY COPYs tables defined in the logical data model to Postgres
+        # in binary format, so the DB doesn't have to parse text. Tables
+        # with data types we can't encode fall back to CSV
+        if 'DB_COPY_FORMAT' in appConfig['ctrl']:
+            self.DB_COPY_FORMAT = appConfig['ctrl']['DB_COPY_FORMAT'].upper()
+        else:
+            self.DB_COPY_FORMAT = 'CSV'
+        if self.DB_COPY_FORMAT not in dbIO.COPY_FORMATS:
+            raise ValueError('DB_COPY_FORMAT must be one of ' +
+                             str(dbIO.COPY_FORMATS))
+        # Postgres connections are pooled across the process. This is how
+        # many idle connections each pool keeps open for reuse
+        if 'DB_POOL_SIZE' in appConfig['ctrl']:
+            self.DB_POOL_SIZE = int(appConfig['ctrl']['DB_POOL_SIZE'])
+        else:
+            self.DB_POOL_SIZE = 10
+        # ... and the most connections each pool has open at once. Beyond
+        # that, we wait up to DB_POOL_TIMEOUT seconds for one to be released
+        if 'DB_POOL_MAX_OPEN' in appConfig['ctrl']:
+            self.DB_POOL_MAX_OPEN = int(appConfig['ctrl']['DB_POOL_MAX_OPEN'])
+        else:
+            self.DB_POOL_MAX_OPEN = 50
+        if 'DB_POOL_TIMEOUT' in appConfig['ctrl']:
+            self.DB_POOL_TIMEOUT = float(appConfig['ctrl']['DB_POOL_TIMEOUT'])
+        else:
+            self.DB_POOL_TIMEOUT = 60
+        # Dimensions' SK/NK mappings are kept in memory once read, for all
+        # the fact loads in the process, up to this many MB between them
+        if 'KEY_MAP_CACHE_SIZE_MB' in appConfig['ctrl']:
+            self.KEY_MAP_CACHE_SIZE_MB = \
+                float(appConfig['ctrl']['KEY_MAP_CACHE_SIZE_MB'])
+        else:
+            self.KEY_MAP_CACHE_SIZE_MB = 1024
+        # How natural keys are collapsed into a single column for SK lookup
+        if 'NK_ENCODING' in appConfig['ctrl']:
+            self.NK_ENCODING = appConfig['ctrl']['NK_ENCODING'].upper()
+        else:
+            self.NK_ENCODING = 'STRING'
+        if self.NK_ENCODING not in keyMapIO.NK_ENCODINGS:
+            raise ValueError('NK_ENCODING must be one of ' +
+                             str(keyMapIO.NK_ENCODINGS))
+        # Who assigns dimensions' SKs when they are bulk loaded
+        if 'SK_GENERATION' in appConfig['ctrl']:
+            self.SK_GENERATION = appConfig['ctrl']['SK_GENERATION'].upper()
+        else:
+            self.SK_GENERATION = 'DB'
+        if self.SK_GENERATION not in keyMapIO.SK_GENERATION_MODES:
+            raise ValueError('SK_GENERATION must be one of ' +
+                             str(keyMapIO.SK_GENERATION_MODES))
         self.RUN_TESTS = bool(appConfig['ctrl']['RUN_TESTS'])
         self.AUDIT_COLS = pd.DataFrame(Conf.auditColumns)
 
@@ -205,6 +265,108 @@ class Conf():
         self.SCHEMA_PATH = \
             self.APP_DIRECTORY + appConfig['ctrl']['SCHEMA_PATH']
 
+        # If set, parsed Excel and CSV source files are cached here (as
+        # Parquet), and unchanged files are read from the cache. Entries
+        # are evicted when unused for SRC_CACHE_MAX_AGE_DAYS, or when the
+        # cache outgrows SRC_CACHE_MAX_SIZE_MB
+        if 'SRC_CACHE_PATH' in appConfig['ctrl']:
+            self.SRC_CACHE_PATH = \
+                self.APP_DIRECTORY + appConfig['ctrl']['SRC_CACHE_PATH']
+        else:
+            self.SRC_CACHE_PATH = None
+        if 'SRC_CACHE_MAX_AGE_DAYS' in appConfig['ctrl']:
+            self.SRC_CACHE_MAX_AGE_DAYS = \
+                float(appConfig['ctrl']['SRC_CACHE_MAX_AGE_DAYS'])
+        else:
+            self.SRC_CACHE_MAX_AGE_DAYS = 30
+        if 'SRC_CACHE_MAX_SIZE_MB' in appConfig['ctrl']:
+            self.SRC_CACHE_MAX_SIZE_MB = \
+                float(appConfig['ctrl']['SRC_CACHE_MAX_SIZE_MB'])
+        else:
+            self.SRC_CACHE_MAX_SIZE_MB = 1024
+
+        # If SKIP_UNCHANGED_EXTRACTS is TRUE, the default bulk extract
+        # fingerprints each source table and skips the extract if it
+        # matches the fingerprint saved (in EXTRACT_STATE_PATH) last time
+        if 'SKIP_UNCHANGED_EXTRACTS' in appConfig['ctrl']:
+            self.SKIP_UNCHANGED_EXTRACTS = \
+                appConfig['ctrl']['SKIP_UNCHANGED_EXTRACTS'].upper() == 'TRUE'
+        else:
+            self.SKIP_UNCHANGED_EXTRACTS = False
+        if 'EXTRACT_STATE_PATH' in appConfig['ctrl']:
+            self.EXTRACT_STATE_PATH = \
+                self.APP_DIRECTORY + appConfig['ctrl']['EXTRACT_STATE_PATH']
+        else:
+            self.EXTRACT_STATE_PATH = self.APP_DIRECTORY + 'extract_state'
+
+        # Google Sheets reads can also be cached (as JSON) in
+        # GSHEET_CACHE_PATH. Entries are keyed on the spreadsheet's
+        # modifiedTime, so an edited spreadsheet is always re-read. The
+        # least recently used are evicted when the cache outgrows
+        # GSHEET_CACHE_MAX_SIZE_MB
+        if 'GSHEET_CACHE_PATH' in appConfig['ctrl']:
+            self.GSHEET_CACHE_PATH = \
+                self.APP_DIRECTORY + appConfig['ctrl']['GSHEET_CACHE_PATH']
+        else:
+            self.GSHEET_CACHE_PATH = None
+        if 'GSHEET_CACHE_MAX_SIZE_MB' in appConfig['ctrl']:
+            self.GSHEET_CACHE_MAX_SIZE_MB = \
+                float(appConfig['ctrl']['GSHEET_CACHE_MAX_SIZE_MB'])
+        else:
+            self.GSHEET_CACHE_MAX_SIZE_MB = 256
+
+        # All Google Sheets requests share one client, which keeps within
+        # GSHEET_REQUESTS_PER_MINUTE and retries (with exponential backoff)
+        # up to GSHEET_MAX_RETRIES times when Google pushes back
+        if 'GSHEET_REQUESTS_PER_MINUTE' in appConfig['ctrl']:
+            self.GSHEET_REQUESTS_PER_MINUTE = \
+                float(appConfig['ctrl']['GSHEET_REQUESTS_PER_MINUTE'])
+        else:
+            self.GSHEET_REQUESTS_PER_MINUTE = \
+                gsheetClient.DEFAULT_REQUESTS_PER_MINUTE
+        if 'GSHEET_MAX_RETRIES' in appConfig['ctrl']:
+            self.GSHEET_MAX_RETRIES = \
+                int(appConfig['ctrl']['GSHEET_MAX_RETRIES'])
+        else:
+            self.GSHEET_MAX_RETRIES = gsheetClient.DEFAULT_MAX_RETRIES
+
+        ####################
+        # TEMP DATA FORMAT #
+        ####################
+
+        # The format of the temp data files handed between data layers.
+        # CSV by default, or PARQUET / ARROW for typed, columnar files
+        if 'TMP_DATA_FORMAT' in appConfig['ctrl']:
+            self.TMP_DATA_FORMAT = \
+                appConfig['ctrl']['TMP_DATA_FORMAT'].upper()
+        else:
+            self.TMP_DATA_FORMAT = 'CSV'
+        if self.TMP_DATA_FORMAT not in fileIO.TMP_DATA_FILE_EXTS:
+            raise ValueError('TMP_DATA_FORMAT must be one of ' +
+                             str(list(fileIO.TMP_DATA_FILE_EXTS)))
+        self.TMP_DATA_FILE_EXT = \
+            fileIO.TMP_DATA_FILE_EXTS[self.TMP_DATA_FORMAT]
+
+        # Compression codec for the columnar formats (ignored for CSV)
+        if 'TMP_DATA_COMPRESSION' in appConfig['ctrl']:
+            self.TMP_DATA_COMPRESSION = \
+                appConfig['ctrl']['TMP_DATA_COMPRESSION'].upper()
+        else:
+            self.TMP_DATA_COMPRESSION = 'NONE'
+        if self.TMP_DATA_COMPRESSION not in fileIO.TMP_DATA_COMPRESSIONS:
+            raise ValueError('TMP_DATA_COMPRESSION must be one of ' +
+                             str(fileIO.TMP_DATA_COMPRESSIONS))
+
+        # The parser used to read CSV files (temp data and FILESYSTEM
+        # source systems). PYARROW parses on multiple threads
+        if 'CSV_ENGINE' in appConfig['ctrl']:
+            self.CSV_ENGINE = appConfig['ctrl']['CSV_ENGINE'].upper()
+        else:
+            self.CSV_ENGINE = 'PANDAS'
+        if self.CSV_ENGINE not in fileIO.CSV_ENGINES:
+            raise ValueError('CSV_ENGINE must be one of ' +
+                             str(fileIO.CSV_ENGINES))
+
         #########
         # STATE #
         #########
@@ -289,6 +451,13 @@ class Conf():
     # DATASTORE CONNECTIONS #
     #########################
 
+    def getGsheetClient(self):
+        return gsheetClient.getClient(
+            apiKey=self.APP_DIRECTORY + self.GSHEETS_API_KEY_FILE,
+            apiScope=self.GOOGLE_API_SCOPE,
+            requestsPerMinute=self.GSHEET_REQUESTS_PER_MINUTE,
+            maxRetries=self.GSHEET_MAX_RETRIES)
+
     def getSchemaDescDatastore(self, dbId):
         if dbId in self.SCHEMA_DESCRIPTION_GSHEETS:
             return self.SCHEMA_DESCRIPTION_GSHEETS[dbId]
@@ -304,7 +473,10 @@ class Conf():
                     apiScope=self.GOOGLE_API_SCOPE,
                     apiKey=self.APP_DIRECTORY + self.GSHEETS_API_KEY_FILE,
                     filename=self.SCHEMA_DESCRIPTION_GSHEETS_FILENAMES[dbId],
-                    isSchemaDesc=True)
+                    isSchemaDesc=True,
+                    cachePath=self.GSHEET_CACHE_PATH,
+                    cacheMaxSizeMB=self.GSHEET_CACHE_MAX_SIZE_MB,
+                    client=self.getGsheetClient())
             return self.SCHEMA_DESCRIPTION_GSHEETS[dbId]
 
     def getDefaultRowsDatastore(self):
@@ -320,7 +492,10 @@ class Conf():
                     ssID='DR',
                     apiScope=self.GOOGLE_API_SCOPE,
                     apiKey=self.APP_DIRECTORY + self.GSHEETS_API_KEY_FILE,
-                    filename=self.DEFAULT_ROWS_FILENAME)
+                    filename=self.DEFAULT_ROWS_FILENAME,
+                    cachePath=self.GSHEET_CACHE_PATH,
+                    cacheMaxSizeMB=self.GSHEET_CACHE_MAX_SIZE_MB,
+                    client=self.getGsheetClient())
             return self.DEFAULT_ROWS_GSHEET
         else:
             # You don't have to specify a default rows file at all
@@ -339,8 +514,19 @@ class Conf():
                     ssID='MDM',
                     apiScope=self.GOOGLE_API_SCOPE,
                     apiKey=self.APP_DIRECTORY + self.GSHEETS_API_KEY_FILE,
-                    filename=self.MDM_FILENAME)
-            return self.MDM_SRC
+                    filename=self.MDM_FILENAME,
+                    cachePath=self.GSHEET_CACHE_PATH,
+                    cacheMaxSizeMB=self.GSHEET_CACHE_MAX_SIZE_MB,
+                    client=self.getGsheetClient())
+            return self.MDM_GSHEET
+
+    def closeDatastores(self):
+        # Called at the end of every task, so datastores don't hold on to
+        # connections (or open files) between tasks. They reopen lazily if
+        # they're used again
+        for datastore in list(self.DWH_DATABASES.values()) + \
+                list(self.SRC_SYSTEMS.values()):
+            datastore.close()
 
     def getDWHDatastore(self, dbId):
 
@@ -362,9 +548,32 @@ class Conf():
                     user=self.DWH_DATABASES_DETAILS[dbId]['user'],
                     password=self.DWH_DATABASES_DETAILS[dbId]['password'],
                     schema=self.DWH_DATABASES_DETAILS[dbId]['schema'],
-                    createIfNotFound=True)
+                    createIfNotFound=True,
+                    poolSize=self.DB_POOL_SIZE,
+                    poolMaxOpen=self.DB_POOL_MAX_OPEN,
+                    poolTimeout=self.DB_POOL_TIMEOUT)
             return self.DWH_DATABASES[dbId]
 
+    def getSnapshotExtractConnections(self, ssID):
+        # A POSTGRES source system can set SNAPSHOT_EXTRACT_CONNECTIONS, in
+        # which case the default bulk extract reads all its tables at once,
+        # over this many connections, from a single snapshot
+        details = self.SRC_SYSTEM_DETAILS[ssID]
+        if details['type'] == 'POSTGRES' and \
+                'snapshot_extract_connections' in details:
+            return int(details['snapshot_extract_connections'])
+        return None
+
+    def getParallelExtractProcesses(self, ssID):
+        # An EXCEL source system can set PARALLEL_EXTRACT_PROCESSES, in
+        # which case the default bulk extract parses all its worksheets at
+        # once, in this many processes
+        details = self.SRC_SYSTEM_DETAILS[ssID]
+        if details['type'] == 'EXCEL' and \
+                'parallel_extract_processes' in details:
+            return int(details['parallel_extract_processes'])
+        return None
+
     def getSrcSysDatastore(self, ssID):
         if ssID in self.SRC_SYSTEMS:
             return self.SRC_SYSTEMS[ssID]
@@ -374,6 +583,22 @@ class Conf():
                 srcSysPath = (self.APP_DIRECTORY +
                               self.SRC_SYSTEM_DETAILS[ssID]['path'])
             if srcSysType == 'POSTGRES':
+                # Optionally, large tables can be read in key ranges over
+                # several connections at once. These are listed in a
+                # PARTITIONED_READS subsection, one table per line:
+                #   tableName = partitionColumn, numberOfPartitions
+                partitionedReads = {}
+                if 'partitioned_reads' in self.SRC_SYSTEM_DETAILS[ssID]:
+                    tables = self.SRC_SYSTEM_DETAILS[ssID]['partitioned_reads']
+                    for tableName in tables:
+                        if len(tables[tableName]) != 2:
+                            raise ValueError(
+                                'PARTITIONED_READS for ' + tableName +
+                                ' must be: partitionColumn, ' +
+                                'numberOfPartitions')
+                        partitionedReads[tableName.lower()] = \
+                            (tables[tableName][0],
+                             int(tables[tableName][1]))
                 self.SRC_SYSTEMS[ssID] = \
                     PostgresDatastore(
                         dbId=ssID,
@@ -382,7 +607,11 @@ class Conf():
                         user=self.SRC_SYSTEM_DETAILS[ssID]['user'],
                         password=self.SRC_SYSTEM_DETAILS[ssID]['password'],
                         schema=self.SRC_SYSTEM_DETAILS[ssID]['schema'],
-                        isSrcSys=True)
+                        isSrcSys=True,
+                        partitionedReads=partitionedReads,
+                        poolSize=self.DB_POOL_SIZE,
+                        poolMaxOpen=self.DB_POOL_MAX_OPEN,
+                        poolTimeout=self.DB_POOL_TIMEOUT)
 
             elif srcSysType == 'SQLITE':
 
@@ -394,6 +623,19 @@ class Conf():
                         isSrcSys=True)
 
             elif srcSysType == 'FILESYSTEM':
+                # Optionally, large files can be parsed in parallel
+                parallelParseThresholdMB = None
+                parallelParseProcesses = None
+                if 'parallel_parse_threshold_mb' in \
+                        self.SRC_SYSTEM_DETAILS[ssID]:
+                    parallelParseThresholdMB = float(
+                        self.SRC_SYSTEM_DETAILS[ssID][
+                            'parallel_parse_threshold_mb'])
+                if 'parallel_parse_processes' in \
+                        self.SRC_SYSTEM_DETAILS[ssID]:
+                    parallelParseProcesses = int(
+                        self.SRC_SYSTEM_DETAILS[ssID][
+                            'parallel_parse_processes'])
                 self.SRC_SYSTEMS[ssID] = \
                     FileDatastore(
                         fileSysID=ssID,
@@ -401,6 +643,8 @@ class Conf():
                         fileExt=self.SRC_SYSTEM_DETAILS[ssID]['file_ext'],
                         delim=self.SRC_SYSTEM_DETAILS[ssID]['delimiter'],
                         quotechar=self.SRC_SYSTEM_DETAILS[ssID]['quotechar'],
+                        parallelParseThresholdMB=parallelParseThresholdMB,
+                        parallelParseProcesses=parallelParseProcesses,
                         isSrcSys=True)
 
             elif srcSysType == 'EXCEL':
@@ -419,7 +663,10 @@ class Conf():
                         apiScope=self.GOOGLE_API_SCOPE,
                         apiKey=self.APP_DIRECTORY + self.GSHEETS_API_KEY_FILE,
                         filename=self.SRC_SYSTEM_DETAILS[ssID]['filename'],
-                        isSrcSys=True)
+                        isSrcSys=True,
+                        cachePath=self.GSHEET_CACHE_PATH,
+                        cacheMaxSizeMB=self.GSHEET_CACHE_MAX_SIZE_MB,
+                        client=self.getGsheetClient())
 
             return self.SRC_SYSTEMS[ssID]
 
@@ -433,7 +680,7 @@ class Conf():
             for filename in filenames:
                 _filename = filename[self.FILE_PREFIX_LENGTH+1:]
                 shortfn, ext = os.path.splitext(filename)
-                if ext == '.csv':
+                if ext in fileIO.TMP_DATA_FILE_EXTS.values():
                     thisPrefix = int(filename[:self.FILE_PREFIX_LENGTH])
                     if thisPrefix >= self.NEXT_FILE_PREFIX:
                         self.NEXT_FILE_PREFIX = thisPrefix + 1
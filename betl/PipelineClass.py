@@ -9,6 +9,7 @@ from betl.defaultdataflows import dmDate
 from betl.defaultdataflows import dmAudit
 from .ConfClass import Conf
 from betl.logger import Logger
+from betl.io import gsheetClient
 
 
 class Pipeline():
@@ -85,6 +86,39 @@ class Pipeline():
                         extLayer = self.CONF.getLogicalSchemaDataLayer('EXT')
                         skip = self.CONF.EXT_TABLES_TO_EXCLUDE_FROM_DEFAULT_EXT
                         for dmId in extLayer.datasets:
+
+                            # Source systems extracted under a single
+                            # snapshot get one op for all their tables
+                            if self.CONF.getSnapshotExtractConnections(
+                                    dmId) is not None:
+                                extractOp = self.createOp(
+                                    taskId='bulkExtractWithSnapshot_' + dmId,
+                                    func=stageExtract.bulkExtractWithSnapshot,
+                                    upstream=logExtractStart,
+                                    tableNames=[
+                                        tableName for tableName
+                                        in extLayer.datasets[dmId].tables
+                                        if tableName not in skip],
+                                    dmId=dmId)
+                                extractOps.append(extractOp)
+                                continue
+
+                            # Likewise, Excel source systems whose worksheets
+                            # are parsed in parallel
+                            if self.CONF.getParallelExtractProcesses(
+                                    dmId) is not None:
+                                extractOp = self.createOp(
+                                    taskId='bulkExtractWorksheets_' + dmId,
+                                    func=stageExtract.bulkExtractWorksheets,
+                                    upstream=logExtractStart,
+                                    tableNames=[
+                                        tableName for tableName
+                                        in extLayer.datasets[dmId].tables
+                                        if tableName not in skip],
+                                    dmId=dmId)
+                                extractOps.append(extractOp)
+                                continue
+
                             for tableName in extLayer.datasets[dmId].tables:
 
                                 if tableName in skip:
@@ -480,10 +514,13 @@ class Pipeline():
             return op
         else:
             # We call the conf arg "betl" for the app-facing interface
-            if isBETLFunc:
-                func(**{**kwargs, 'conf': self.CONF})
-            else:
-                func(**{**kwargs, 'betl': self.CONF})
+            try:
+                if isBETLFunc:
+                    func(**{**kwargs, 'conf': self.CONF})
+                else:
+                    func(**{**kwargs, 'betl': self.CONF})
+            finally:
+                self.CONF.closeDatastores()
 
     def log(self, logMethod, **kwargs):
         getattr(self.LOG, logMethod)(**kwargs)
@@ -508,10 +545,14 @@ def wrapperFunc(**kwargs):
     # BETL funcs, on the other hand, e.g. default data flows, can have
     # additional params. Note that the entire Airflow context is passed through
     # in kwargs as well
-    if kwargs['isBETLFunc']:
-        kwargs['func'](**kwargs)
-    else:
-        kwargs['func'](kwargs['conf'])
+    try:
+        if kwargs['isBETLFunc']:
+            kwargs['func'](**kwargs)
+        else:
+            kwargs['func'](kwargs['conf'])
+    finally:
+        # Give the datastores' connections back to their pools
+        kwargs['conf'].closeDatastores()
 
 
 def logBETLStart(**kwargs):
@@ -519,4 +560,5 @@ def logBETLStart(**kwargs):
 
 
 def logBETLEnd(**kwargs):
+    kwargs['conf'].log('logGsheetClientStats', stats=gsheetClient.getStats())
     kwargs['conf'].log('logBETLEnd')
@@ -1,13 +1,23 @@
 import os
 import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from configobj import ConfigObj
 
 from betl.ConfClass import Conf
 from betl.io import fileIO
+from betl.io import gsheetClient
 from betl.setup import SetupClass
 from betl.setup import fileSetup
 
+# Worksheets are fetched in batches of up to gsheetClient.BATCH_GET_MAX_RANGES;
+# this many batches at once
+SCHEMA_DESC_READ_THREADS = 4
+
+LAST_MODIFIED_TIMES_LOCK = threading.Lock()
+
 
 def admin(appDirectory,
           appConfigFileName,
@@ -92,14 +102,17 @@ def autoPopulateExtSchemaDescGsheets(conf, srcSystemDataModels):
 
     conf.log('logDeleteSrcSchemaDescWsFromSS')
 
-    ss = conf.getSchemaDescDatastore('ETL').conn
+    gSheet = conf.getSchemaDescDatastore('ETL')
 
-    for ws in ss.worksheets():
-        if ws.title.find('ETL.EXT.') == 0:
-            ss.del_worksheet(ws)
+    gSheet.deleteWorksheets(
+        [wsTitle for wsTitle in gSheet.getWorksheets()
+         if wsTitle.find('ETL.EXT.') == 0])
 
     # Each source system will create a new dataset within our EXT data
-    # layer (within our ETL database)
+    # layer (within our ETL database). We build up all the new worksheets
+    # first, in memory, then add them all in one go.
+
+    newWorksheets = {}
 
     for srcSysID in conf.SRC_SYSTEM_DETAILS:
 
@@ -116,29 +129,16 @@ def autoPopulateExtSchemaDescGsheets(conf, srcSystemDataModels):
             wsName = ('ETL.EXT.' + srcSysID + '.' +
                       srcSysID.lower() + '_' + extTableName)
 
-            ws = ss.add_worksheet(title=wsName,
-                                  rows=len(colSchemas)+1,
-                                  cols=3)
-
-            # We build up our new GSheets table first, in memory,
-            # then write it all in one go.
-            cell_list = ws.range('A1:C'+str(len(colSchemas)+1))
-            rangeRowCount = 0
-            cell_list[rangeRowCount].value = 'Column Name'
-            cell_list[rangeRowCount+1].value = 'Data Type'
-            cell_list[rangeRowCount+2].value = 'Column Type'
-            rangeRowCount += 3
+            rows = [['Column Name', 'Data Type', 'Column Type']]
             for col in colSchemas:
-                cell_list[rangeRowCount].value = \
-                    colSchemas[col]['columnName']
-                cell_list[rangeRowCount+1].value = \
-                    colSchemas[col]['dataType']
-                cell_list[rangeRowCount+2].value = \
-                    colSchemas[col]['columnType']
-                rangeRowCount += 3
+                rows.append([colSchemas[col]['columnName'],
+                             colSchemas[col]['dataType'],
+                             colSchemas[col]['columnType']])
+            newWorksheets[wsName] = rows
 
-            ws.update_cells(cell_list)
+    gSheet.addWorksheets(newWorksheets)
 
+    conf.log('logGsheetClientStats', stats=gsheetClient.getStats())
     conf.log('logAutoPopExtSchemaDescsEnd')
 
 
@@ -287,8 +287,9 @@ def readSrcSystemSchemas(conf):
             # worksheet containing one table. The top row is the column
             # headings.
             worksheets = srcSysDS.getWorksheets()
+            headerRows = srcSysDS.getWorksheetsHeaderRows(list(worksheets))
             for wsName in worksheets:
-                colHeaders = worksheets[wsName].row_values(1)
+                colHeaders = headerRows[wsName]
                 colSchemas = {}
                 for colName in colHeaders:
                     if colName != '':
@@ -366,112 +367,224 @@ def refreshSchemaDescsTxtFilesFromGsheets(conf):
 
     conf.log('logRefreshingSchemaDescsTxtFilesFromGsheetsStart')
 
-    for dbId in conf.DWH_DATABASES_DETAILS:
-        gSheet = conf.getSchemaDescDatastore(dbId)
-
-        # -----
-        # Start by builing an array of all the releavnt worksheets from the
-        # DB's schema desc gsheet.
-        worksheets = []
-        # It's important to call getWorksheets() again, rather than the
-        # worksheets attribute, because we might have just replaced the SRC
-        # worksheets (if we ran READ_SRC)
-        for gWorksheetTitle in gSheet.getWorksheets():
-            # skip README sheets, and any sheets prefixed with "IGN."
-            if (gWorksheetTitle[0:4] != 'IGN.' and
-                    gWorksheetTitle.lower() != 'readme'):
-                worksheets.append(gSheet.worksheets[gWorksheetTitle])
-
-        dbSchemaDesc = {}
-
-        conf.log('logLoadingDBSchemaDescsFromGsheets', dbId=dbId)
-
-        for ws in worksheets:
-            # Get the dataLayer, dataset and table name from the worksheet
-            # title. The TRG schmea desc spreadsheet only needs to code
-            # worksheets with the datalayer (beacuse there's only one
-            # dataset per datalayer: <dataLayerID>.<tableName>). We default
-            # the datasetID to the dataLayerID
-            # The ETL worksheet names are:
-            # <dataLayerID>.<datasetID>.<tableName>
-            if dbId == 'TRG':
-                dataLayerID = ws.title[0:ws.title.find('.')]
-                dsID = dataLayerID
-                tableName = ws.title[ws.title.rfind('.')+1:]
-            elif dbId == 'ETL':
-                dataLayerID = ws.title[0:ws.title.find('.')]
-                dsID = ws.title[ws.title.find('.')+1:ws.title.rfind('.')]
-                tableName = ws.title[ws.title.rfind('.')+1:]
-
-            # If needed, create a new item in our db schema desc for
-            # this data layer, and a new item in our dl schema desc for
-            # this data model.
-            # (there is a worksheet per table, many tables per data model,
-            # and many data models per database)
-            if dataLayerID not in dbSchemaDesc:
-                dbSchemaDesc[dataLayerID] = {
-                    'dataLayerID': dataLayerID,
-                    'datasetSchemas': {}
-                }
-            dlSchemaDesc = dbSchemaDesc[dataLayerID]
-            if dsID not in dlSchemaDesc['datasetSchemas']:
-                dlSchemaDesc['datasetSchemas'][dsID] = {
-                    'datasetID': dsID,
-                    'tableSchemas': {}
-                }
-            datasetSchemaDesc = dlSchemaDesc['datasetSchemas'][dsID]
-
-            # Create a new table schema description
-
-            # For the EXT layer, some data sources can provide us with table
-            # name incompatible with Postgres (e.g. worksheet names in Excel/
-            # GSheets). The table names in EXT schema description GSheet needs
-            # to match source exactly, otherwise the default extract won't run
-            # (and, of course, if autoPopulateExtSchemaDescGsheets() has been
-            # used, then then the table names will match by default). This
-            # leaves us with a problem, because we can't then use these table
-            # names in our Postgres EXT layer. So use a cleanTableName function
-            # and store along with the src table name
-
-            if dataLayerID == 'EXT':
-                cleanedTableName = cleanTableName(tableName)
-            else:
-                cleanedTableName = ''
-
-            tableSchema = {
-                'tableName': tableName,
-                'cleanTableName': cleanedTableName,
-                'schema': conf.DWH_DATABASES_DETAILS[dbId]['schema'],
-                'columnSchemas': {}
+    # Each database's schema desc spreadsheet is refreshed in its own thread
+    with ThreadPoolExecutor(
+            max_workers=len(conf.DWH_DATABASES_DETAILS)) as executor:
+        futures = [
+            executor.submit(refreshSchemaDescTxtFileFromGsheet, conf, dbId)
+            for dbId in conf.DWH_DATABASES_DETAILS]
+        for future in futures:
+            future.result()
+
+    conf.log('logRefreshingSchemaDescsTxtFilesFromGsheetsEnd')
+
+    conf.log('logGsheetClientStats', stats=gsheetClient.getStats())
+
+
+def refreshSchemaDescTxtFileFromGsheet(conf, dbId):
+
+    gSheet = conf.getSchemaDescDatastore(dbId)
+    filename = conf.SCHEMA_PATH + '/dbSchemaDesc_' + dbId + '.txt'
+
+    # If the spreadsheet hasn't been modified since we last wrote the txt
+    # file, there's nothing to do. (The schema name is part of the version
+    # because it's written into every table schema)
+    version = {
+        'spreadsheetId': gSheet.version[0],
+        'modifiedTime': gSheet.version[1],
+        'schema': conf.DWH_DATABASES_DETAILS[dbId]['schema']}
+    state = readLastModifiedTimes(conf).get(dbId)
+    if (state is not None and state['version'] == version and
+            os.path.exists(filename)):
+        conf.log('logSkipUnchangedSchemaDesc', dbId=dbId)
+        return
+
+    # -----
+    # Start by builing an array of all the releavnt worksheets from the
+    # DB's schema desc gsheet.
+    wsTitles = []
+    # It's important to call getWorksheets() again, rather than the
+    # worksheets attribute, because we might have just replaced the SRC
+    # worksheets (if we ran READ_SRC)
+    for gWorksheetTitle in gSheet.getWorksheets():
+        # skip README sheets, and any sheets prefixed with "IGN."
+        if (gWorksheetTitle[0:4] != 'IGN.' and
+                gWorksheetTitle.lower() != 'readme'):
+            wsTitles.append(gWorksheetTitle)
+
+    conf.log('logLoadingDBSchemaDescsFromGsheets', dbId=dbId)
+
+    # Batched requests for all the worksheets (that aren't cached), several
+    # at a time
+    valuesByWS = gSheet.getWorksheetsValues(
+        wsTitles,
+        numThreads=SCHEMA_DESC_READ_THREADS)
+
+    # We merge into the existing txt file: a worksheet whose contents
+    # haven't changed since the last refresh keeps its table schema from
+    # the file, so we only rebuild the ones that have changed. Worksheets
+    # that have been deleted drop out
+    oldDbSchemaDesc = {}
+    oldWSHashes = {}
+    if state is not None and os.path.exists(filename):
+        with open(filename, 'r') as file:
+            oldDbSchemaDesc = json.loads(file.read())
+        oldWSHashes = state['worksheetHashes']
+
+    dbSchemaDesc = {}
+    wsHashes = {}
+
+    for wsTitle in wsTitles:
+
+        dataLayerID, dsID, tableName = \
+            getSchemaDescWorksheetNames(dbId, wsTitle)
+
+        # If needed, create a new item in our db schema desc for
+        # this data layer, and a new item in our dl schema desc for
+        # this data model.
+        # (there is a worksheet per table, many tables per data model,
+        # and many data models per database)
+        if dataLayerID not in dbSchemaDesc:
+            dbSchemaDesc[dataLayerID] = {
+                'dataLayerID': dataLayerID,
+                'datasetSchemas': {}
             }
+        dlSchemaDesc = dbSchemaDesc[dataLayerID]
+        if dsID not in dlSchemaDesc['datasetSchemas']:
+            dlSchemaDesc['datasetSchemas'][dsID] = {
+                'datasetID': dsID,
+                'tableSchemas': {}
+            }
+        datasetSchemaDesc = dlSchemaDesc['datasetSchemas'][dsID]
 
-            # Pull out the column schema descriptions from the Google
-            # worksheeet and restructure a little
-            colSchemaDescsFromWS = ws.get_all_records()
-            for colSchemaDescFromWS in colSchemaDescsFromWS:
-                colName = colSchemaDescFromWS['Column Name']
-                fkDimension = 'None'
-                if 'FK Dimension' in colSchemaDescFromWS:
-                    fkDimension = colSchemaDescFromWS['FK Dimension']
-
-                # append this column schema desc to our tableSchema object
-                tableSchema['columnSchemas'][colName] = {
-                    'schema':  conf.DWH_DATABASES_DETAILS[dbId]['schema'],
-                    'tableName':   tableName,
-                    'columnName':  colName,
-                    'dataType':    colSchemaDescFromWS['Data Type'],
-                    'columnType':  colSchemaDescFromWS['Column Type'],
-                    'fkDimension': fkDimension
-                }
+        wsHashes[wsTitle] = hashlib.sha256(
+            json.dumps(valuesByWS[wsTitle]).encode('utf-8')).hexdigest()
 
-            # Finally, add the tableSchema to our data dataset schema desc
-            datasetSchemaDesc['tableSchemas'][tableName] = tableSchema
+        try:
+            oldTableSchema = (oldDbSchemaDesc[dataLayerID]
+                              ['datasetSchemas'][dsID]
+                              ['tableSchemas'][tableName])
+        except KeyError:
+            oldTableSchema = None
 
-        filename = conf.SCHEMA_PATH + '/dbSchemaDesc_' + dbId + '.txt'
-        with open(filename, 'w') as file:
-            file.write(json.dumps(dbSchemaDesc))
+        if (oldTableSchema is not None and
+                oldWSHashes.get(wsTitle) == wsHashes[wsTitle]):
+            tableSchema = oldTableSchema
+        else:
+            tableSchema = getTableSchemaFromWorksheet(
+                conf=conf,
+                dbId=dbId,
+                dataLayerID=dataLayerID,
+                tableName=tableName,
+                colSchemaDescsFromWS=gsheetClient.valuesToRecords(
+                    valuesByWS[wsTitle]))
+
+        # Finally, add the tableSchema to our data dataset schema desc
+        datasetSchemaDesc['tableSchemas'][tableName] = tableSchema
+
+    with open(filename, 'w') as file:
+        file.write(json.dumps(dbSchemaDesc))
+
+    # Written last, so if we fail part way through we'll refresh in full
+    # next time
+    writeLastModifiedTime(conf, dbId, {
+        'version': version,
+        'worksheetHashes': wsHashes})
+
+
+# The schema dir's lastModifiedTimes.txt records, for each database, the
+# version of the schema desc spreadsheet the txt file was last refreshed
+# from, and a hash of each of its worksheets
+def readLastModifiedTimes(conf):
+
+    filename = conf.SCHEMA_PATH + '/lastModifiedTimes.txt'
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, 'r') as file:
+        content = file.read()
+    if content == '':
+        return {}
+    return json.loads(content)
+
+
+def writeLastModifiedTime(conf, dbId, state):
+
+    # The databases are refreshed in parallel threads, so we serialise the
+    # read-modify-write of the shared file
+    with LAST_MODIFIED_TIMES_LOCK:
+        lastModifiedTimes = readLastModifiedTimes(conf)
+        lastModifiedTimes[dbId] = state
+        with open(conf.SCHEMA_PATH + '/lastModifiedTimes.txt', 'w') as file:
+            file.write(json.dumps(lastModifiedTimes))
+
+
+def getSchemaDescWorksheetNames(dbId, wsTitle):
+
+    # Get the dataLayer, dataset and table name from the worksheet
+    # title. The TRG schmea desc spreadsheet only needs to code
+    # worksheets with the datalayer (beacuse there's only one
+    # dataset per datalayer: <dataLayerID>.<tableName>). We default
+    # the datasetID to the dataLayerID
+    # The ETL worksheet names are:
+    # <dataLayerID>.<datasetID>.<tableName>
+    if dbId == 'TRG':
+        dataLayerID = wsTitle[0:wsTitle.find('.')]
+        dsID = dataLayerID
+        tableName = wsTitle[wsTitle.rfind('.')+1:]
+    elif dbId == 'ETL':
+        dataLayerID = wsTitle[0:wsTitle.find('.')]
+        dsID = wsTitle[wsTitle.find('.')+1:wsTitle.rfind('.')]
+        tableName = wsTitle[wsTitle.rfind('.')+1:]
+
+    return dataLayerID, dsID, tableName
+
+
+def getTableSchemaFromWorksheet(conf, dbId, dataLayerID, tableName,
+                                colSchemaDescsFromWS):
+
+    # Create a new table schema description
+
+    # For the EXT layer, some data sources can provide us with table
+    # name incompatible with Postgres (e.g. worksheet names in Excel/
+    # GSheets). The table names in EXT schema description GSheet needs
+    # to match source exactly, otherwise the default extract won't run
+    # (and, of course, if autoPopulateExtSchemaDescGsheets() has been
+    # used, then then the table names will match by default). This
+    # leaves us with a problem, because we can't then use these table
+    # names in our Postgres EXT layer. So use a cleanTableName function
+    # and store along with the src table name
+
+    if dataLayerID == 'EXT':
+        cleanedTableName = cleanTableName(tableName)
+    else:
+        cleanedTableName = ''
+
+    tableSchema = {
+        'tableName': tableName,
+        'cleanTableName': cleanedTableName,
+        'schema': conf.DWH_DATABASES_DETAILS[dbId]['schema'],
+        'columnSchemas': {}
+    }
+
+    # Pull out the column schema descriptions from the Google
+    # worksheeet and restructure a little
+    for colSchemaDescFromWS in colSchemaDescsFromWS:
+        colName = colSchemaDescFromWS['Column Name']
+        fkDimension = 'None'
+        if 'FK Dimension' in colSchemaDescFromWS:
+            fkDimension = colSchemaDescFromWS['FK Dimension']
+
+        # append this column schema desc to our tableSchema object
+        tableSchema['columnSchemas'][colName] = {
+            'schema':  conf.DWH_DATABASES_DETAILS[dbId]['schema'],
+            'tableName':   tableName,
+            'columnName':  colName,
+            'dataType':    colSchemaDescFromWS['Data Type'],
+            'columnType':  colSchemaDescFromWS['Column Type'],
+            'fkDimension': fkDimension
+        }
 
-        conf.log('logRefreshingSchemaDescsTxtFilesFromGsheetsEnd')
+    return tableSchema
 
 
 ########################
@@ -1,27 +1,79 @@
+import logging
+import os
 import pytest
 
 import betl
-from betl.conf.utils import processArgs
-from betl.conf import Conf
-from betl.logger import Logger
+from betl.ConfClass import Conf
 
 
-@pytest.fixture(scope='session', autouse=True)
+@pytest.fixture(scope='session')
 def standardSetup(standardSetupParams):
     return betl.setupBetl(standardSetupParams)
 
 
-@pytest.fixture(scope='session')
-def conf(standardSetupParams, standardRunTimeParams, standardScheduleConfig):
-    conf = Conf(
-        appConfigFile=standardSetupParams['appRootPath'] + '/appConfig.ini',
-        runTimeParams=processArgs(standardRunTimeParams),
-        scheduleConfig=standardScheduleConfig)
-    Logger.initialiseLogging(
-        logLevel=CONF.LOG_LEVEL,
-        logPath=CONF.LOG_PATH,
-        auditCols=CONF.AUDIT_COLS)
-    return conf
+@pytest.fixture
+def conf(tmp_path, standardScheduleConfig):
+
+    # A Conf for an app in tmp_path, with no source systems or schema
+    # descriptions. Nothing in it connects to a database or to Google until
+    # it's used, so tests that don't need them can run anywhere
+    appDirectory = str(tmp_path) + '/'
+    for dirName in ['tmp_data/EXT', 'reports', 'logs', 'schema']:
+        os.makedirs(appDirectory + dirName)
+
+    dbDetails = {
+        'HOST': 'localhost',
+        'DBNAME': 'tst_etl',
+        'USER': 'betl',
+        'PASSWORD': '',
+        'SCHEMA': 'public'}
+
+    conf = Conf({
+        'appDirectory': appDirectory,
+        'appConfig': {
+            'ctrl': {
+                'DWH_ID': 'TST',
+                'BULK_OR_DELTA': 'BULK',
+                # The flags are bool()ed, so empty means False
+                'RUN_EXTRACT': 'Y',
+                'RUN_TRANSFORM': 'Y',
+                'RUN_LOAD': 'Y',
+                'RUN_DM_LOAD': 'Y',
+                'RUN_FT_LOAD': 'Y',
+                'RUN_SUMMARISE': 'Y',
+                'RUN_DATAFLOWS': 'Y',
+                'DEFAULT_DM_DATE': '',
+                'DEFAULT_DM_AUDIT': '',
+                'LOG_LEVEL': 'ERROR',
+                'SKIP_WARNINGS': 'Y',
+                'WRITE_TO_ETL_DB': '',
+                'RUN_TESTS': '',
+                'TMP_DATA_PATH': 'tmp_data',
+                'REPORTS_PATH': 'reports',
+                'LOG_PATH': 'logs',
+                'SCHEMA_PATH': 'schema'},
+            'data': {
+                'GSHEETS_API_KEY_FILE': 'api_key.json',
+                'schema_descs': {},
+                'mdm': {'FILENAME': 'TST - Master Data Mappings'},
+                'dwh_dbs': {
+                    'ETL': dbDetails,
+                    'TRG': dict(dbDetails, DBNAME='tst_trg')},
+                'src_sys': {}}},
+        'scheduleConfig': standardScheduleConfig,
+        'isAdmin': False,
+        'isAirflow': False})
+    conf.constructLogicalDWHSchemas()
+    conf.STAGE = 'EXTRACT'
+
+    yield conf
+
+    # The logger adds a file handler (for this test's log file) to the
+    # shared JOB_LOG logger
+    jobLog = logging.getLogger('JOB_LOG')
+    for handler in list(jobLog.handlers):
+        jobLog.removeHandler(handler)
+        handler.close()
 
 
 @pytest.fixture(scope='session')
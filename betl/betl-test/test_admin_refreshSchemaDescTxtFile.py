@@ -0,0 +1,111 @@
+import json
+import pytest
+
+from betl import admin
+from betl.io import gsheetClient
+from betl.io import GsheetDatastore
+
+HEADER = ['Column Name', 'Data Type', 'Column Type']
+
+
+@pytest.fixture
+def backend():
+    return gsheetClient.FakeGsheetBackend({'schema_etl': {
+        'README': [['Notes']],
+        'EXT.SRC.tbl_a': [HEADER, ['id', 'INTEGER', 'Natural key']],
+        'EXT.SRC.tbl_b': [HEADER, ['code', 'TEXT', 'Natural key']],
+        'EXT.SRC.tbl_c': [HEADER, ['name', 'TEXT', 'Attribute']]}})
+
+
+@pytest.fixture
+def schemaConf(conf, backend, tmp_path, monkeypatch):
+
+    client = gsheetClient.GsheetClient(backend,
+                                       requestsPerMinute=6000,
+                                       sleep=lambda seconds: None)
+
+    # A new datastore each time, as each run of the app gets
+    def getSchemaDescDatastore(dbId):
+        return GsheetDatastore(ssID='ETL',
+                               apiScope=None,
+                               apiKey=None,
+                               filename='schema_etl',
+                               isSchemaDesc=True,
+                               client=client)
+
+    monkeypatch.setattr(conf, 'getSchemaDescDatastore',
+                        getSchemaDescDatastore)
+    monkeypatch.setattr(conf, 'SCHEMA_PATH', str(tmp_path))
+
+    return conf
+
+
+@pytest.fixture
+def rebuiltWorksheets(monkeypatch):
+
+    # The worksheets whose table schemas are rebuilt (not reused)
+    rebuilt = []
+    getTableSchemaFromWorksheet = admin.getTableSchemaFromWorksheet
+
+    def recordRebuild(conf, dbId, dataLayerID, tableName,
+                      colSchemaDescsFromWS):
+        rebuilt.append(tableName)
+        return getTableSchemaFromWorksheet(
+            conf, dbId, dataLayerID, tableName, colSchemaDescsFromWS)
+
+    monkeypatch.setattr(admin, 'getTableSchemaFromWorksheet', recordRebuild)
+    return rebuilt
+
+
+def readTableSchemas(conf):
+    with open(conf.SCHEMA_PATH + '/dbSchemaDesc_ETL.txt', 'r') as file:
+        dbSchemaDesc = json.loads(file.read())
+    return dbSchemaDesc['EXT']['datasetSchemas']['SRC']['tableSchemas']
+
+
+def test_refreshSchemaDesc_unchangedSpreadsheetIsNotRead(schemaConf, backend,
+                                                         rebuiltWorksheets):
+
+    admin.refreshSchemaDescTxtFileFromGsheet(schemaConf, 'ETL')
+    assert rebuiltWorksheets == ['tbl_a', 'tbl_b', 'tbl_c']
+    backend.calls = []
+    rebuiltWorksheets.clear()
+
+    admin.refreshSchemaDescTxtFileFromGsheet(schemaConf, 'ETL')
+
+    # Just the one request, to get the spreadsheet's version
+    assert backend.calls == ['getSpreadsheetVersion']
+    assert rebuiltWorksheets == []
+    assert sorted(readTableSchemas(schemaConf)) == ['tbl_a', 'tbl_b', 'tbl_c']
+
+
+def test_refreshSchemaDesc_onlyChangedWorksheetIsRebuilt(schemaConf,
+                                                         rebuiltWorksheets):
+
+    admin.refreshSchemaDescTxtFileFromGsheet(schemaConf, 'ETL')
+    schemaConf.getSchemaDescDatastore('ETL').writeWorksheet(
+        'EXT.SRC.tbl_b', [HEADER, ['code', 'VARCHAR(10)', 'Natural key']])
+    rebuiltWorksheets.clear()
+
+    admin.refreshSchemaDescTxtFileFromGsheet(schemaConf, 'ETL')
+
+    tableSchemas = readTableSchemas(schemaConf)
+    assert rebuiltWorksheets == ['tbl_b']
+    assert tableSchemas['tbl_b']['columnSchemas']['code']['dataType'] == \
+        'VARCHAR(10)'
+    assert tableSchemas['tbl_a']['columnSchemas']['id']['dataType'] == \
+        'INTEGER'
+
+
+def test_refreshSchemaDesc_deletedWorksheetIsDropped(schemaConf,
+                                                     rebuiltWorksheets):
+
+    admin.refreshSchemaDescTxtFileFromGsheet(schemaConf, 'ETL')
+    schemaConf.getSchemaDescDatastore('ETL').deleteWorksheets(
+        ['EXT.SRC.tbl_c'])
+    rebuiltWorksheets.clear()
+
+    admin.refreshSchemaDescTxtFileFromGsheet(schemaConf, 'ETL')
+
+    assert rebuiltWorksheets == []
+    assert sorted(readTableSchemas(schemaConf)) == ['tbl_a', 'tbl_b']
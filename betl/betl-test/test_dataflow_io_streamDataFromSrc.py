@@ -0,0 +1,139 @@
+import os
+import pyarrow.parquet as pq
+import pytest
+
+from betl.dataflow import DataFlow
+from betl.io import FileDatastore
+from betl.io import cacheIO
+from betl.io import fileIO
+
+ROWS = 'id,name\n1,a\n2,b\n3,c\n4,d\n5,e\n'
+
+
+@pytest.fixture
+def srcConf(conf, tmp_path, monkeypatch):
+
+    srcPath = str(tmp_path) + '/src/'
+    os.makedirs(srcPath)
+    datastore = FileDatastore(fileSysID='SRC',
+                              path=srcPath,
+                              fileExt='.csv',
+                              delim=',',
+                              quotechar='"',
+                              isSrcSys=True)
+
+    monkeypatch.setattr(conf, 'getSrcSysDatastore',
+                        lambda srcSysID: datastore)
+    monkeypatch.setattr(conf, 'DATA_LIMIT_ROWS', None)
+    monkeypatch.setattr(conf, 'SRC_CACHE_PATH', None)
+
+    return conf
+
+
+def writeSrcFile(conf, content):
+    filePath = conf.getSrcSysDatastore('SRC').getFilePath('src_stream')
+    with open(filePath, 'w') as f:
+        f.write(content)
+
+
+def streamExtract(conf, chunkSize, srcFingerprint=None):
+
+    dfl = DataFlow(desc='test dataflow', conf=conf)
+
+    dfl.streamDataFromSrc(
+        tableName='src_stream',
+        srcSysID='SRC',
+        targetTableName='src_stream',
+        dataLayerID='EXT',
+        chunkSize=chunkSize,
+        desc='Stream the test source to EXT',
+        srcFingerprint=srcFingerprint)
+
+    return fileIO.readDataFromTmpFile(
+        conf=conf,
+        path=conf.TMP_DATA_PATH + '/EXT/',
+        filename='src_stream' + conf.TMP_DATA_FILE_EXT)
+
+
+@pytest.mark.parametrize("chunkSize", [1, 2, 5, 100])
+def test_streamDataFromSrc_firstChunkReplaces(srcConf, chunkSize):
+
+    writeSrcFile(srcConf, ROWS)
+
+    streamExtract(srcConf, chunkSize)
+    # A second extract must replace the first, not append to it
+    df = streamExtract(srcConf, chunkSize)
+
+    assert df['id'].tolist() == ['1', '2', '3', '4', '5']
+    assert df['audit_source_system'].tolist() == ['SRC'] * 5
+
+
+@pytest.mark.parametrize("tmpDataFormat", ['PARQUET', 'ARROW'])
+def test_streamDataFromSrc_columnarTmpData(srcConf, monkeypatch,
+                                           tmpDataFormat):
+
+    monkeypatch.setattr(srcConf, 'TMP_DATA_FORMAT', tmpDataFormat)
+    monkeypatch.setattr(srcConf, 'TMP_DATA_FILE_EXT',
+                        fileIO.TMP_DATA_FILE_EXTS[tmpDataFormat])
+    writeSrcFile(srcConf, ROWS)
+
+    streamExtract(srcConf, 2)
+    df = streamExtract(srcConf, 2)
+
+    assert df['id'].tolist() == ['1', '2', '3', '4', '5']
+    assert df['audit_source_system'].tolist() == ['SRC'] * 5
+    if tmpDataFormat == 'PARQUET':
+        # One file, written once, with a row group per chunk
+        filePath = srcConf.TMP_DATA_PATH + '/EXT/' + \
+            srcConf.FILE_NAME_MAP['src_stream.parquet']
+        assert pq.ParquetFile(filePath).num_row_groups == 3
+
+
+def test_streamDataFromSrc_emptySource(srcConf):
+
+    writeSrcFile(srcConf, ROWS)
+    streamExtract(srcConf, 2)
+
+    writeSrcFile(srcConf, 'id,name\n')
+    df = streamExtract(srcConf, 2)
+
+    assert len(df) == 0
+    assert list(df.columns)[0:2] == ['id', 'name']
+
+
+def test_streamDataFromSrc_warmCache(srcConf, tmp_path, monkeypatch):
+
+    monkeypatch.setattr(srcConf, 'SRC_CACHE_PATH', str(tmp_path) + '/cache')
+    writeSrcFile(srcConf, ROWS)
+
+    # The first extract fills the cache as it streams
+    streamExtract(srcConf, 2)
+    assert len(os.listdir(srcConf.SRC_CACHE_PATH)) == 1
+
+    def readSrcFile(*args, **kwargs):
+        raise AssertionError('Source file parsed despite a warm cache')
+    monkeypatch.setattr(fileIO, 'readDataFromCsvInChunks', readSrcFile)
+
+    df = streamExtract(srcConf, 2)
+
+    assert df['id'].tolist() == ['1', '2', '3', '4', '5']
+    assert df['name'].tolist() == ['a', 'b', 'c', 'd', 'e']
+
+
+def test_streamDataFromSrc_reusesCallersFingerprint(srcConf, tmp_path,
+                                                    monkeypatch):
+
+    monkeypatch.setattr(srcConf, 'SRC_CACHE_PATH', str(tmp_path) + '/cache')
+    writeSrcFile(srcConf, ROWS)
+    fingerprint = cacheIO.getFileFingerprint(
+        srcConf.getSrcSysDatastore('SRC').getFilePath('src_stream'))
+
+    def getFileFingerprint(filePath):
+        raise AssertionError('Source file hashed twice')
+    monkeypatch.setattr(cacheIO, 'getFileFingerprint', getFileFingerprint)
+
+    streamExtract(srcConf, 2, srcFingerprint=fingerprint)
+    df = streamExtract(srcConf, 2, srcFingerprint=fingerprint)
+
+    assert len(os.listdir(srcConf.SRC_CACHE_PATH)) == 1
+    assert df['id'].tolist() == ['1', '2', '3', '4', '5']
@@ -0,0 +1,143 @@
+import os
+import pandas as pd
+
+from betl.io import cacheIO
+
+
+def test_cacheIO_fingerprintChangesWithContent(tmp_path):
+
+    filePath = str(tmp_path) + '/src.csv'
+    with open(filePath, 'w') as f:
+        f.write('a,b\n1,2\n')
+    fingerprint = cacheIO.getFileFingerprint(filePath)
+    mtime = os.stat(filePath).st_mtime_ns
+
+    with open(filePath, 'w') as f:
+        f.write('a,b\n1,3\n')
+    # Same size and mtime, different content
+    os.utime(filePath, ns=(mtime, mtime))
+
+    assert cacheIO.getFileFingerprint(filePath) != fingerprint
+
+
+def test_cacheIO_fingerprintHashesOnlyIfStatChanges(tmp_path, monkeypatch):
+
+    filePath = str(tmp_path) + '/src.csv'
+    with open(filePath, 'w') as f:
+        f.write('a,b\n1,2\n')
+    fingerprint = cacheIO.getFileFingerprint(filePath)
+    stat = os.stat(filePath)
+
+    hashes = []
+    sha256 = cacheIO.hashlib.sha256
+
+    def countingSha256():
+        hashes.append(filePath)
+        return sha256()
+
+    monkeypatch.setattr(cacheIO.hashlib, 'sha256', countingSha256)
+
+    # Unchanged, so last time's hash is reused
+    assert cacheIO.getFileFingerprint(filePath, [fingerprint]) == fingerprint
+    assert len(hashes) == 0
+
+    # Touched, so we hash it again, but the content hasn't changed
+    os.utime(filePath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    touchedFingerprint = cacheIO.getFileFingerprint(filePath, [fingerprint])
+    assert len(hashes) == 1
+    assert touchedFingerprint['hash'] == fingerprint['hash']
+    assert touchedFingerprint['mtime'] != fingerprint['mtime']
+
+
+def test_cacheIO_roundTrip(tmp_path):
+
+    cachePath = str(tmp_path) + '/cache'
+    df = pd.DataFrame({'a': pd.Series([1, None], dtype=object),
+                       'b': ['x', 2]})
+
+    assert cacheIO.readCachedData(cachePath, 'key') is None
+    writtenDf = cacheIO.writeCachedData(cachePath, 'key', df, 30, 1024)
+    cachedDf = cacheIO.readCachedData(cachePath, 'key')
+
+    assert list(cachedDf.columns) == ['a', 'b']
+    assert cachedDf['a'].tolist() == [1, None]
+    assert cachedDf['b'].tolist() == ['x', '2']
+    # A cache miss carries on with the same data a hit would give
+    assert writtenDf.equals(cachedDf)
+    assert writtenDf.dtypes.equals(cachedDf.dtypes)
+
+
+def test_cacheIO_evictsLeastRecentlyUsed(tmp_path):
+
+    cachePath = str(tmp_path) + '/cache'
+    df = pd.DataFrame({'a': range(1000)})
+
+    cacheIO.writeCachedData(cachePath, 'old', df, 30, 1024)
+    os.utime(cachePath + '/old' + cacheIO.CACHE_FILE_EXT, (0, 0))
+    entrySizeMB = os.path.getsize(
+        cachePath + '/old' + cacheIO.CACHE_FILE_EXT) / 1024 / 1024
+    cacheIO.writeCachedData(cachePath, 'new', df, 10000000, entrySizeMB * 1.5)
+
+    assert cacheIO.readCachedData(cachePath, 'old') is None
+    assert cacheIO.readCachedData(cachePath, 'new') is not None
+
+
+def test_cacheIO_extractState(tmp_path):
+
+    statePath = str(tmp_path) + '/extract_state'
+    state = {'fingerprint': [1, 2, 3], 'dataLimitRows': None}
+
+    assert cacheIO.readExtractState(statePath, 'SRC.table') is None
+    cacheIO.writeExtractState(statePath, 'SRC.table', state)
+
+    assert cacheIO.readExtractState(statePath, 'SRC.table') == state
+
+
+def test_cacheIO_jsonCacheEvictsOnlyJsonFiles(tmp_path):
+
+    cachePath = str(tmp_path) + '/cache'
+    values = [['a', 'b'], ['1', '2']]
+
+    assert cacheIO.readCachedJson(cachePath, 'key') is None
+    cacheIO.writeCachedJson(cachePath, 'key', values, None, 1024)
+    assert cacheIO.readCachedJson(cachePath, 'key') == values
+
+    with open(cachePath + '/other.parquet', 'w') as f:
+        f.write('x')
+    cacheIO.writeCachedJson(cachePath, 'key2', values, None, 0)
+
+    assert cacheIO.readCachedJson(cachePath, 'key') is None
+    assert os.path.exists(cachePath + '/other.parquet')
+
+
+def test_cacheIO_chunkedRoundTrip(tmp_path):
+
+    cachePath = str(tmp_path) + '/cache'
+    writer = cacheIO.CachedDataWriter(cachePath, 'key', 30, 1024)
+    writtenChunks = [
+        writer.write(pd.DataFrame({'a': ['1', '2'], 'b': ['x', 2]})),
+        writer.write(pd.DataFrame({'a': ['3'], 'b': ['z']}))]
+
+    # Nothing is readable until the writer is closed
+    assert cacheIO.readCachedDataInChunks(cachePath, 'key', 2) is None
+    writer.close()
+
+    chunks = list(cacheIO.readCachedDataInChunks(cachePath, 'key', 2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert pd.concat(chunks)['a'].tolist() == ['1', '2', '3']
+    assert pd.concat(chunks)['b'].tolist() == ['x', '2', 'z']
+    for writtenChunk, chunk in zip(writtenChunks, chunks):
+        assert writtenChunk.equals(chunk)
+
+
+def test_cacheIO_chunkedWriteAbandonedOnTypeChange(tmp_path):
+
+    cachePath = str(tmp_path) + '/cache'
+    writer = cacheIO.CachedDataWriter(cachePath, 'key', 30, 1024)
+    writer.write(pd.DataFrame({'a': [1, 2]}))
+    writer.write(pd.DataFrame({'a': ['x']}))
+    writer.close()
+
+    assert cacheIO.readCachedDataInChunks(cachePath, 'key', 2) is None
+    assert os.listdir(cachePath) == []
@@ -0,0 +1,131 @@
+import pytest
+import struct
+import pandas as pd
+
+from betl.io import dbIO
+
+
+def readBinaryCopy(data):
+    # Decode a binary COPY stream back into rows of raw field bytes
+    assert data.startswith(dbIO.BINARY_COPY_HEADER)
+    pos = len(dbIO.BINARY_COPY_HEADER)
+    rows = []
+    while True:
+        (fieldCount,) = struct.unpack('!h', data[pos:pos + 2])
+        pos += 2
+        if fieldCount == -1:
+            break
+        row = []
+        for i in range(fieldCount):
+            (length,) = struct.unpack('!i', data[pos:pos + 4])
+            pos += 4
+            if length == -1:
+                row.append(None)
+            else:
+                row.append(data[pos:pos + length])
+                pos += length
+        rows.append(row)
+    assert pos == len(data)
+    return rows
+
+
+@pytest.mark.parametrize("pipelined", [(False), (True)])
+def test_binaryCopyStream(pipelined):
+
+    df = pd.DataFrame({
+        'sk': ['1', '-1', ''],
+        'name': ['a', '', 'é'],
+        'load_date': ['2000-01-02', '1999-12-31', None]})
+    binaryTypes = dbIO.getBinaryCopyTypes(
+        list(df.columns),
+        {'sk': 'INTEGER', 'name': 'TEXT', 'load_date': 'DATE'})
+
+    copyStream = dbIO.DataFrameBinaryCopyStream(
+        df, 2, binaryTypes, True, pipelined)
+    rows = readBinaryCopy(copyStream.read())
+    copyStream.close()
+
+    assert rows == [
+        [struct.pack('!i', 1), b'a', struct.pack('!i', 1)],
+        [struct.pack('!i', -1), None, struct.pack('!i', -1)],
+        [None, 'é'.encode('utf-8'), None]]
+
+
+def test_getBinaryCopyTypes_unsupportedType():
+
+    assert dbIO.getBinaryCopyTypes(
+        ['amount'], {'amount': 'NUMERIC(10,2)'}) is None
+    assert dbIO.getBinaryCopyTypes(['amount'], {}) is None
+
+
+@pytest.mark.parametrize("values", [
+    (['9007199254740993', '']),  # As read from CSV temp data
+    (pd.Series([9007199254740993, None], dtype='Int64')),
+    (pd.Series([9007199254740993, None], dtype=object))])
+def test_encodeBinaryCopyColumn_int8WithNullsKeepsPrecision(values):
+
+    fields = dbIO.encodeBinaryCopyColumn(pd.Series(values), 'INT8', True)
+
+    assert fields == [
+        struct.pack('!i', 8) + struct.pack('!q', 9007199254740993),
+        dbIO.BINARY_COPY_NULL]
+
+
+class FakeCopyCursor():
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def copy_expert(self, sql, copyStream, size):
+        self.connection.sqls.append(sql)
+        while len(copyStream.read(size)) > 0:
+            pass
+
+    def close(self):
+        pass
+
+
+class FakeCopyDatastore():
+
+    def __init__(self):
+        self.sqls = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def getConnection(self):
+        return self
+
+    def releaseConnection(self, conn):
+        pass
+
+    def cursor(self):
+        return FakeCopyCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.mark.parametrize("pipelined", [(False), (True)])
+@pytest.mark.parametrize("timestamps", [
+    (pd.Series(pd.to_datetime(['2000-01-02 10:00'])).dt.tz_localize('UTC')),
+    (['2000-01-02', '02/01/2000 10:00'])])
+def test_writeDataToDB_unencodableFallsBackToCsv(pipelined, timestamps):
+
+    df = pd.DataFrame({'id': ['1'] * len(timestamps),
+                       'load_ts': timestamps})
+    dataStore = FakeCopyDatastore()
+
+    copyStats = dbIO.writeDataToDB(
+        df, 'tbl', dataStore, 'append',
+        pipelined=pipelined,
+        copyFormat='BINARY',
+        colDataTypes={'id': 'INTEGER', 'load_ts': 'TIMESTAMP'})
+
+    assert "FORMAT 'binary'" in dataStore.sqls[0]
+    assert "FORMAT 'csv'" in dataStore.sqls[1]
+    assert dataStore.rollbacks == 1
+    assert dataStore.commits == 1
+    assert copyStats['rows'] == len(df)
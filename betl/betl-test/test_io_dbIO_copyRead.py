@@ -0,0 +1,86 @@
+import datetime
+import pytest
+import pandas as pd
+import tempfile
+
+from betl.io import dbIO
+
+
+def makeCopyBuffer(copyOutput):
+    copyBuffer = tempfile.SpooledTemporaryFile()
+    copyBuffer.write(copyOutput)
+    copyBuffer.seek(0)
+    return copyBuffer
+
+
+def test_readCopyBuffer():
+
+    df = dbIO.readCopyBuffer(
+        makeCopyBuffer(b'nk,name\n007,""\n,"multi\nline"\n'))
+
+    assert list(df.columns) == ['nk', 'name']
+    assert df['nk'].tolist()[0] == '007'
+    assert df['nk'].isnull().tolist() == [False, True]
+    assert df['name'].tolist() == ['', 'multi\nline']
+
+
+@pytest.mark.parametrize("copyOutput, chunkSize, expectedChunkLengths", [
+    (b'nk\n' + b'1\n' * 5, 2, [2, 2, 1]),
+    (b'nk\n' + b'1\n' * 4, 2, [2, 2]),
+    (b'nk\n', 2, [0])])
+def test_readCopyBufferInChunks(copyOutput, chunkSize, expectedChunkLengths):
+
+    chunks = list(dbIO.readCopyBufferInChunks(
+        makeCopyBuffer(copyOutput), chunkSize))
+
+    assert [len(chunk) for chunk in chunks] == expectedChunkLengths
+    assert all(list(chunk.columns) == ['nk'] for chunk in chunks)
+
+
+class FakeDescribeConn():
+
+    # Gives a cursor whose description is that of a (planned) query
+    def __init__(self, description):
+        self.description = description
+        self.sql = None
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        self.sql = sql
+
+    def close(self):
+        pass
+
+
+def test_readCopyBuffer_typedAsReadSql():
+
+    conn = FakeDescribeConn([('id', 23), ('amount', 1700), ('active', 16),
+                             ('day', 1082), ('at', 1114), ('name', 25)])
+    colTypes = dbIO.getQueryColumnTypes('SELECT * FROM t LIMIT 5', conn)
+
+    df = dbIO.readCopyBuffer(
+        makeCopyBuffer(b'id,amount,active,day,at,name\n' +
+                       b'1,2.50,t,2020-01-02,2020-01-02 03:04:05,007\n' +
+                       b'2,,f,,,""\n'),
+        colTypes)
+
+    assert conn.sql == 'SELECT * FROM (SELECT * FROM t LIMIT 5) AS q LIMIT 0'
+    assert df['id'].dtype == 'int64'
+    assert df['id'].tolist() == [1, 2]
+    assert df['amount'].dtype == 'float64'
+    assert df['active'].tolist() == [True, False]
+    assert df['day'].tolist()[0] == datetime.date(2020, 1, 2)
+    assert pd.api.types.is_datetime64_any_dtype(df['at'])
+    assert df['at'].isnull().tolist() == [False, True]
+    assert df['name'].tolist() == ['007', '']
+
+
+def test_readCopyBufferInChunks_typedWhenEmpty():
+
+    chunks = list(dbIO.readCopyBufferInChunks(
+        makeCopyBuffer(b'id\n'), 2, {'id': dbIO.POSTGRES_COPY_READ_TYPES[20]}))
+
+    assert len(chunks) == 1
+    assert chunks[0]['id'].dtype == 'int64'
@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from betl.io import dbIO
+
+
+def readCsvCopy(text, nullMarker):
+    # Parse the CSV COPY text as Postgres would: an unquoted value that
+    # equals the NULL string is NULL, a quoted one never is
+    rows = []
+    row = []
+    value = ''
+    quoted = False
+    inQuotes = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if inQuotes:
+            if char == '"' and text[i + 1:i + 2] == '"':
+                value += '"'
+                i += 1
+            elif char == '"':
+                inQuotes = False
+            else:
+                value += char
+        elif char == '"':
+            inQuotes = True
+            quoted = True
+        elif char in (',', '\n'):
+            row.append(None if not quoted and value == nullMarker else value)
+            value = ''
+            quoted = False
+            if char == '\n':
+                rows.append(row)
+                row = []
+        else:
+            value += char
+        i += 1
+    assert value == '' and row == []
+    return rows
+
+
+def copyText(df, nullMarker, pipelined):
+    copyStream = dbIO.DataFrameCopyStream(df, 2, nullMarker, pipelined)
+    text = copyStream.read()
+    copyStream.close()
+    return text
+
+
+@pytest.mark.parametrize("pipelined", [(False), (True)])
+def test_csvCopyStream_emptyStringToNull(pipelined):
+
+    df = pd.DataFrame({
+        'id': ['1', '2', '3'],
+        'name': ['', np.nan, 'a,"b"\nc']})
+
+    assert readCsvCopy(copyText(df, '', pipelined), '') == [
+        ['1', None], ['2', None], ['3', 'a,"b"\nc']]
+    # In a one-column table too
+    assert readCsvCopy(copyText(df[['name']], '', pipelined), '') == [
+        [None], [None], ['a,"b"\nc']]
+
+
+@pytest.mark.parametrize("pipelined", [(False), (True)])
+def test_csvCopyStream_nullMarkerDoesNotCollide(pipelined):
+
+    marker = dbIO.COPY_NULL_MARKER
+    df = pd.DataFrame({
+        'id': ['1', '2', '3'],
+        'name': ['', np.nan, marker]})
+
+    assert readCsvCopy(copyText(df, marker, pipelined), marker) == [
+        ['1', ''], ['2', None], ['3', marker]]
+    assert readCsvCopy(copyText(df[['name']], marker, pipelined), marker) == [
+        [''], [None], [marker]]
+
+
+class FakeCopyCursor():
+
+    def copy_expert(self, sql, copyStream, size):
+        while len(copyStream.read(size)) > 0:
+            pass
+
+    def close(self):
+        pass
+
+
+class FakeCopyDatastore():
+
+    def __init__(self):
+        self.commits = 0
+        self.checkedOut = 0
+
+    def getConnection(self):
+        self.checkedOut += 1
+        return self
+
+    def releaseConnection(self, conn):
+        self.checkedOut -= 1
+
+    def cursor(self):
+        return FakeCopyCursor()
+
+    def commit(self):
+        self.commits += 1
+
+
+@pytest.mark.parametrize("pipelined", [(False), (True)])
+def test_writeDataToDB_countsEncodedBytes(pipelined):
+
+    df = pd.DataFrame({'id': ['1', '2'], 'name': ['é', 'ab']})
+    dataStore = FakeCopyDatastore()
+
+    copyStats = dbIO.writeDataToDB(df, 'tbl', dataStore, 'append',
+                                   pipelined=pipelined)
+
+    assert copyStats['rows'] == 2
+    assert copyStats['bytes'] == len('1,é\n2,ab\n'.encode('utf-8'))
+    assert dataStore.commits == 1
+    assert dataStore.checkedOut == 0
+
+
+class Unserialisable():
+
+    def __str__(self):
+        raise ValueError('Cannot serialise')
+
+
+@pytest.mark.parametrize("pipelined", [(False), (True)])
+def test_writeDataToDB_serialiseErrorReachesCaller(pipelined):
+
+    # The bad value is in a later batch, so (if pipelined) the producer
+    # thread fails while COPY is already reading
+    df = pd.DataFrame({'name': ['a', 'b', Unserialisable()]})
+    dataStore = FakeCopyDatastore()
+
+    with pytest.raises(ValueError, match='Cannot serialise'):
+        dbIO.writeDataToDB(df, 'tbl', dataStore, 'append',
+                           batchSize=1,
+                           pipelined=pipelined)
+    assert dataStore.commits == 0
+    # The connection still goes back to the pool
+    assert dataStore.checkedOut == 0
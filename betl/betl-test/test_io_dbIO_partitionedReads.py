@@ -0,0 +1,18 @@
+import pytest
+
+from betl.io import dbIO
+
+
+@pytest.mark.parametrize("minValue, maxValue, numPartitions, expected", [
+    (1, 100, 4, ['(id < 26 OR id IS NULL)',
+                 'id >= 26 AND id < 51',
+                 'id >= 51 AND id < 76',
+                 'id >= 76']),
+    (1, 2, 4, ['(id < 2 OR id IS NULL)',
+               'id >= 2']),
+    (1, 100, 1, ['TRUE'])])
+def test_getPartitionWhereClauses(minValue, maxValue, numPartitions,
+                                  expected):
+
+    assert dbIO.getPartitionWhereClauses(
+        'id', minValue, maxValue, numPartitions) == expected
@@ -0,0 +1,49 @@
+import pytest
+
+from betl.io import dbIO
+from betl.io import SqliteDatastore
+
+
+@pytest.fixture
+def sqliteSrc(tmp_path):
+    datastore = SqliteDatastore(dbId='SRC',
+                                path=str(tmp_path) + '/',
+                                filename='src.db',
+                                isSrcSys=True)
+    cursor = datastore.cursor()
+    cursor.execute('CREATE TABLE src_tbl (id INTEGER, name TEXT)')
+    cursor.execute('CREATE TABLE src_empty (id INTEGER, name TEXT)')
+    cursor.executemany('INSERT INTO src_tbl VALUES (?, ?)',
+                       [(i, 'name' + str(i)) for i in range(5)])
+    datastore.commit()
+    return datastore
+
+
+@pytest.mark.parametrize("chunkSize, limitdata, chunkLengths", [
+    (2, None, [2, 2, 1]),
+    (5, None, [5]),
+    (100, None, [5]),
+    (2, 3, [2, 1]),
+])
+def test_readDataFromDBInChunks_sqlite(sqliteSrc, chunkSize, limitdata,
+                                       chunkLengths):
+
+    chunks = list(dbIO.readDataFromDBInChunks(tableName='src_tbl',
+                                              dataStore=sqliteSrc,
+                                              chunkSize=chunkSize,
+                                              limitdata=limitdata))
+
+    assert [len(chunk) for chunk in chunks] == chunkLengths
+    assert [i for chunk in chunks for i in chunk['id'].tolist()] == \
+        list(range(sum(chunkLengths)))
+
+
+def test_readDataFromDBInChunks_emptyTableKeepsColumns(sqliteSrc):
+
+    chunks = list(dbIO.readDataFromDBInChunks(tableName='src_empty',
+                                              dataStore=sqliteSrc,
+                                              chunkSize=2))
+
+    assert len(chunks) == 1
+    assert len(chunks[0]) == 0
+    assert list(chunks[0].columns) == ['id', 'name']
@@ -0,0 +1,53 @@
+import pytest
+
+from betl.io import dbIO
+
+
+class FakeSequenceDatastore():
+
+    # Runs the reservation's setval(seq, nextval(seq) + count - 1) against
+    # an in-memory sequence
+
+    def __init__(self, lastValue):
+        self.lastValue = lastValue
+        self.params = None
+        self.committed = False
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params):
+        self.params = params
+        self.lastValue = self.lastValue + 1 + params['count'] - 1
+
+    def fetchone(self):
+        return (self.lastValue,)
+
+    def commit(self):
+        self.committed = True
+
+
+@pytest.mark.parametrize("schema, expectedTable", [
+    (None, 'dm_a'),
+    ('bse', 'bse.dm_a')])
+def test_reserveSequenceValues_reservesConsecutiveRanges(schema,
+                                                         expectedTable):
+
+    datastore = FakeSequenceDatastore(lastValue=0)
+
+    first = dbIO.reserveSequenceValues('dm_a', 'a_id', 3, datastore, schema)
+    second = dbIO.reserveSequenceValues('dm_a', 'a_id', 2, datastore, schema)
+
+    assert (first, second) == (1, 4)
+    assert datastore.params == {'table': expectedTable, 'col': 'a_id',
+                                'count': 2}
+    assert datastore.committed
+
+
+def test_reserveSequenceValues_nothingToReserve():
+
+    datastore = FakeSequenceDatastore(lastValue=0)
+
+    assert dbIO.reserveSequenceValues(
+        'dm_a', 'a_id', 0, datastore, None) is None
+    assert datastore.params is None
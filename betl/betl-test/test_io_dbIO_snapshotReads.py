@@ -0,0 +1,111 @@
+import pandas as pd
+import pytest
+
+from betl.io import dbIO
+
+
+class FakeCursor():
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        self.conn.statements.append((sql, params))
+
+    def fetchone(self):
+        return ('snapshot-1',)
+
+    def close(self):
+        pass
+
+
+class FakeConnection():
+
+    def __init__(self):
+        self.session = None
+        self.statements = []
+
+    def set_session(self, **kwargs):
+        self.session = kwargs
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakeDatastore():
+
+    def __init__(self):
+        self.conns = []
+        self.released = []
+
+    def getConnection(self, readonly=False):
+        assert readonly
+        self.conns.append(FakeConnection())
+        return self.conns[-1]
+
+    def releaseConnection(self, conn):
+        self.released.append(conn)
+
+
+@pytest.fixture
+def tableReads(monkeypatch):
+
+    # The connection each table was read on
+    tableReads = {}
+
+    def readDataFromDB(tableName, dataStore, cols, limitdata, conn):
+        if tableName == 'bad_tbl':
+            raise ValueError('Failed to read ' + tableName)
+        tableReads[tableName] = conn
+        return pd.DataFrame({'tableName': [tableName]})
+
+    monkeypatch.setattr(dbIO, 'readDataFromDB', readDataFromDB)
+    return tableReads
+
+
+@pytest.mark.parametrize("numConnections", [1, 2, 5])
+def test_readDataFromDBWithSnapshot(tableReads, numConnections):
+
+    datastore = FakeDatastore()
+    tableNames = ['tbl_' + str(i) for i in range(4)]
+
+    dfs = dict(dbIO.readDataFromDBWithSnapshot(tableNames=tableNames,
+                                               dataStore=datastore,
+                                               numConnections=numConnections))
+
+    assert sorted(dfs) == tableNames
+    assert dfs['tbl_2']['tableName'].tolist() == ['tbl_2']
+
+    # The snapshot is exported once, in a REPEATABLE READ transaction
+    snapshotConn = datastore.conns[0]
+    assert snapshotConn.session['isolation_level'] == 'REPEATABLE READ'
+    assert snapshotConn.statements == [('SELECT pg_export_snapshot()', None)]
+
+    # Every table is read on a worker connection that has imported it
+    workerConns = datastore.conns[1:]
+    assert 1 <= len(workerConns) <= min(numConnections, len(tableNames))
+    for conn in workerConns:
+        assert conn.session == {'isolation_level': 'REPEATABLE READ',
+                                'readonly': True}
+        assert conn.statements[0] == \
+            ('SET TRANSACTION SNAPSHOT %s', ('snapshot-1',))
+    for tableName in tableNames:
+        assert tableReads[tableName] in workerConns
+
+    assert sorted(map(id, datastore.released)) == \
+        sorted(map(id, datastore.conns))
+
+
+def test_readDataFromDBWithSnapshot_releasesConnectionsOnError(tableReads):
+
+    datastore = FakeDatastore()
+
+    with pytest.raises(ValueError):
+        for tableName, df in dbIO.readDataFromDBWithSnapshot(
+                tableNames=['tbl_0', 'bad_tbl', 'tbl_1'],
+                dataStore=datastore,
+                numConnections=2):
+            pass
+
+    assert sorted(map(id, datastore.released)) == \
+        sorted(map(id, datastore.conns))
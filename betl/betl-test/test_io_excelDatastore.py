@@ -0,0 +1,112 @@
+import pytest
+from types import SimpleNamespace
+from openpyxl import Workbook
+
+from betl.io import excelIO
+from betl.io import ExcelDatastore
+from betl.defaultdataflows import stageExtract
+
+
+def writeWorkbook(tmp_path):
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.title = 'src_tbl'
+    for row in [['id', 'name', 'total'],
+                [1, 'a', '=A2*2'],
+                [2, None, None],
+                [None, None, None],
+                [3, 'after the empty row', None]]:
+        worksheet.append(row)
+    workbook.create_sheet('src_other').append(['code'])
+    workbook.save(str(tmp_path) + '/src.xlsx')
+
+
+def getDatastore(tmp_path):
+    return ExcelDatastore(ssID='SRC',
+                          path=str(tmp_path) + '/',
+                          filename='src.xlsx',
+                          isSrcSys=True)
+
+
+def test_excelDatastore_opensWorkbookWhenNeeded(tmp_path):
+
+    # The file doesn't exist yet, so this would fail if we opened it
+    datastore = getDatastore(tmp_path)
+    assert datastore.workbook is None
+
+    writeWorkbook(tmp_path)
+
+    assert list(datastore.worksheets) == ['src_tbl', 'src_other']
+    assert datastore.conn is datastore.workbook
+    assert datastore.conn.read_only
+
+
+def test_excelDatastore_closeReleasesWorkbook(tmp_path):
+
+    writeWorkbook(tmp_path)
+    datastore = getDatastore(tmp_path)
+    workbook = datastore.conn
+
+    datastore.close()
+
+    assert datastore.workbook is None
+    assert datastore.conn is not workbook
+    assert list(datastore.worksheets) == ['src_tbl', 'src_other']
+
+
+def test_excelDatastore_readsValuesNotFormulas(tmp_path):
+
+    writeWorkbook(tmp_path)
+    datastore = getDatastore(tmp_path)
+
+    df = excelIO.readDataFromWorksheet(datastore.worksheets['src_tbl'])
+
+    assert list(df.columns) == ['id', 'name', 'total']
+    # Stops at the first empty row
+    assert df['id'].tolist() == [1, 2]
+    # openpyxl doesn't calculate formulas, so a workbook it saved has no
+    # values for them. (Excel saves the last calculated values)
+    assert df['total'].tolist() == [None, None]
+
+
+class FailingExtractDataFlow():
+
+    def __init__(self, desc):
+        pass
+
+    def getDataFromSrc(self, srcSysID, **kwargs):
+        raise ValueError('Extract failed')
+
+
+def test_bulkExtract_closesWorkbook(conf, tmp_path, monkeypatch):
+
+    writeWorkbook(tmp_path)
+    datastore = getDatastore(tmp_path)
+    datastore.worksheets
+    conf.SRC_SYSTEMS['SRC'] = datastore
+    monkeypatch.setattr(conf, 'SKIP_UNCHANGED_EXTRACTS', False)
+    monkeypatch.setattr(conf, 'EXTRACT_CHUNK_SIZE', None)
+    monkeypatch.setattr(conf, 'DataFlow', FailingExtractDataFlow,
+                        raising=False)
+    extLayer = SimpleNamespace(datasets={'SRC': SimpleNamespace(
+        tables={'tbl': SimpleNamespace(srcTableName='SRC_src_tbl')})})
+    monkeypatch.setattr(conf, 'getLogicalSchemaDataLayer',
+                        lambda dataLayerID: extLayer)
+
+    # Even if the extract fails
+    with pytest.raises(ValueError, match='Extract failed'):
+        stageExtract.bulkExtract(conf=conf, tableName='tbl', dmId='SRC')
+
+    assert datastore.workbook is None
+
+
+def test_conf_closeDatastoresClosesWorkbooks(conf, tmp_path):
+
+    writeWorkbook(tmp_path)
+    datastore = getDatastore(tmp_path)
+    datastore.worksheets
+    conf.SRC_SYSTEMS['SRC'] = datastore
+
+    conf.closeDatastores()
+
+    assert datastore.workbook is None
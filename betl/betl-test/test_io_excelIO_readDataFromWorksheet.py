@@ -0,0 +1,104 @@
+import pytest
+from openpyxl import Workbook
+from openpyxl import load_workbook
+
+from betl.io import excelIO
+
+ROWS = [['id', 'name', None],
+        [1, 'a', None],
+        [2, None, None],
+        [3, 'c'],
+        [None, None, None],
+        [4, 'after the empty row']]
+
+
+@pytest.fixture
+def workbookPath(tmp_path):
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.title = 'src_tbl'
+    for row in ROWS:
+        worksheet.append(row)
+    workbook.create_sheet('src_empty').append(['id', 'name'])
+    filePath = str(tmp_path) + '/src.xlsx'
+    workbook.save(filePath)
+    return filePath
+
+
+def openWorksheet(filePath, title):
+    return load_workbook(filename=filePath,
+                         read_only=True,
+                         data_only=True)[title]
+
+
+@pytest.mark.parametrize("chunkSize, limitdata, chunkLengths", [
+    (1, None, [1, 1, 1]),
+    (2, None, [2, 1]),
+    (100, None, [3]),
+    (2, 3, [2]),
+])
+def test_readDataFromWorksheetInChunks(workbookPath, chunkSize, limitdata,
+                                       chunkLengths):
+
+    chunks = list(excelIO.readDataFromWorksheetInChunks(
+        openWorksheet(workbookPath, 'src_tbl'), chunkSize, limitdata))
+
+    assert [len(chunk) for chunk in chunks] == chunkLengths
+    for chunk in chunks:
+        assert list(chunk.columns) == ['id', 'name']
+    # Stops at the first empty row
+    assert [i for chunk in chunks for i in chunk['id'].tolist()] == \
+        [1, 2, 3][0:sum(chunkLengths)]
+
+
+def test_readDataFromWorksheetInChunks_emptyWorksheet(workbookPath):
+
+    chunks = list(excelIO.readDataFromWorksheetInChunks(
+        openWorksheet(workbookPath, 'src_empty'), 2))
+
+    assert len(chunks) == 1
+    assert len(chunks[0]) == 0
+    assert list(chunks[0].columns) == ['id', 'name']
+
+
+class RaggedWorksheet():
+
+    # Read-only worksheets can give rows of different lengths
+    def iter_rows(self, min_row, max_row, values_only):
+        rows = [('id', 'name'), (1,), (2, 'b', 'extra'), (3, 'c')]
+        return iter(rows[0:max_row])
+
+
+def test_readDataFromWorksheet_raggedRows():
+
+    df = excelIO.readDataFromWorksheet(RaggedWorksheet())
+
+    # The extra column has no heading, but it's back-filled
+    assert list(df.columns)[0:2] == ['id', 'name']
+    assert len(df.columns) == 3
+    assert df['id'].tolist() == [1, 2, 3]
+    assert df.isnull().values.tolist() == [[False, True, True],
+                                           [False, False, False],
+                                           [False, False, True]]
+    assert df.iloc[1].tolist() == [2, 'b', 'extra']
+
+
+@pytest.mark.parametrize("numProcesses", [1, 2, 4])
+@pytest.mark.parametrize("limitdata", [None, 2])
+def test_readDataFromWorksheetsInParallel_matchesSerialRead(
+        workbookPath, numProcesses, limitdata):
+
+    worksheetTitles = ['src_tbl', 'src_empty']
+
+    dfs = dict(excelIO.readDataFromWorksheetsInParallel(
+        workbookPath,
+        worksheetTitles,
+        numProcesses=numProcesses,
+        limitdata=limitdata))
+
+    assert sorted(dfs) == sorted(worksheetTitles)
+    for worksheetTitle in worksheetTitles:
+        expected = excelIO.readDataFromWorksheet(
+            openWorksheet(workbookPath, worksheetTitle), limitdata)
+        assert dfs[worksheetTitle].equals(expected)
+        assert list(dfs[worksheetTitle].columns) == list(expected.columns)
@@ -0,0 +1,119 @@
+import pytest
+
+from betl.io import fileIO
+
+
+@pytest.fixture
+def csvPath(tmp_path):
+    with open(str(tmp_path) + '/test_src.csv', 'w') as f:
+        f.write('col1,col2\n007,"a,b"\n,"multi\nline"\n')
+    return str(tmp_path) + '/'
+
+
+@pytest.mark.parametrize("engine", [('PANDAS'), ('PYARROW')])
+def test_readDataFromCsv(conf, csvPath, engine):
+
+    df = fileIO.readDataFromCsv(
+        conf=conf,
+        path=csvPath,
+        filename='test_src.csv',
+        isTmpData=False,
+        engine=engine)
+
+    assert list(df.columns) == ['col1', 'col2']
+    assert df['col1'].tolist() == ['007', '']
+    assert df['col2'].tolist() == ['a,b', 'multi\nline']
+
+
+@pytest.mark.parametrize("nrows", [(None), (1), (5)])
+def test_readDataFromCsv_pyarrowPadsShortRowsLikePandas(conf, tmp_path,
+                                                        nrows):
+
+    with open(str(tmp_path) + '/test_src.csv', 'w') as f:
+        f.write('col1,col2,col3\n1,2\n3,4,5\n6\n')
+
+    dfs = [fileIO.readDataFromCsv(conf=conf,
+                                  path=str(tmp_path) + '/',
+                                  filename='test_src.csv',
+                                  isTmpData=False,
+                                  limitdata=nrows,
+                                  engine=engine)
+           for engine in ['PANDAS', 'PYARROW']]
+
+    assert dfs[1].values.tolist() == dfs[0].values.tolist()
+    assert dfs[1].values.tolist()[0] == ['1', '2', '']
+
+
+def test_readCsvHeader_emptyFile(tmp_path):
+
+    filePath = str(tmp_path) + '/test_src.csv'
+    open(filePath, 'w').close()
+
+    assert fileIO.readCsvHeader(filePath, ',', '"') == []
+    assert len(fileIO.readDataFromCsvWithPyarrow(filePath, ',', '"').columns) \
+        == 0
+
+
+# Quoted values with line breaks and delimiters in them, each long enough to
+# straddle the boundary between at least one pair of byte ranges
+PARALLEL_CSV = ('id,val\n' +
+                '1,"' + 'a\n,b' * 20 + '"\n' +
+                '2,plain\n' +
+                '3,"x ""quoted"" \n, value"\n' +
+                '4,"' + '\n' * 30 + '"\n' +
+                '5,')
+
+
+def writeParallelCsv(tmp_path, content):
+    filePath = str(tmp_path) + '/test_parallel.csv'
+    with open(filePath, 'w', newline='') as f:
+        f.write(content)
+    return filePath
+
+
+@pytest.mark.parametrize("numRanges", range(1, 30))
+def test_getCsvByteRanges_splitOnRowBoundaries(tmp_path, numRanges):
+
+    filePath = writeParallelCsv(tmp_path, PARALLEL_CSV)
+    colNames = fileIO.readCsvHeader(filePath, ',', '"')
+
+    byteRanges = fileIO.getCsvByteRanges(filePath, '"', numRanges)
+
+    # The ranges cover the body of the file, in order, with no gaps
+    assert byteRanges[0][0] == len('id,val\n')
+    assert byteRanges[-1][1] == len(PARALLEL_CSV)
+    for previousRange, byteRange in zip(byteRanges, byteRanges[1:]):
+        assert previousRange[1] == byteRange[0]
+
+    dfs = [fileIO.readCsvByteRange(filePath, start, end, colNames, ',', '"')
+           for start, end in byteRanges]
+    # Each range parses to whole rows
+    assert [i for df in dfs for i in df['id'].tolist()] == \
+        ['1', '2', '3', '4', '5']
+
+
+@pytest.mark.parametrize("content", [
+    PARALLEL_CSV,
+    PARALLEL_CSV + '\n',
+    'id,val\n1,a',
+    'id,val\n',
+    'id,val',
+])
+@pytest.mark.parametrize("numProcesses", [1, 3, 50])
+def test_readDataFromCsvInParallel_matchesSerialRead(conf, tmp_path,
+                                                     content, numProcesses):
+
+    filePath = writeParallelCsv(tmp_path, content)
+
+    df = fileIO.readDataFromCsvInParallel(filePath,
+                                          sep=',',
+                                          quotechar='"',
+                                          numProcesses=numProcesses)
+    expected = fileIO.readDataFromCsv(conf=conf,
+                                      path=str(tmp_path) + '/',
+                                      filename='test_parallel.csv',
+                                      isTmpData=False,
+                                      engine='PANDAS')
+
+    assert list(df.columns) == list(expected.columns)
+    assert df.values.tolist() == expected.values.tolist()
@@ -0,0 +1,129 @@
+import os
+import pytest
+import pandas as pd
+
+from betl.io import fileIO
+
+
+@pytest.fixture
+def dataset():
+    return pd.DataFrame(
+        {'col1': ['1', '2'],
+         'col2': ['a', 'b']})
+
+
+@pytest.mark.parametrize("tmpDataFormat", [
+    ('CSV'), ('PARQUET'), ('ARROW')])
+def test_tmpDataRoundTrip(conf, dataset, tmpDataFormat, tmp_path):
+
+    conf.TMP_DATA_FORMAT = tmpDataFormat
+    conf.TMP_DATA_FILE_EXT = fileIO.TMP_DATA_FILE_EXTS[tmpDataFormat]
+    path = str(tmp_path) + '/'
+    filename = 'test_round_trip' + conf.TMP_DATA_FILE_EXT
+
+    fileIO.writeDataToTmpFile(conf, dataset, path, filename, True, 'w')
+    fileIO.writeDataToTmpFile(conf, dataset, path, filename, True, 'a')
+
+    df = fileIO.readDataFromTmpFile(conf, path, filename)
+
+    df_expected = pd.concat([dataset, dataset], ignore_index=True)
+
+    assert df.equals(df_expected)
+
+
+@pytest.mark.parametrize("tmpDataFormat", [
+    ('CSV'), ('PARQUET'), ('ARROW')])
+def test_tmpDataStreamWriter(conf, tmpDataFormat, tmp_path):
+
+    conf.TMP_DATA_FORMAT = tmpDataFormat
+    conf.TMP_DATA_FILE_EXT = fileIO.TMP_DATA_FILE_EXTS[tmpDataFormat]
+    path = str(tmp_path) + '/'
+    filename = 'test_stream' + conf.TMP_DATA_FILE_EXT
+
+    writer = fileIO.TmpDataStreamWriter(conf, path, filename)
+    # col2 has no values in the first chunk, so it has no type yet
+    writer.write(pd.DataFrame({'col1': ['1', '2'], 'col2': [None, None]}))
+    writer.write(pd.DataFrame({'col1': ['3'], 'col2': ['c']}))
+    writer.close()
+
+    df = fileIO.readDataFromTmpFile(conf, path, filename)
+
+    assert df['col1'].tolist() == ['1', '2', '3']
+    # Text columns read NULLs back as empty strings, whatever the format
+    assert df['col2'].tolist() == ['', '', 'c']
+
+
+@pytest.mark.parametrize("tmpDataFormat", [('PARQUET'), ('ARROW')])
+def test_tmpDataStreamWriter_changedColumnsRaiseError(conf, tmpDataFormat,
+                                                      tmp_path):
+
+    conf.TMP_DATA_FORMAT = tmpDataFormat
+    conf.TMP_DATA_FILE_EXT = fileIO.TMP_DATA_FILE_EXTS[tmpDataFormat]
+
+    writer = fileIO.TmpDataStreamWriter(
+        conf, str(tmp_path) + '/', 'test_stream' + conf.TMP_DATA_FILE_EXT)
+    writer.write(pd.DataFrame({'col1': ['1']}))
+
+    with pytest.raises(ValueError):
+        writer.write(pd.DataFrame({'other': ['2']}))
+    writer.close()
+
+
+@pytest.mark.parametrize("tmpDataFormat", [('PARQUET'), ('ARROW')])
+def test_tmpDataTypes(conf, tmpDataFormat, tmp_path):
+
+    conf.TMP_DATA_FORMAT = tmpDataFormat
+    conf.TMP_DATA_FILE_EXT = fileIO.TMP_DATA_FILE_EXTS[tmpDataFormat]
+    path = str(tmp_path) + '/'
+    filename = 'test_types' + conf.TMP_DATA_FILE_EXT
+
+    dataset = pd.DataFrame({
+        'bigInt': pd.Series([2**53 + 1, None], dtype='Int64'),
+        'mixed': pd.Series([1, 'a'], dtype=object),
+        'numbers': pd.Series([1, 2.5], dtype=object),
+        'text': ['a', None]})
+
+    fileIO.writeDataToTmpFile(conf, dataset, path, filename, True, 'w')
+    df = fileIO.readDataFromTmpFile(conf, path, filename)
+
+    # Ints with nulls stay (exact) ints
+    assert str(df['bigInt'].dtype) == 'Int64'
+    assert df['bigInt'][0] == 2**53 + 1
+    # A column Arrow can't give one type is written as text
+    assert df['mixed'].tolist() == ['1', 'a']
+    assert df['numbers'].tolist() == [1.0, 2.5]
+    assert df['text'].tolist() == ['a', '']
+
+
+@pytest.mark.parametrize("tmpDataFormat", [('PARQUET'), ('ARROW')])
+def test_tmpDataTruncateKeepsColumns(conf, dataset, tmpDataFormat,
+                                     tmp_path):
+
+    conf.TMP_DATA_FORMAT = tmpDataFormat
+    conf.TMP_DATA_FILE_EXT = fileIO.TMP_DATA_FILE_EXTS[tmpDataFormat]
+    path = str(tmp_path) + '/'
+    filename = 'test_truncate' + conf.TMP_DATA_FILE_EXT
+
+    fileIO.writeDataToTmpFile(conf, dataset, path, filename, True, 'w')
+    fileIO.truncateFile(conf, path, filename)
+    df = fileIO.readDataFromTmpFile(conf, path, filename)
+
+    assert list(df.columns) == ['col1', 'col2']
+    assert len(df) == 0
+
+
+@pytest.mark.parametrize("tmpDataFormat", [('PARQUET'), ('ARROW')])
+@pytest.mark.parametrize("keepBytes", [(0), (10)])
+def test_tmpDataIncompleteFileRaisesError(conf, dataset, tmpDataFormat,
+                                          keepBytes, tmp_path):
+
+    conf.TMP_DATA_FORMAT = tmpDataFormat
+    conf.TMP_DATA_FILE_EXT = fileIO.TMP_DATA_FILE_EXTS[tmpDataFormat]
+    path = str(tmp_path) + '/'
+    filename = 'test_incomplete' + conf.TMP_DATA_FILE_EXT
+
+    fileIO.writeDataToTmpFile(conf, dataset, path, filename, True, 'w')
+    os.truncate(path + conf.FILE_NAME_MAP[filename], keepBytes)
+
+    with pytest.raises(ValueError):
+        fileIO.readDataFromTmpFile(conf, path, filename)
@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+
+from betl.io import gsheetClient
+from betl.io import GsheetDatastore
+
+
+def getDatastore(backend):
+    client = gsheetClient.GsheetClient(backend,
+                                       requestsPerMinute=6000,
+                                       sleep=lambda seconds: None)
+    return GsheetDatastore(ssID='SS',
+                           apiScope=None,
+                           apiKey=None,
+                           filename='ss',
+                           client=client)
+
+
+def test_gsheetClient_readsWorksheetsInOneRequest():
+
+    backend = gsheetClient.FakeGsheetBackend({'ss': {
+        'a': [['id', 'name'], ['1', 'x'], ['2', '']],
+        'b': [['id', 'name', ''], ['3', 'y', '']]}})
+    datastore = getDatastore(backend)
+
+    records = datastore.getWorksheetsRecords(['a', 'b'])
+
+    assert records == {'a': [{'id': 1, 'name': 'x'}, {'id': 2, 'name': ''}],
+                       'b': [{'id': 3, 'name': 'y'}]}
+    assert backend.calls == ['openSpreadsheet', 'batchGetValues']
+
+
+def test_gsheetClient_addAndWriteWorksheetsInOneRequestEach():
+
+    backend = gsheetClient.FakeGsheetBackend({'ss': {'a': [['x']]}})
+    datastore = getDatastore(backend)
+
+    datastore.addWorksheets({'b': [['h'], ['1']], 'c': [['h'], ['2']]})
+    datastore.writeWorksheet('a', [['y', 'z']], resize=True)
+
+    assert datastore.getWorksheetsValues(['a', 'b', 'c']) == \
+        {'a': [['y', 'z']], 'b': [['h'], ['1']], 'c': [['h'], ['2']]}
+    assert backend.calls.count('batchUpdate') == 2
+
+
+@pytest.mark.parametrize("failures, maxRetries, succeeds", [
+    ([429, 503], 5, True),
+    ([429, 429, 429], 2, False),
+    ([400], 5, False),
+])
+def test_gsheetClient_retriesTransientErrors(failures, maxRetries, succeeds):
+
+    backend = gsheetClient.FakeGsheetBackend({'ss': {'a': [['x']]}})
+    backend.failures = list(failures)
+    sleeps = []
+    client = gsheetClient.GsheetClient(backend,
+                                       maxRetries=maxRetries,
+                                       sleep=sleeps.append)
+
+    if succeeds:
+        assert client.openSpreadsheet('ss').title == 'ss'
+        assert client.getStats()['open']['retries'] == len(failures)
+        # Exponential backoff (plus jitter)
+        assert sleeps[0] < sleeps[1]
+    else:
+        with pytest.raises(gsheetClient.GsheetRequestError):
+            client.openSpreadsheet('ss')
+
+
+def test_gsheetClient_rateLimitWaitsForTokens():
+
+    now = [0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    bucket = gsheetClient.TokenBucket(rate=1, capacity=2,
+                                      clock=lambda: now[0], sleep=sleep)
+    for i in range(4):
+        bucket.acquire()
+
+    assert sleeps == [1, 1]
+
+
+def test_gsheetClient_cachedReadCostsOneRequest(tmp_path):
+
+    backend = gsheetClient.FakeGsheetBackend({'ss': {
+        'a': [['id'], ['1']], 'b': [['id'], ['2']]}})
+    client = gsheetClient.GsheetClient(backend,
+                                       requestsPerMinute=6000,
+                                       sleep=lambda seconds: None)
+
+    def getCachedDatastore():
+        return GsheetDatastore(ssID='SS',
+                               apiScope=None,
+                               apiKey=None,
+                               filename='ss',
+                               cachePath=str(tmp_path),
+                               cacheMaxSizeMB=1,
+                               client=client)
+
+    values = getCachedDatastore().getWorksheetsValues(['a', 'b'])
+    backend.calls = []
+
+    # A fresh datastore (e.g. the next run) with every worksheet cached
+    datastore = getCachedDatastore()
+    assert datastore.getWorksheetsValues(['a', 'b']) == values
+    assert datastore.getWorksheetsValues(['a', 'b']) == values
+    assert backend.calls == ['getSpreadsheetVersion']
+
+
+@pytest.mark.parametrize("value, cellData", [
+    ('a', {'userEnteredValue': {'stringValue': 'a'}}),
+    ('1', {'userEnteredValue': {'stringValue': '1'}}),
+    (1, {'userEnteredValue': {'numberValue': 1}}),
+    (np.int64(2**60), {'userEnteredValue': {'numberValue': 2**60}}),
+    (1.5, {'userEnteredValue': {'numberValue': 1.5}}),
+    (True, {'userEnteredValue': {'boolValue': True}}),
+    (np.bool_(False), {'userEnteredValue': {'boolValue': False}}),
+    (None, {}),
+    (float('nan'), {}),
+    (np.float32('nan'), {}),
+    (float('inf'), {'userEnteredValue': {'stringValue': 'inf'}})])
+def test_gsheetClient_cellDataByType(value, cellData):
+
+    assert gsheetClient.getCellData(value) == cellData
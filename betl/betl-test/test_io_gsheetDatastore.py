@@ -0,0 +1,121 @@
+from betl.io import gsheetClient
+from betl.io import GsheetDatastore
+
+
+def getDatastore(backend):
+    client = gsheetClient.GsheetClient(backend,
+                                       requestsPerMinute=6000,
+                                       sleep=lambda seconds: None)
+    return GsheetDatastore(ssID='SS',
+                           apiScope=None,
+                           apiKey=None,
+                           filename='ss',
+                           client=client)
+
+
+def test_gsheetDatastore_noRequestsUntilNeeded():
+
+    backend = gsheetClient.FakeGsheetBackend({'ss': {'a': [['x']]}})
+
+    getDatastore(backend)
+
+    assert backend.calls == []
+
+
+def test_gsheetDatastore_connectionAndWorksheetsFetchedOnce():
+
+    backend = gsheetClient.FakeGsheetBackend({'ss': {
+        'a': [['id'], ['1']], 'b': [['id'], ['2']]}})
+    datastore = getDatastore(backend)
+
+    datastore.getWorksheetValues('a')
+    datastore.getWorksheetValues('b')
+    assert list(datastore.worksheets) == ['a', 'b']
+    assert list(datastore.worksheets) == ['a', 'b']
+
+    assert backend.calls == ['openSpreadsheet',
+                             'batchGetValues',
+                             'batchGetValues',
+                             'getWorksheets']
+
+
+def test_gsheetDatastore_getWorksheetsRefetches():
+
+    backend = gsheetClient.FakeGsheetBackend({'ss': {'a': [['x']]}})
+    datastore = getDatastore(backend)
+    datastore.worksheets
+
+    # Added by someone else
+    backend.spreadsheets['ss'].addWorksheet('b', [['y']])
+
+    assert list(datastore.worksheets) == ['a']
+    assert list(datastore.getWorksheets()) == ['a', 'b']
+    assert list(datastore.worksheets) == ['a', 'b']
+
+
+def test_gsheetDatastore_lastModifiedTimeFetchedOnceUntilWrite():
+
+    backend = gsheetClient.FakeGsheetBackend({'ss': {'a': [['x']]}})
+    datastore = getDatastore(backend)
+
+    firstModifiedTime = datastore.lastModifiedTime
+    assert datastore.lastModifiedTime == firstModifiedTime
+    assert backend.calls == ['getSpreadsheetVersion']
+
+    datastore.writeWorksheet('a', [['y']])
+
+    # The spreadsheet is open now, so it's asked for its own modifiedTime
+    assert datastore.lastModifiedTime != firstModifiedTime
+    assert datastore.lastModifiedTime != firstModifiedTime
+    assert backend.calls[-2:] == ['batchUpdate', 'getModifiedTime']
+
+
+def test_gsheetDatastore_usesSpreadsheetIdOnceFound():
+
+    backend = gsheetClient.FakeGsheetBackend({'ss': {'a': [['x']]}})
+    datastore = getDatastore(backend)
+    firstVersion = datastore.version
+
+    # Someone else now has a spreadsheet with the same name
+    backend.spreadsheets['ss-original'] = backend.spreadsheets.pop('ss')
+    backend.addSpreadsheet('ss', {'a': [['y']]})
+
+    assert datastore.getWorksheetValues('a') == [['x']]
+    datastore.resetLastModifiedTime()
+    assert datastore.version == firstVersion
+    assert backend.calls == ['getSpreadsheetVersion',
+                             'openSpreadsheetById',
+                             'batchGetValues',
+                             'getModifiedTime']
+
+
+class FakeDriveFiles():
+
+    def __init__(self):
+        self.queries = []
+
+    def list(self, q, **kwargs):
+        self.queries.append(q)
+        return self
+
+    def execute(self):
+        return {'files': [{'id': 'id1', 'modifiedTime': 't1'}]}
+
+
+class FakeDrive():
+
+    def __init__(self):
+        self.driveFiles = FakeDriveFiles()
+
+    def files(self):
+        return self.driveFiles
+
+
+def test_gspreadBackend_versionLookupIgnoresTrashedFiles(monkeypatch):
+
+    drive = FakeDrive()
+    backend = gsheetClient.GspreadBackend(apiKey=None, apiScope=None)
+    monkeypatch.setattr(backend, 'getGdriveConn', lambda: drive)
+
+    assert backend.getSpreadsheetVersion('ss') == ('id1', 't1')
+    assert 'trashed = false' in drive.driveFiles.queries[0]
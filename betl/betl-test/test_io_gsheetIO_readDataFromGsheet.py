@@ -0,0 +1,69 @@
+import pytest
+
+from betl.io import gsheetClient
+from betl.io import gsheetIO
+from betl.io import GsheetDatastore
+
+ROWS = [['id', 'name', ''],
+        ['1', 'a', ''],
+        ['', '', ''],
+        ['', '', ''],
+        ['2', 'b', 'x'],
+        ['3', '', ''],
+        ['', '', ''],
+        ['', '', '']]
+
+
+def getDatastore(backend):
+    client = gsheetClient.GsheetClient(backend,
+                                       requestsPerMinute=6000,
+                                       sleep=lambda seconds: None)
+    return GsheetDatastore(ssID='SS',
+                           apiScope=None,
+                           apiKey=None,
+                           filename='ss',
+                           client=client)
+
+
+@pytest.mark.parametrize("pageRows", [1, 2, 3, 100])
+def test_gsheetIO_pagedReadMatchesWholeWorksheet(pageRows):
+
+    backend = gsheetClient.FakeGsheetBackend({'ss': {'ws': ROWS}})
+    datastore = getDatastore(backend)
+
+    df = gsheetIO.readDataFromGsheet(datastore, 'ws', pageRows=pageRows)
+    expected = gsheetIO.worksheetValuesToDataFrame(
+        datastore.getWorksheetValues('ws'))
+
+    assert df.equals(expected)
+    assert list(df.columns) == ['id', 'name', '']
+    assert len(df) == 5
+
+
+def test_gsheetIO_limitedReadOnlyRequestsNeededRows():
+
+    backend = gsheetClient.FakeGsheetBackend({'ss': {'ws': ROWS}})
+    datastore = getDatastore(backend)
+    datastore.conn
+
+    df = gsheetIO.readDataFromGsheet(datastore, 'ws', limitdata=2)
+
+    assert df.values.tolist() == [['1', 'a']]
+    assert backend.calls == ['openSpreadsheet', 'batchGetValues']
+
+
+@pytest.mark.parametrize("chunkSize, limitdata, chunkLengths", [
+    (2, None, [1, 4]),
+    (6, None, [5]),
+    (100, 5, [4]),
+])
+def test_gsheetIO_readInChunks(chunkSize, limitdata, chunkLengths):
+
+    backend = gsheetClient.FakeGsheetBackend({'ss': {'ws': ROWS}})
+    datastore = getDatastore(backend)
+
+    chunks = list(gsheetIO.readDataFromGsheetInChunks(
+        datastore, 'ws', chunkSize, limitdata=limitdata))
+
+    assert [len(chunk) for chunk in chunks] == chunkLengths
+    assert list(chunks[0].columns) == ['id', 'name']
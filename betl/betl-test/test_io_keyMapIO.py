@@ -0,0 +1,199 @@
+import os
+import pytest
+import pandas as pd
+
+from betl.io import fileIO
+from betl.io import keyMapIO
+
+
+@pytest.mark.parametrize("sks", [
+    (['1', '2', '3']),  # As read from CSV temp data
+    ([1, 2, 3])])
+def test_keyMap_lookup(sks):
+
+    keyMap = keyMapIO.KeyMap(pd.DataFrame({'sk': sks, 'nk': ['a', 'b', '']}))
+
+    fks, missCount = keyMap.lookup(pd.Series(['b', 'x', '', 'a', 'b']))
+
+    assert fks.dtype == 'int64'
+    assert fks.tolist() == [2, -1, 3, 1, 2]
+    assert missCount == 1
+
+
+def test_keyMap_typedNKsMatchTextNKs():
+
+    # e.g. a mapping from typed temp data, looked up with NKs from text
+    keyMap = keyMapIO.KeyMap(pd.DataFrame({'sk': [1, 2], 'nk': [10, 20]}))
+
+    fks, missCount = keyMap.lookup(pd.Series(['20', '10', '30']))
+
+    assert fks.tolist() == [2, 1, -1]
+    assert missCount == 1
+
+    # And the other way round
+    keyMap = keyMapIO.KeyMap(pd.DataFrame({'sk': [1], 'nk': ['10']}))
+
+    fks, missCount = keyMap.lookup(pd.Series([10, 20], dtype='Int64'))
+
+    assert fks.tolist() == [1, -1]
+
+
+def test_nkComponentToStr_nullsAsEmptyStrings():
+
+    strings = keyMapIO.nkComponentToStr(pd.Series([1, None], dtype='Int64'))
+
+    assert strings.tolist() == ['1', '']
+
+
+def test_keyMap_duplicateNKsUseFirstSK():
+
+    keyMap = keyMapIO.KeyMap(pd.DataFrame({'sk': [1, 2], 'nk': ['a', 'a']}))
+
+    fks, missCount = keyMap.lookup(pd.Series(['a']))
+
+    assert fks.tolist() == [1]
+    assert keyMap.duplicateCount == 1
+
+
+def test_keyMap_emptyMappingFile():
+
+    keyMap = keyMapIO.KeyMap(pd.DataFrame())
+
+    fks, missCount = keyMap.lookup(pd.Series(['a', 'b']))
+
+    assert fks.tolist() == [-1, -1]
+    assert missCount == 2
+
+
+def writeKeyMap(conf, dimensionName, df):
+    fileIO.writeDataToTmpFile(
+        conf, df, conf.TMP_DATA_PATH + '/LOD/',
+        keyMapIO.getKeyMapTableName(dimensionName) + conf.TMP_DATA_FILE_EXT,
+        True, 'w')
+
+
+def test_keyMap_cachedUntilMappingRewritten(conf, tmp_path, monkeypatch):
+
+    monkeypatch.setattr(conf, 'TMP_DATA_PATH', str(tmp_path))
+    monkeypatch.setattr(conf, 'KEY_MAP_CACHE_SIZE_MB', 1024)
+    (tmp_path / 'LOD').mkdir()
+    keyMapIO.KEY_MAPS.clear()
+
+    writeKeyMap(conf, 'dm_a', pd.DataFrame({'sk': [1], 'nk': ['a']}))
+    keyMap = keyMapIO.getKeyMap(conf, 'dm_a')
+    assert keyMapIO.getKeyMap(conf, 'dm_a') is keyMap
+
+    writeKeyMap(conf, 'dm_a', pd.DataFrame({'sk': [2], 'nk': ['a']}))
+    keyMapIO.invalidateKeyMap('dm_a')
+    assert keyMapIO.getKeyMap(conf, 'dm_a').lookup(['a'])[0].tolist() == [2]
+
+
+def test_keyMap_leastRecentlyUsedEvicted(conf, tmp_path, monkeypatch):
+
+    monkeypatch.setattr(conf, 'TMP_DATA_PATH', str(tmp_path))
+    monkeypatch.setattr(conf, 'KEY_MAP_CACHE_SIZE_MB', 0)
+    (tmp_path / 'LOD').mkdir()
+    keyMapIO.KEY_MAPS.clear()
+
+    for dimensionName in ['dm_a', 'dm_b']:
+        writeKeyMap(conf, dimensionName,
+                    pd.DataFrame({'sk': [1], 'nk': ['a']}))
+        keyMapIO.getKeyMap(conf, dimensionName)
+
+    assert list(keyMapIO.KEY_MAPS) == ['dm_b']
+
+
+def test_hashNKs_sameForTypedAndTextValues():
+
+    typed = pd.DataFrame({'id': [1, 2], 'date': pd.to_datetime(
+        ['2020-01-01', '2020-01-02'])})
+    text = pd.DataFrame({'id': ['1', '2'], 'date': [
+        '2020-01-01 00:00:00', '2020-01-02 00:00:00']})
+
+    hashes = keyMapIO.hashNKs(typed, ['id', 'date'])
+
+    assert hashes.dtype == 'int64'
+    assert hashes.tolist() == keyMapIO.hashNKs(text, ['id', 'date']).tolist()
+    assert hashes[0] != hashes[1]
+
+
+@pytest.mark.parametrize("ids, fakeHashes, collides", [
+    (['a', 'b'], [7, 7], True),
+    (['a', 'b', 'a'], [7, 8, 7], False),
+    (['a', 'b', 'c', 'a'], [7, 8, 8, 7], True),
+    (['a', 'b', 'c', 'b'], [7, 8, 9, 8], False),
+])
+def test_hashNKs_collisionRaisesError(monkeypatch, ids, fakeHashes,
+                                      collides):
+
+    # A repeated NK (e.g. in a fact) is not a collision
+    monkeypatch.setattr(
+        pd.util, 'hash_pandas_object',
+        lambda df, index: pd.Series(fakeHashes, dtype='uint64'))
+
+    if collides:
+        with pytest.raises(ValueError):
+            keyMapIO.hashNKs(pd.DataFrame({'id': ids}), ['id'])
+    else:
+        assert keyMapIO.hashNKs(
+            pd.DataFrame({'id': ids}), ['id']).tolist() == fakeHashes
+
+
+def test_keyMap_hashedNKsFromTextTempData():
+
+    hashes = keyMapIO.hashNKs(pd.DataFrame({'id': ['a', 'b']}), ['id'])
+    keyMap = keyMapIO.KeyMap(
+        pd.DataFrame({'sk': ['1', '2'], 'nk': hashes.astype(str)}),
+        hashedNKs=True)
+
+    fks, missCount = keyMap.lookup(pd.Series(hashes[::-1].astype(str)))
+
+    assert fks.tolist() == [2, 1]
+    assert keyMap.nks.dtype == 'int64'
+
+
+@pytest.mark.parametrize("nks, sks", [
+    ([30, 10, 20, 10], [1, 2, 3, 4]),  # Unsorted, with a duplicate NK
+    ([], [])])
+def test_sortedKeyMap_lookupMatchesKeyMap(conf, tmp_path, monkeypatch,
+                                          nks, sks):
+
+    monkeypatch.setattr(conf, 'TMP_DATA_PATH', str(tmp_path))
+    df = pd.DataFrame({'sk': sks, 'nk': nks}, dtype='int64')
+    keyMapIO.writeKeyMapArrays(conf, 'dm_a', df)
+
+    sortedKeyMap = keyMapIO.SortedKeyMap(
+        *keyMapIO.getKeyMapArrayPaths(conf, 'dm_a'))
+    keyMap = keyMapIO.KeyMap(df, hashedNKs=True)
+    lookupNKs = pd.Series(['10', '5', '20', '30', '40'])
+
+    fks, missCount = sortedKeyMap.lookup(lookupNKs)
+
+    assert fks.tolist() == keyMap.lookup(lookupNKs)[0].tolist()
+    assert missCount == keyMap.lookup(lookupNKs)[1]
+    assert sortedKeyMap.nks.tolist() == sorted(set(nks))
+
+
+def test_keyMap_usesArraysInHashModeUnlessStale(conf, tmp_path, monkeypatch):
+
+    monkeypatch.setattr(conf, 'TMP_DATA_PATH', str(tmp_path))
+    monkeypatch.setattr(conf, 'KEY_MAP_CACHE_SIZE_MB', 1024)
+    monkeypatch.setattr(conf, 'NK_ENCODING', 'HASH')
+    (tmp_path / 'LOD').mkdir()
+    keyMapIO.KEY_MAPS.clear()
+
+    df = pd.DataFrame({'sk': [1], 'nk': [10]})
+    writeKeyMap(conf, 'dm_a', df)
+    keyMapIO.writeKeyMapArrays(conf, 'dm_a', df)
+    assert isinstance(keyMapIO.getKeyMap(conf, 'dm_a'),
+                      keyMapIO.SortedKeyMap)
+
+    # A later (STRING) load of the dimension rewrote only the mapping file
+    writeKeyMap(conf, 'dm_a', pd.DataFrame({'sk': [2], 'nk': [10]}))
+    arraysMTime = os.stat(keyMapIO.getKeyMapArrayPaths(conf, 'dm_a')[0])
+    os.utime(keyMapIO.getKeyMapFilePath(conf, 'dm_a'),
+             ns=(arraysMTime.st_atime_ns, arraysMTime.st_mtime_ns + 10**9))
+    keyMapIO.invalidateKeyMap('dm_a')
+    keyMap = keyMapIO.getKeyMap(conf, 'dm_a')
+    assert isinstance(keyMap, keyMapIO.KeyMap)
+    assert keyMap.lookup(['10'])[0].tolist() == [2]
@@ -0,0 +1,207 @@
+import threading
+import psycopg2
+import pytest
+
+from betl.io import DatastoreClass_postgres
+
+
+class FakeCursor():
+
+    def execute(self, sql):
+        pass
+
+    def fetchall(self):
+        return [('db',)]
+
+
+class FakeConnection():
+
+    def __init__(self, failRollback=False):
+        self.closed = 0
+        self.failRollback = failRollback
+        self.rollbacks = 0
+        self.session = None
+        self.readonly = None
+
+    def rollback(self):
+        if self.failRollback:
+            raise psycopg2.OperationalError('server closed the connection')
+        self.rollbacks += 1
+
+    def set_session(self, **kwargs):
+        self.session = kwargs
+        if kwargs.get('readonly') is True:
+            self.readonly = True
+
+    def cursor(self):
+        return FakeCursor()
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connections(monkeypatch):
+
+    # Every connection the pool opens
+    connections = []
+
+    def connect(**kwargs):
+        # Connecting can be slow, so we must never hold the shared lock
+        assert not DatastoreClass_postgres.POOLS_LOCK.locked()
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    monkeypatch.setattr(DatastoreClass_postgres.psycopg2, 'connect', connect)
+    monkeypatch.setattr(DatastoreClass_postgres, 'CONNECTION_POOLS', {})
+    monkeypatch.setattr(DatastoreClass_postgres, 'CHECKED_DATABASES', set())
+    return connections
+
+
+def getPool(poolSize=2, maxOpen=3, timeout=5):
+    return DatastoreClass_postgres.PostgresConnectionPool(
+        host='localhost',
+        dbName='db',
+        user='user',
+        password='pwd',
+        schema=None,
+        readonly=False,
+        poolSize=poolSize,
+        maxOpen=maxOpen,
+        timeout=timeout)
+
+
+def test_connectionPool_reusesReleasedConnections(connections):
+
+    pool = getPool()
+
+    conn = pool.getConnection()
+    pool.releaseConnection(conn)
+
+    assert pool.getConnection() is conn
+    assert len(connections) == 1
+
+
+def test_connectionPool_resetsOnRelease(connections):
+
+    pool = getPool()
+
+    conn = pool.getConnection()
+    conn.set_session(isolation_level='SERIALIZABLE', readonly=True)
+    pool.releaseConnection(conn)
+
+    assert conn.rollbacks == 1
+    assert conn.session == {'isolation_level': 'DEFAULT',
+                            'readonly': 'DEFAULT',
+                            'deferrable': 'DEFAULT',
+                            'autocommit': False}
+    assert not conn.closed
+
+
+def test_connectionPool_discardsClosedConnections(connections):
+
+    pool = getPool(maxOpen=2)
+
+    # Closed while checked out
+    conn1 = pool.getConnection()
+    conn1.close()
+    pool.releaseConnection(conn1)
+    # Broken when we try to reset it
+    conn2 = pool.getConnection()
+    conn2.failRollback = True
+    pool.releaseConnection(conn2)
+    assert conn2.closed
+    # Closed while idle
+    conn3 = pool.getConnection()
+    pool.releaseConnection(conn3)
+    conn3.close()
+
+    # None of them count against maxOpen any more
+    conns = [pool.getConnection(), pool.getConnection()]
+    assert conn1 not in conns and conn2 not in conns and conn3 not in conns
+    assert len(connections) == 5
+
+
+def test_connectionPool_closesConnectionsBeyondPoolSize(connections):
+
+    pool = getPool(poolSize=1)
+
+    conns = [pool.getConnection(), pool.getConnection()]
+    for conn in conns:
+        pool.releaseConnection(conn)
+
+    assert [conn.closed for conn in conns] == [0, 1]
+
+
+def test_connectionPool_waitsForReleaseAtMaxOpen(connections):
+
+    pool = getPool(maxOpen=2)
+    conns = [pool.getConnection(), pool.getConnection()]
+
+    gotConn = []
+    waiter = threading.Thread(target=lambda: gotConn.append(
+        pool.getConnection()))
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()
+
+    pool.releaseConnection(conns[0])
+    waiter.join(5)
+
+    assert gotConn == [conns[0]]
+    assert len(connections) == 2
+
+
+def test_connectionPool_timesOutAtMaxOpen(connections):
+
+    pool = getPool(maxOpen=1, timeout=0.1)
+    pool.getConnection()
+
+    with pytest.raises(ValueError, match='DB_POOL_MAX_OPEN'):
+        pool.getConnection()
+    assert len(connections) == 1
+
+
+def getDatastore():
+    return DatastoreClass_postgres.PostgresDatastore(
+        dbId='ETL',
+        host='localhost',
+        dbName='db',
+        user='user',
+        password='pwd',
+        createIfNotFound=True)
+
+
+def test_postgresDatastore_closeReturnsConnectionToPool(connections):
+
+    datastore = getDatastore()
+    conn = datastore.conn
+    datastore.close()
+
+    assert datastore.getPool(readonly=False).idleConns == [conn]
+    # The next use checks a connection out again
+    assert datastore.conn is conn
+
+
+def test_postgresDatastore_checksDatabaseExistsOnce(connections):
+
+    datastore = getDatastore()
+    datastore.checkDatabaseExists()
+    datastore.checkDatabaseExists()
+    getDatastore().checkDatabaseExists()
+
+    # One temporary connection to the postgres DB, closed straight away
+    assert len(connections) == 1
+    assert connections[0].closed
+
+
+def test_conf_closeDatastoresReleasesConnections(conf, connections):
+
+    datastore = getDatastore()
+    conf.DWH_DATABASES['ETL'] = datastore
+    conn = datastore.conn
+
+    conf.closeDatastores()
+
+    assert datastore.datastoreConn is None
+    assert datastore.getPool(readonly=False).idleConns == [conn]
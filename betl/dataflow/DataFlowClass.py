@@ -30,7 +30,9 @@ class DataFlow():
 
     from .dfl_io import (read,
                          write,
+                         writeKeyMap,
                          getDataFromSrc,
+                         streamDataFromSrc,
                          createDataset,
                          duplicateDataset,
                          getDataFrames,
@@ -38,12 +40,14 @@ class DataFlow():
                          getColumnList)
 
     from .dfl_loadPrep import (prepForLoad,
-                               collapseNaturalKeyCols)
+                               collapseNaturalKeyCols,
+                               assignSurrogateKeys)
 
     from .dfl_mdm import (mapMasterData)
 
     from .dfl_merge import (join,
-                            union)
+                            union,
+                            resolveSurrogateKeys)
 
     def __init__(self, desc, conf):
 
@@ -1,4 +1,7 @@
 from datetime import datetime
+import pandas as pd
+
+from betl.io import keyMapIO
 
 
 def setAuditCols(self, dataset, bulkOrDelta, sourceSystem, desc):
@@ -21,8 +24,18 @@ def createAuditNKs(self, dataset, desc):
     self.stepStart(desc=desc)
 
     # TODO will improve this over time. Basic solution as PoC
-    self.data[dataset]['nk_audit'] = \
-        self.data[dataset]['audit_latest_load_operation'] + '_' + '10'
+    if self.CONF.NK_ENCODING == 'HASH':
+        auditNKCols = pd.DataFrame(
+            {'latest_load_operation':
+                self.data[dataset]['audit_latest_load_operation'],
+             'data_quality_score': '10'},
+            index=self.data[dataset].index)
+        self.data[dataset]['nk_audit'] = keyMapIO.hashNKs(
+            auditNKCols,
+            ['latest_load_operation', 'data_quality_score'])
+    else:
+        self.data[dataset]['nk_audit'] = \
+            self.data[dataset]['audit_latest_load_operation'] + '_' + '10'
 
     self.data[dataset].drop(
         ['audit_source_system',
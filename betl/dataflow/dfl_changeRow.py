@@ -7,7 +7,7 @@ def truncate(self, dataset, dataLayerID, desc=None, forceDBWrite=False, silent=F
     self.stepStart(desc=desc, silent=silent)
 
     path = (self.CONF.TMP_DATA_PATH + '/' + dataLayerID + '/')
-    filename = dataset + '.csv'
+    filename = dataset + self.CONF.TMP_DATA_FILE_EXT
 
     fileIO.truncateFile(self.CONF, path, filename)
 
@@ -4,6 +4,8 @@ from betl.io import dbIO
 from betl.io import fileIO
 from betl.io import gsheetIO
 from betl.io import excelIO
+from betl.io import cacheIO
+from betl.io import keyMapIO
 
 
 def read(self,
@@ -27,7 +29,7 @@ def read(self,
                          _targetDataset + ' in this dataflow')
 
     path = (self.CONF.TMP_DATA_PATH + '/' + dataLayer + '/')
-    filename = tableName + '.csv'
+    filename = tableName + self.CONF.TMP_DATA_FILE_EXT
 
     self.data[_targetDataset] = pd.DataFrame()
 
@@ -40,11 +42,9 @@ def read(self,
 
     else:
         self.data[_targetDataset] = \
-            fileIO.readDataFromCsv(conf=self.CONF,
-                                   path=path,
-                                   filename=filename,
-                                   sep=',',
-                                   quotechar='"')
+            fileIO.readDataFromTmpFile(conf=self.CONF,
+                                       path=path,
+                                       filename=filename)
 
     shape = self.data[_targetDataset].shape
     report = 'Read (' + str(shape[0]) + ', ' + str(shape[1]) + ') ' + \
@@ -67,7 +67,8 @@ def write(self,
           append_or_replace='replace',
           writingDefaultRows=False,
           desc=None,
-          keepDataflowOpen=False):
+          keepDataflowOpen=False,
+          tmpDataWriter=None):
 
     if desc is None:
         desc = 'Write data to ' + dataLayerID + '.' + targetTableName + \
@@ -106,9 +107,17 @@ def write(self,
     # can check we have all the columns and reorder them to match
     # the schema (which saves the app having to worry about this)
     logDataModelCols = dataLayer.getColumnsForTable(targetTableName)
+    colDataTypes = None
 
     if logDataModelCols is not None:
 
+        # The data type of every column we might write, so the DB write
+        # can COPY in binary format
+        colDataTypes = dict(zip(self.CONF.AUDIT_COLS['colNames'],
+                                self.CONF.AUDIT_COLS['dataType']))
+        for col in logDataModelCols:
+            colDataTypes[col.columnName] = col.dataType
+
         logDataModelColNames_sks = []
         logDataModelColNames_all = []
         logDataModelColNames_noSKs = []
@@ -172,14 +181,15 @@ def write(self,
                 forceDBWrite=True,
                 silent=True)
 
-        dbEng = dataLayer.getDatastore().eng
-        dbIO.writeDataToDB(
+        copyStats = dbIO.writeDataToDB(
             self.targetDataset,
             targetTableName,
-            dbEng,
-            append_or_replace)
+            dataLayer.getDatastore(),
+            append_or_replace,
+            copyFormat=self.CONF.DB_COPY_FORMAT,
+            colDataTypes=colDataTypes)
 
-    # write to CSV
+    # write to temp file
     mode = 'w'
     if append_or_replace.upper() == 'APPEND':
         mode = 'a'
@@ -194,25 +204,36 @@ def write(self,
     if not os.path.exists(path):
         os.makedirs(path)
 
-    filename = targetTableName + '.csv'
+    filename = targetTableName + self.CONF.TMP_DATA_FILE_EXT
 
-    fileIO.writeDataToCsv(
-        conf=self.CONF,
-        df=self.targetDataset,
-        path=path,
-        filename=filename,
-        headers=True,
-        mode=mode)
+    # A streaming write hands us the writer it's keeping open
+    if tmpDataWriter is not None:
+        tmpDataWriter.write(self.targetDataset)
+    else:
+        fileIO.writeDataToTmpFile(
+            conf=self.CONF,
+            df=self.targetDataset,
+            path=path,
+            filename=filename,
+            headers=True,
+            mode=mode)
 
     report = str(self.targetDataset.shape[0]) + ' rows written to '
     report += targetTableName
 
+    if writeToDB and copyStats['seconds'] > 0:
+        report += ' (DB write: ' + \
+            str(round(copyStats['rows'] / copyStats['seconds'])) + \
+            ' rows/sec, ' + \
+            str(round(copyStats['bytes'] / copyStats['seconds'])) + \
+            ' bytes/sec)'
+
     self.stepEnd(report=report, df=self.targetDataset)
     if not keepDataflowOpen:
         self.close()
 
 
-def getDataFromSrc(self, tableName, srcSysID, desc, bulkOrDelta='BULK', srcTableName=None, doNotChangeSrcTableName=False):
+def getDataFromSrc(self, tableName, srcSysID, desc, bulkOrDelta='BULK', srcTableName=None, doNotChangeSrcTableName=False, srcFingerprint=None):
 
     self.stepStart(desc=desc)
 
@@ -233,27 +254,77 @@ def getDataFromSrc(self, tableName, srcSysID, desc, bulkOrDelta='BULK', srcTable
     elif not doNotChangeSrcTableName:
         srcTableName = srcTableName[srcTableName.find("_")+1:]
 
-    if srcSysDatastore.datastoreType == 'FILESYSTEM':
+    # Unchanged Excel and CSV source files can be read from a columnar copy
+    # saved the last time we parsed them. The caller may already have
+    # fingerprinted the file (srcFingerprint), which saves hashing it twice
+    srcCacheKey = None
+    cachedData = None
+    if self.CONF.SRC_CACHE_PATH is not None and limitdata is None and \
+            srcSysDatastore.datastoreType in ('FILESYSTEM', 'EXCEL'):
+        if srcFingerprint is None:
+            srcFingerprint = cacheIO.getFileFingerprint(
+                srcSysDatastore.getFilePath(srcTableName))
+        srcCacheKey = cacheIO.getCacheKey(srcFingerprint, srcTableName)
+        cachedData = cacheIO.readCachedData(
+            self.CONF.SRC_CACHE_PATH,
+            srcCacheKey)
+
+    if cachedData is not None:
+
+        self.data[tableName] = cachedData
+
+    elif srcSysDatastore.datastoreType == 'FILESYSTEM':
 
         path = srcSysDatastore.path
         separator = srcSysDatastore.delim
         quotechar = srcSysDatastore.quotechar
 
         if srcSysDatastore.fileExt == '.csv':
-            self.data[tableName] = \
-                fileIO.readDataFromCsv(conf=self.CONF,
-                                       path=path,
-                                       filename=srcTableName + '.csv',
-                                       sep=separator,
-                                       quotechar=quotechar,
-                                       isTmpData=False,
-                                       limitdata=limitdata)
+            filename = srcTableName + '.csv'
+
+            # Very large files can be parsed in parallel (but there's no
+            # point if we're only reading the first few rows)
+            parallelParse = False
+            threshold = srcSysDatastore.parallelParseThresholdMB
+            if limitdata is None and threshold is not None:
+                fileSizeMB = os.path.getsize(path + filename) / 1024 / 1024
+                parallelParse = fileSizeMB >= threshold
+
+            if parallelParse:
+                self.data[tableName] = \
+                    fileIO.readDataFromCsvInParallel(
+                        filePath=path + filename,
+                        sep=separator,
+                        quotechar=quotechar,
+                        numProcesses=srcSysDatastore.parallelParseProcesses)
+            else:
+                self.data[tableName] = \
+                    fileIO.readDataFromCsv(conf=self.CONF,
+                                           path=path,
+                                           filename=filename,
+                                           sep=separator,
+                                           quotechar=quotechar,
+                                           isTmpData=False,
+                                           limitdata=limitdata)
 
         else:
             raise ValueError('Unhandled file extension for src system: ' +
                              srcSysDatastore.fileExt + ' for source sys ' +
                              srcSysID)
 
+    elif srcSysDatastore.datastoreType == 'POSTGRES' and \
+            limitdata is None and \
+            srcTableName.lower() in srcSysDatastore.partitionedReads:
+
+        # Large tables can be read in key ranges, over several connections
+        partitionCol, numPartitions = \
+            srcSysDatastore.partitionedReads[srcTableName.lower()]
+        self.data[tableName] = \
+            dbIO.readDataFromDBInParallel(tableName=srcTableName,
+                                          dataStore=srcSysDatastore,
+                                          partitionCol=partitionCol,
+                                          numPartitions=numPartitions)
+
     elif srcSysDatastore.datastoreType in ('POSTGRES', 'SQLITE'):
 
         self.data[tableName] = \
@@ -265,8 +336,9 @@ def getDataFromSrc(self, tableName, srcSysID, desc, bulkOrDelta='BULK', srcTable
     elif srcSysDatastore.datastoreType == 'GSHEET':
 
         self.data[tableName] = \
-            gsheetIO.readDataFromWorksheet(
-                worksheet=srcSysDatastore.worksheets[srcTableName],
+            gsheetIO.readDataFromGsheet(
+                datastore=srcSysDatastore,
+                worksheetTitle=srcTableName,
                 limitdata=limitdata)
 
     elif srcSysDatastore.datastoreType == 'EXCEL':
@@ -281,6 +353,15 @@ def getDataFromSrc(self, tableName, srcSysID, desc, bulkOrDelta='BULK', srcTable
                          + srcSysDatastore.datastoreType
                          + '> connection type not supported')
 
+    # From here on, the data is as we'd have got it from the cache
+    if srcCacheKey is not None and cachedData is None:
+        self.data[tableName] = cacheIO.writeCachedData(
+            cachePath=self.CONF.SRC_CACHE_PATH,
+            cacheKey=srcCacheKey,
+            df=self.data[tableName],
+            maxAgeDays=self.CONF.SRC_CACHE_MAX_AGE_DAYS,
+            maxSizeMB=self.CONF.SRC_CACHE_MAX_SIZE_MB)
+
     self.setAuditCols(
         dataset=tableName,
         bulkOrDelta=bulkOrDelta,
@@ -289,6 +370,8 @@ def getDataFromSrc(self, tableName, srcSysID, desc, bulkOrDelta='BULK', srcTable
 
     report = 'Read ' + str(self.data[tableName].shape[0])
     report += ' rows from source: ' + srcSysID + '.' + srcTableName
+    if cachedData is not None:
+        report += ' (unchanged since last parsed, so read from cache)'
 
     self.stepEnd(
         report=report,
@@ -296,19 +379,207 @@ def getDataFromSrc(self, tableName, srcSysID, desc, bulkOrDelta='BULK', srcTable
         df=self.data[tableName])
 
 
+def streamDataFromSrc(self,
+                      tableName,
+                      srcSysID,
+                      targetTableName,
+                      dataLayerID,
+                      chunkSize,
+                      desc,
+                      bulkOrDelta='BULK',
+                      srcTableName=None,
+                      keepDataflowOpen=False,
+                      srcFingerprint=None):
+
+    # Reads the source table a chunk at a time, and writes each chunk (with
+    # its audit columns) straight to the target data layer, so we never hold
+    # more than one chunk in memory. The first chunk replaces the target,
+    # the rest are appended to it.
+
+    self.stepStart(desc=desc)
+
+    srcSysDatastore = self.CONF.getSrcSysDatastore(srcSysID)
+
+    limitdata = self.CONF.DATA_LIMIT_ROWS
+
+    # See getDataFromSrc
+    if srcTableName is None:
+        srcTableName = tableName
+    else:
+        srcTableName = srcTableName[srcTableName.find("_")+1:]
+
+    # Unchanged Excel and CSV source files can be read from a columnar copy
+    # saved the last time we parsed them, a batch of rows at a time. If
+    # there isn't one, we save one as we stream the file. As in
+    # getDataFromSrc, the caller may already have fingerprinted the file
+    cachedChunks = None
+    cacheWriter = None
+    if self.CONF.SRC_CACHE_PATH is not None and limitdata is None and \
+            srcSysDatastore.datastoreType in ('FILESYSTEM', 'EXCEL'):
+        if srcFingerprint is None:
+            srcFingerprint = cacheIO.getFileFingerprint(
+                srcSysDatastore.getFilePath(srcTableName))
+        srcCacheKey = cacheIO.getCacheKey(srcFingerprint, srcTableName)
+        cachedChunks = cacheIO.readCachedDataInChunks(
+            self.CONF.SRC_CACHE_PATH,
+            srcCacheKey,
+            chunkSize)
+        if cachedChunks is None:
+            cacheWriter = cacheIO.CachedDataWriter(
+                cachePath=self.CONF.SRC_CACHE_PATH,
+                cacheKey=srcCacheKey,
+                maxAgeDays=self.CONF.SRC_CACHE_MAX_AGE_DAYS,
+                maxSizeMB=self.CONF.SRC_CACHE_MAX_SIZE_MB)
+
+    if cachedChunks is not None:
+
+        chunks = cachedChunks
+
+    elif srcSysDatastore.datastoreType == 'FILESYSTEM':
+
+        if srcSysDatastore.fileExt == '.csv':
+            chunks = fileIO.readDataFromCsvInChunks(
+                path=srcSysDatastore.path,
+                filename=srcTableName + '.csv',
+                chunkSize=chunkSize,
+                sep=srcSysDatastore.delim,
+                quotechar=srcSysDatastore.quotechar,
+                limitdata=limitdata)
+        else:
+            raise ValueError('Unhandled file extension for src system: ' +
+                             srcSysDatastore.fileExt + ' for source sys ' +
+                             srcSysID)
+
+    elif srcSysDatastore.datastoreType in ('POSTGRES', 'SQLITE'):
+
+        chunks = dbIO.readDataFromDBInChunks(
+            tableName=srcTableName,
+            dataStore=srcSysDatastore,
+            chunkSize=chunkSize,
+            cols='*',
+            limitdata=limitdata)
+
+    elif srcSysDatastore.datastoreType == 'EXCEL':
+
+        chunks = excelIO.readDataFromWorksheetInChunks(
+            worksheet=srcSysDatastore.worksheets[srcTableName],
+            chunkSize=chunkSize,
+            limitdata=limitdata)
+
+    elif srcSysDatastore.datastoreType == 'GSHEET':
+
+        chunks = gsheetIO.readDataFromGsheetInChunks(
+            datastore=srcSysDatastore,
+            worksheetTitle=srcTableName,
+            chunkSize=chunkSize,
+            limitdata=limitdata)
+
+    else:
+        raise ValueError('Extract for source systems type <'
+                         + srcSysDatastore.datastoreType
+                         + '> connection type not supported')
+
+    # The target file stays open for the whole stream, so a Parquet target
+    # isn't rewritten for every chunk
+    path = self.CONF.TMP_DATA_PATH + '/' + dataLayerID + '/'
+    if not os.path.exists(path):
+        os.makedirs(path)
+    tmpDataWriter = fileIO.TmpDataStreamWriter(
+        conf=self.CONF,
+        path=path,
+        filename=targetTableName + self.CONF.TMP_DATA_FILE_EXT)
+
+    rowCount = 0
+    chunkCount = 0
+    try:
+        for chunk in chunks:
+
+            # From here on, the chunk is as we'd have got it from the cache
+            if cacheWriter is not None:
+                chunk = cacheWriter.write(chunk)
+
+            self.data[tableName] = chunk
+
+            self.setAuditCols(
+                dataset=tableName,
+                bulkOrDelta=bulkOrDelta,
+                sourceSystem=srcSysID,
+                desc='Set the audit columns on chunk ' +
+                     str(chunkCount + 1) + ' of ' + tableName)
+
+            append_or_replace = 'append'
+            if chunkCount == 0:
+                append_or_replace = 'replace'
+
+            self.write(
+                dataset=tableName,
+                targetTableName=targetTableName,
+                dataLayerID=dataLayerID,
+                append_or_replace=append_or_replace,
+                desc='Write chunk ' + str(chunkCount + 1) + ' of ' +
+                     tableName + ' to ' + dataLayerID,
+                keepDataflowOpen=True,
+                tmpDataWriter=tmpDataWriter)
+
+            rowCount += chunk.shape[0]
+            chunkCount += 1
+            del self.data[tableName]
+
+    except BaseException:
+        tmpDataWriter.close()
+        # Don't leave half a cache entry behind
+        if cacheWriter is not None:
+            cacheWriter.abandon()
+        raise
+
+    tmpDataWriter.close()
+    if cacheWriter is not None:
+        cacheWriter.close()
+
+    report = 'Streamed ' + str(rowCount) + ' rows in ' + str(chunkCount)
+    report += ' chunks from source: ' + srcSysID + '.' + srcTableName
+    if cachedChunks is not None:
+        report += ' (unchanged since last parsed, so read from cache)'
+
+    self.stepEnd(report=report)
+
+    if not keepDataflowOpen:
+        self.close()
+
+
+def writeKeyMap(self, dataset, dimensionName, desc=None):
+
+    # Writes the dataset's sk/nk mapping (hashed NKs only) as the sorted
+    # arrays that fact loads memory-map for their SK lookups
+
+    if desc is None:
+        desc = 'Write the sorted SK/NK key map for ' + dimensionName
+    self.stepStart(desc=desc, datasetName=dataset)
+
+    duplicateCount = keyMapIO.writeKeyMapArrays(
+        self.CONF, dimensionName, self.data[dataset])
+
+    report = 'Wrote ' + str(len(self.data[dataset]) - duplicateCount) + \
+             ' keys to the ' + dimensionName + ' key map'
+    if duplicateCount > 0:
+        report += ' (' + str(duplicateCount) + ' duplicate NKs dropped)'
+
+    self.stepEnd(report=report)
+
+
 def createDataset(self, dataset, data, desc):
 
     self.stepStart(desc=desc)
 
     # data can be a dictionary of columnName:value, where value is
     # hardcoded or an array. Or data can be a pandas dataframe.
-    if str(type(data)) == 'pandas.core.frame.DataFrame':
+    if isinstance(data, pd.DataFrame):
         self.data[dataset] = data
     else:
         self.data[dataset] = pd.DataFrame(columns=list(data.keys()))
 
-    for col in data:
-        self.data[dataset][col] = data[col]
+        for col in data:
+            self.data[dataset][col] = data[col]
 
     report = 'Created ' + dataset + ' table with '
     report += str(self.data[dataset].shape[0]) + ' rows'
@@ -1,3 +1,7 @@
+import numpy as np
+
+from betl.io import dbIO
+from betl.io import keyMapIO
 
 
 def prepForLoad(self,
@@ -38,13 +42,22 @@ def collapseNaturalKeyCols(self,
 
     for nkCol in naturalKeyCols:
 
-        # Create the NK column empty, then concat the other cols on one by one
-        self.data[dataset][nkCol] = ''
-
         srcCols = naturalKeyCols[nkCol]
         if isinstance(srcCols, str):
             srcCols = [srcCols]
 
+        if self.CONF.NK_ENCODING == 'HASH':
+            self.data[dataset][nkCol] = \
+                keyMapIO.hashNKs(self.data[dataset], srcCols)
+            self.data[dataset].drop(
+                [srcCol for srcCol in srcCols if srcCol != nkCol],
+                axis=1,
+                inplace=True)
+            continue
+
+        # Create the NK column empty, then concat the other cols on one by one
+        self.data[dataset][nkCol] = ''
+
         i = 1
         for srcCol in srcCols:
             separator = '_'
@@ -52,8 +65,10 @@ def collapseNaturalKeyCols(self,
                 separator = ''
             i += 1
 
+            # Typed temp data gives us columns that aren't text
             self.data[dataset][nkCol] = \
-                self.data[dataset][nkCol] + self.data[dataset][srcCol] + \
+                self.data[dataset][nkCol] + \
+                keyMapIO.nkComponentToStr(self.data[dataset][srcCol]) + \
                 separator
 
             self.data[dataset].drop(
@@ -67,3 +82,46 @@ def collapseNaturalKeyCols(self,
         report=report,
         datasetName=dataset,
         df=self.data[dataset])
+
+
+def assignSurrogateKeys(self, dataset, targetTableName, dataLayerID='BSE',
+                        desc=None):
+
+    # Gives every row of the dataset an SK, from a range reserved from the
+    # target table's SK sequence, so we know the SKs without reading the
+    # table back once it's written
+
+    if desc is None:
+        desc = 'Assigning SKs to ' + dataset + ' from the ' + \
+               targetTableName + ' SK sequence'
+    self.stepStart(desc=desc)
+
+    dataLayer = self.CONF.getLogicalSchemaDataLayer(dataLayerID)
+    skColNames = [col.columnName
+                  for col in dataLayer.getColumnsForTable(targetTableName)
+                  if col.isSK]
+    if len(skColNames) != 1:
+        raise ValueError('Cannot assign SKs to ' + targetTableName +
+                         ': it must have exactly one surrogate key column')
+
+    rowCount = len(self.data[dataset])
+    firstSK = dbIO.reserveSequenceValues(
+        tableName=targetTableName,
+        colName=skColNames[0],
+        count=rowCount,
+        datastore=dataLayer.getDatastore(),
+        schema=dataLayer.schema)
+
+    if rowCount > 0:
+        self.data[dataset][skColNames[0]] = \
+            np.arange(firstSK, firstSK + rowCount, dtype='int64')
+        report = 'Assigned SKs ' + str(firstSK) + ' to ' + \
+                 str(firstSK + rowCount - 1)
+    else:
+        self.data[dataset][skColNames[0]] = np.array([], dtype='int64')
+        report = 'No rows to assign SKs to'
+
+    self.stepEnd(
+        report=report,
+        datasetName=dataset,
+        df=self.data[dataset])
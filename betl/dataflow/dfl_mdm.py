@@ -19,13 +19,13 @@ def mapMasterData(self,
     # Connect to MDM Worksheet #
     ############################
 
-    ws = self.CONF.getMDMDatastore().conn.worksheet(mdmWS)
+    mdmDatastore = self.CONF.getMDMDatastore()
 
     #################################
     # Extract the current MDM table #
     #################################
 
-    mdm_list = ws.get_all_values()
+    mdm_list = mdmDatastore.getWorksheetValues(mdmWS)
 
     if(len(mdm_list)) == 0:
         raise ValueError('MDM column headings must be entered into the ' +
@@ -163,21 +163,16 @@ def mapMasterData(self,
     ####################
 
     colsToWriteBack = joinCols + masterDataCols + ['count']
-    ws.resize(rows=len(df_m)+1, cols=len(colsToWriteBack))
-    cell_list = ws.range(1, 1, len(df_m)+1, len(colsToWriteBack))
-    cellPos = 0
-    for colName in colsToWriteBack:
-        cell_list[cellPos].value = colName
-        cellPos += 1
+    rows = [colsToWriteBack]
     for i, row in df_m.iterrows():
+        rowValues = []
         for colName in colsToWriteBack:
             value = str(row[colName])
             if value == '£$%^NOTAVALUE^%$£':
                 value = ''
-            cell_list[cellPos].value = value
-            cellPos += 1
-    ws.clear()
-    ws.update_cells(cell_list)
+            rowValues.append(value)
+        rows.append(rowValues)
+    mdmDatastore.writeWorksheet(mdmWS, rows, resize=True)
 
     ###########
     # Wrap Up #
@@ -1,6 +1,8 @@
 import pandas as pd
 import pprint
 
+from betl.io import keyMapIO
+
 
 def join(self,
          datasets,
@@ -81,3 +83,51 @@ def union(self, datasets, targetDataset, desc):
         report=report,
         datasetName=targetDataset,
         df=self.data[targetDataset])
+
+
+def resolveSurrogateKeys(self, dataset, fkColumns, desc, silent=False):
+
+    # fkColumns is a dict of FK column name: (NK column name, dimension).
+    # Rather than joining each dimension's SK/NK mapping to the dataset in
+    # turn, we get each mapping once (from the in-process cache, so other
+    # fact loads and role-playing dimensions share it), resolve every FK
+    # with a vectorised lookup, and rebuild the dataset once: NK columns
+    # out, FK columns (int64, -1 where not found) in
+
+    self.stepStart(desc=desc, silent=silent)
+
+    df = self.data[dataset]
+
+    keyMaps = {}
+    fks = {}
+    report = 'Resolved ' + str(len(fkColumns)) + ' FKs for ' + \
+             str(len(df)) + ' rows'
+    for fkColName, (nkColName, dimensionName) in fkColumns.items():
+        if dimensionName not in keyMaps:
+            keyMaps[dimensionName] = \
+                keyMapIO.getKeyMap(self.CONF, dimensionName)
+        keyMap = keyMaps[dimensionName]
+
+        fks[fkColName], missCount = keyMap.lookup(df[nkColName])
+
+        missRate = 0
+        if len(df) > 0:
+            missRate = missCount / len(df)
+        report += '\n  - ' + fkColName + ': ' + str(missCount) + \
+                  ' (' + str(round(missRate * 100, 2)) + '%) not found in ' + \
+                  dimensionName + ', set to ' + str(keyMapIO.DEFAULT_SK)
+        if keyMap.duplicateCount > 0:
+            report += ' (' + str(keyMap.duplicateCount) + ' duplicate ' + \
+                      'NKs in ' + dimensionName + ', first SK used)'
+
+    nkColNames = [nkColName for nkColName, _ in fkColumns.values()]
+    self.data[dataset] = pd.concat(
+        [df.drop(columns=nkColNames),
+         pd.DataFrame(fks, index=df.index)],
+        axis=1)
+
+    self.stepEnd(
+        report=report,
+        datasetName=dataset,
+        df=self.data[dataset],
+        silent=silent)
@@ -1,3 +1,8 @@
+from betl.io import dbIO
+from betl.io import excelIO
+from betl.io import cacheIO
+
+
 def logExtractStart(**kwargs):
     kwargs['conf'].log('logExtractStart')
 
@@ -16,27 +21,297 @@ def bulkExtract(**kwargs):
     tableName = kwargs['tableName']
     dmId = kwargs['dmId']
 
-    dfl = conf.DataFlow(desc='Default extract for ' + tableName)
+    extLayer = conf.getLogicalSchemaDataLayer('EXT')
+
+    # If the source table hasn't changed since we last extracted it (and
+    # we've still got that extract), there's nothing to do. We fingerprint
+    # before we extract, so a change made during the extract is picked up
+    # next time
+    extractState = None
+    if conf.SKIP_UNCHANGED_EXTRACTS:
+        extractStates = getChangedTables(conf, dmId, [tableName])
+        if tableName not in extractStates:
+            return
+        extractState = extractStates[tableName]
+
+    # A file source's fingerprint is a hash of the whole file, so we hand
+    # it on to the source cache rather than have it hash the file again
+    srcFingerprint = None
+    if extractState is not None and \
+            conf.getSrcSysDatastore(dmId).datastoreType in ('FILESYSTEM',
+                                                            'EXCEL'):
+        srcFingerprint = extractState['fingerprint']
+
+    # Excel sources are opened read-only, which keeps the file open until
+    # the workbook is closed, so we close it as soon as we're done with it
+    # (it's reopened if anything else needs it)
+    try:
+        dfl = conf.DataFlow(desc='Default extract for ' + tableName)
+
+        # Tables too big to hold in memory can be streamed to EXT in chunks
+        if conf.EXTRACT_CHUNK_SIZE is not None:
+
+            dfl.streamDataFromSrc(
+                tableName=tableName,
+                srcSysID=dmId,
+                targetTableName=tableName,
+                dataLayerID='EXT',
+                chunkSize=conf.EXTRACT_CHUNK_SIZE,
+                desc='Stream data from source table to the EXT data layer',
+                srcTableName=extLayer.datasets[dmId].tables[tableName]
+                .srcTableName,
+                srcFingerprint=srcFingerprint)
+
+        else:
+
+            dfl.getDataFromSrc(
+                tableName=tableName,
+                srcSysID=dmId,
+                desc="Extract data from source table",
+                srcTableName=extLayer.datasets[dmId].tables[tableName]
+                .srcTableName,
+                srcFingerprint=srcFingerprint)
+
+            dfl.setAuditCols(
+                dataset=tableName,
+                bulkOrDelta="BULK",
+                sourceSystem=dmId,
+                desc="Set the audit columns on the data extract")
+
+            dfl.write(
+                dataset=tableName,
+                targetTableName=tableName,
+                dataLayerID='EXT',
+                desc="Write the data extract to the SRC data layer")
+
+    finally:
+        conf.getSrcSysDatastore(dmId).close()
+
+    if extractState is not None:
+        cacheIO.writeExtractState(
+            conf.EXTRACT_STATE_PATH,
+            dmId + '.' + tableName,
+            extractState)
+
+
+def getChangedTables(conf, dmId, tableNames):
+
+    # Returns a dict of tableName: extractState for the tables that need
+    # extracting (the extractState is None if we can't fingerprint the
+    # source). The others are unchanged since their last extract, and we've
+    # still got that extract, so we log that we're skipping them
+
+    changedTables = {}
+    # Worksheets of the same workbook share one file, so the fingerprints
+    # we take here are offered to the later tables too
+    newFingerprints = []
+    for tableName in tableNames:
+
+        savedState = cacheIO.readExtractState(conf.EXTRACT_STATE_PATH,
+                                              dmId + '.' + tableName)
+        lastFingerprints = list(newFingerprints)
+        if savedState is not None:
+            lastFingerprints.append(savedState['fingerprint'])
+
+        extractState = getExtractState(conf, dmId, tableName,
+                                       lastFingerprints)
+        if extractState is not None:
+            newFingerprints.append(extractState['fingerprint'])
+
+        if extractState is not None and \
+                extDataExists(conf, tableName) and \
+                savedState == extractState:
+            conf.log('logSkipUnchangedExtract',
+                     tableName=tableName,
+                     srcSysID=dmId)
+        else:
+            changedTables[tableName] = extractState
+
+    return changedTables
+
+
+def getExtractState(conf, dmId, tableName, lastFingerprints=()):
+
+    # The source table's fingerprint, plus the settings that change what
+    # we write to EXT. Returns None if we can't fingerprint the source, in
+    # which case we always extract. A file source isn't hashed again if its
+    # size and mtime match one of lastFingerprints (see getFileFingerprint)
+
+    srcSysDatastore = conf.getSrcSysDatastore(dmId)
+    srcTableName = getSrcTableName(conf, dmId, tableName)
+
+    if srcSysDatastore.datastoreType in ('FILESYSTEM', 'EXCEL'):
+        fingerprint = cacheIO.getFileFingerprint(
+            srcSysDatastore.getFilePath(srcTableName),
+            lastFingerprints)
+    elif srcSysDatastore.datastoreType == 'SQLITE':
+        fingerprint = cacheIO.getFileFingerprint(
+            srcSysDatastore.path + srcSysDatastore.filename,
+            lastFingerprints)
+    elif srcSysDatastore.datastoreType == 'GSHEET':
+        fingerprint = srcSysDatastore.lastModifiedTime
+    elif srcSysDatastore.datastoreType == 'POSTGRES':
+        fingerprint = dbIO.getTableStats(srcTableName, srcSysDatastore)
+    else:
+        fingerprint = None
+
+    if fingerprint is None:
+        return None
+
+    return {
+        'srcTableName': srcTableName,
+        'fingerprint': fingerprint,
+        'dataLimitRows': conf.DATA_LIMIT_ROWS,
+        'tmpDataFormat': conf.TMP_DATA_FORMAT}
+
+
+def extDataExists(conf, tableName):
+
+    filename = tableName + conf.TMP_DATA_FILE_EXT
+    if filename not in conf.FILE_NAME_MAP:
+        conf.populateTempDataFileNameMap()
+    return filename in conf.FILE_NAME_MAP
+
+
+def bulkExtractWithSnapshot(**kwargs):
+
+    # Extracts all the tables of a POSTGRES source system concurrently, all
+    # as at the same snapshot of the source DB (so they're consistent with
+    # each other). Each table is read in full, then written to EXT by its
+    # own dataflow as soon as its read finishes. Unlike bulkExtract, tables
+    # aren't streamed in chunks (EXTRACT_CHUNK_SIZE), because the snapshot
+    # has to stay open until every table has been read. Unchanged tables
+    # are still skipped, if SKIP_UNCHANGED_EXTRACTS is set
+
+    conf = kwargs['conf']
+    tableNames = kwargs['tableNames']
+    dmId = kwargs['dmId']
+
+    extractStates = None
+    if conf.SKIP_UNCHANGED_EXTRACTS:
+        extractStates = getChangedTables(conf, dmId, tableNames)
+        tableNames = list(extractStates.keys())
+        if len(tableNames) == 0:
+            return
+
+    tableNamesBySrcTableName = \
+        getTableNamesBySrcTableName(conf, dmId, tableNames)
+
+    srcTables = dbIO.readDataFromDBWithSnapshot(
+        tableNames=list(tableNamesBySrcTableName.keys()),
+        dataStore=conf.getSrcSysDatastore(dmId),
+        numConnections=conf.getSnapshotExtractConnections(dmId),
+        limitdata=conf.DATA_LIMIT_ROWS)
+
+    writeExtractedTables(
+        conf=conf,
+        dmId=dmId,
+        srcTables=srcTables,
+        tableNamesBySrcTableName=tableNamesBySrcTableName,
+        extractDesc="Extract data from source table (under the snapshot " +
+                    "shared by all " + dmId + " tables)",
+        extractStates=extractStates)
+
+
+def bulkExtractWorksheets(**kwargs):
+
+    # Extracts all the worksheets of an EXCEL source system at once, each
+    # parsed in its own process, then written to EXT by its own dataflow as
+    # soon as its parse finishes. Unlike bulkExtract, worksheets aren't
+    # streamed in chunks (EXTRACT_CHUNK_SIZE) or read from the source cache
+    # (SRC_CACHE_PATH): the worker processes parse whole worksheets. Unchanged
+    # worksheets are still skipped, if SKIP_UNCHANGED_EXTRACTS is set
+
+    conf = kwargs['conf']
+    tableNames = kwargs['tableNames']
+    dmId = kwargs['dmId']
+
+    extractStates = None
+    if conf.SKIP_UNCHANGED_EXTRACTS:
+        extractStates = getChangedTables(conf, dmId, tableNames)
+        tableNames = list(extractStates.keys())
+        if len(tableNames) == 0:
+            return
+
+    tableNamesBySrcTableName = \
+        getTableNamesBySrcTableName(conf, dmId, tableNames)
+
+    srcSysDatastore = conf.getSrcSysDatastore(dmId)
 
+    srcTables = excelIO.readDataFromWorksheetsInParallel(
+        filePath=srcSysDatastore.path + srcSysDatastore.filename,
+        worksheetTitles=list(tableNamesBySrcTableName.keys()),
+        numProcesses=conf.getParallelExtractProcesses(dmId),
+        limitdata=conf.DATA_LIMIT_ROWS)
+
+    writeExtractedTables(
+        conf=conf,
+        dmId=dmId,
+        srcTables=srcTables,
+        tableNamesBySrcTableName=tableNamesBySrcTableName,
+        extractDesc="Extract data from source worksheet (parsed in " +
+                    "parallel with the other " + dmId + " worksheets)",
+        extractStates=extractStates)
+
+
+def getTableNamesBySrcTableName(conf, dmId, tableNames):
+
+    tableNamesBySrcTableName = {}
+    for tableName in tableNames:
+        srcTableName = getSrcTableName(conf, dmId, tableName)
+        tableNamesBySrcTableName[srcTableName] = tableName
+
+    return tableNamesBySrcTableName
+
+
+def getSrcTableName(conf, dmId, tableName):
+
+    # As in getDataFromSrc, the schema's srcTableNames are prefixed with
+    # the datasetId
     extLayer = conf.getLogicalSchemaDataLayer('EXT')
 
-    dfl.getDataFromSrc(
-        tableName=tableName,
-        srcSysID=dmId,
-        desc="Extract data from source table",
-        srcTableName=extLayer.datasets[dmId].tables[tableName].srcTableName)
-
-    dfl.setAuditCols(
-        dataset=tableName,
-        bulkOrDelta="BULK",
-        sourceSystem=dmId,
-        desc="Set the audit columns on the data extract")
-
-    dfl.write(
-        dataset=tableName,
-        targetTableName=tableName,
-        dataLayerID='EXT',
-        desc="Write the data extract to the SRC data layer")
+    srcTableName = extLayer.datasets[dmId].tables[tableName].srcTableName
+    return srcTableName[srcTableName.find("_")+1:]
+
+
+def writeExtractedTables(conf,
+                         dmId,
+                         srcTables,
+                         tableNamesBySrcTableName,
+                         extractDesc,
+                         extractStates=None):
+
+    # srcTables is an iterable of (srcTableName, dataframe). extractStates
+    # (from getChangedTables) are saved as each table is written
+    for srcTableName, df in srcTables:
+
+        tableName = tableNamesBySrcTableName[srcTableName]
+
+        dfl = conf.DataFlow(desc='Default extract for ' + tableName)
+
+        dfl.createDataset(
+            dataset=tableName,
+            data=df,
+            desc=extractDesc)
+
+        dfl.setAuditCols(
+            dataset=tableName,
+            bulkOrDelta="BULK",
+            sourceSystem=dmId,
+            desc="Set the audit columns on the data extract")
+
+        dfl.write(
+            dataset=tableName,
+            targetTableName=tableName,
+            dataLayerID='EXT',
+            desc="Write the data extract to the SRC data layer")
+
+        if extractStates is not None and \
+                extractStates[tableName] is not None:
+            cacheIO.writeExtractState(
+                conf.EXTRACT_STATE_PATH,
+                dmId + '.' + tableName,
+                extractStates[tableName])
 
 # def defaultExtract_delta(**kwargs):
 
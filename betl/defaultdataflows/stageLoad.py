@@ -4,6 +4,8 @@ import json
 import os
 import ast
 
+from betl.io import keyMapIO
+
 
 def logLoadStart(**kwargs):
     kwargs['conf'].log('logLoadStart')
@@ -82,14 +84,15 @@ def refreshDefaultRowsTxtFileFromGSheet(**kwargs):
     # Our defaultRows SS should contain a tab per dimension, each with 1+
     # default rows defined. IDs are defined too - should all be negative
     defaultRowsDatastore = conf.getDefaultRowsDatastore()
-    worksheets = {}
+    defaultRows = {}
     if defaultRowsDatastore is not None:
-        worksheets = defaultRowsDatastore.worksheets
-    for wsTitle in worksheets:
+        defaultRows = defaultRowsDatastore.getWorksheetsRecords(
+            list(defaultRowsDatastore.worksheets))
+    for wsTitle in defaultRows:
         # wsTitle is the table name
         filename = conf.TMP_DATA_PATH + '/defaultRows_' + wsTitle + '.txt'
         with open(filename, 'w') as file:
-            file.write(json.dumps(worksheets[wsTitle].get_all_records()))
+            file.write(json.dumps(defaultRows[wsTitle]))
     conf.log('logRefreshDefaultRowsTxtFileFromGSheetEnd')
 
 
@@ -200,6 +203,13 @@ def bulkLoadDimension(conf, tableSchema, defaultRows):
         desc='Read the data we are going to load to BSE (from file ' +
              tableSchema.tableName + ')')
 
+    if conf.SK_GENERATION == 'CLIENT':
+        dfl.assignSurrogateKeys(
+            dataset=tableSchema.tableName,
+            targetTableName=tableSchema.tableName,
+            desc='Assign the SKs ourselves, so we do not have to read ' +
+                 'them back from the DB after the load')
+
     dfl.write(
         dataset=tableSchema.tableName,
         targetTableName=tableSchema.tableName,
@@ -224,6 +234,7 @@ def bulkLoadDimension(conf, tableSchema, defaultRows):
     # DEFAULT ROWS
 
     # Default rows are not compulsory, so defaultRows may be empty dict
+    defaultRowsDatasetName = None
     if defaultRows:
 
         # Blank values in the spreadsheet come through as empty strings, but
@@ -233,13 +244,14 @@ def bulkLoadDimension(conf, tableSchema, defaultRows):
         df = pd.DataFrame.from_dict(defaultRows)
         df.replace(r'^\s*$', np.nan, regex=True, inplace=True)
 
+        defaultRowsDatasetName = tableSchema.tableName + '_defaultRows'
         dfl.createDataset(
-            dataset=tableSchema.tableName + '_defaultRows',
+            dataset=defaultRowsDatasetName,
             data=df,
             desc='Loading the default rows into the dataflow')
 
         dfl.write(
-            dataset=tableSchema.tableName + '_defaultRows',
+            dataset=defaultRowsDatasetName,
             targetTableName=tableSchema.tableName,
             dataLayerID='BSE',
             forceDBWrite=True,
@@ -250,15 +262,16 @@ def bulkLoadDimension(conf, tableSchema, defaultRows):
 
     elif tableSchema.tableName == 'dm_audit' and conf.DEFAULT_DM_AUDIT:
 
+        defaultRowsDatasetName = 'dm_audit_default_rows'
         dfl.createDataset(
-            dataset='dm_audit_default_rows',
+            dataset=defaultRowsDatasetName,
             data={'audit_id': [-1],
                   'latest_delta_load_operation': ['N/A'],
                   'data_quality_score': [-1]},
             desc='Loading the dm_audit default row')
 
         dfl.write(
-            dataset='dm_audit_default_rows',
+            dataset=defaultRowsDatasetName,
             targetTableName='dm_audit',
             dataLayerID='BSE',
             forceDBWrite=True,
@@ -270,15 +283,40 @@ def bulkLoadDimension(conf, tableSchema, defaultRows):
     # RETRIEVE SK/NK MAPPING (FOR LATER)
 
     skDatasetName = 'sk_' + tableSchema.tableName
+    colsToKeep = [tableSchema.surrogateKeyColName] + tableSchema.colNames_NKs
 
-    dfl.read(
-        tableName=tableSchema.tableName,
-        targetDataset=skDatasetName,
-        dataLayer='BSE',
-        forceDBRead=True,
-        desc='The SKs were generated as we wrote to the DB. We will need ' +
-             'these SKs (and their corresponding NKs) when we load the fact ' +
-             'table (later), so we pull the sk/nks mapping back out now)')
+    if conf.SK_GENERATION == 'CLIENT':
+
+        # We already have every row's SK in memory, so we take the mapping
+        # from the datasets we just wrote, rather than reading the table back
+        skSrcDatasetNames = [tableSchema.tableName]
+        if defaultRowsDatasetName is not None:
+            skSrcDatasetNames.append(defaultRowsDatasetName)
+
+        for skSrcDatasetName in skSrcDatasetNames:
+            dfl.dropColumns(
+                dataset=skSrcDatasetName,
+                colsToKeep=colsToKeep,
+                desc='Drop all cols of ' + skSrcDatasetName + ' except SK ' +
+                     '& NKs (including audit cols)',
+                dropAuditCols=True)
+
+        dfl.union(
+            datasets=skSrcDatasetNames,
+            targetDataset=skDatasetName,
+            desc='Combine the SK/NK mappings of the data and default rows')
+
+    else:
+
+        dfl.read(
+            tableName=tableSchema.tableName,
+            targetDataset=skDatasetName,
+            dataLayer='BSE',
+            forceDBRead=True,
+            desc='The SKs were generated as we wrote to the DB. We will ' +
+                 'need these SKs (and their corresponding NKs) when we ' +
+                 'load the fact table (later), so we pull the sk/nks ' +
+                 'mapping back out now)')
 
     dfl.replace(
         dataset=skDatasetName,
@@ -288,7 +326,6 @@ def bulkLoadDimension(conf, tableSchema, defaultRows):
         regex=True,
         desc='Make all None values come through as empty strings')
 
-    colsToKeep = [tableSchema.surrogateKeyColName] + tableSchema.colNames_NKs
     dfl.dropColumns(
         dataset=skDatasetName,
         colsToKeep=colsToKeep,
@@ -300,10 +337,16 @@ def bulkLoadDimension(conf, tableSchema, defaultRows):
         columns={tableSchema.surrogateKeyColName: 'sk'},
         desc='Rename the SK column to "sk"')
 
-    dfl.addColumns(
-        dataset=skDatasetName,
-        columns={'nk': concatenateNKs},
-        desc='Concatenate the NK columns into a single "nk" column')
+    if conf.NK_ENCODING == 'HASH':
+        dfl.collapseNaturalKeyCols(
+            dataset=skDatasetName,
+            targetTableName=skDatasetName,
+            naturalKeyCols={'nk': tableSchema.colNames_NKs})
+    else:
+        dfl.addColumns(
+            dataset=skDatasetName,
+            columns={'nk': concatenateNKs},
+            desc='Concatenate the NK columns into a single "nk" column')
 
     dfl.dropColumns(
         dataset=skDatasetName,
@@ -313,7 +356,20 @@ def bulkLoadDimension(conf, tableSchema, defaultRows):
     dfl.write(
         dataset=skDatasetName,
         targetTableName=skDatasetName,
-        dataLayerID='LOD')
+        dataLayerID='LOD',
+        keepDataflowOpen=True)
+
+    # Fact loads in this process mustn't use the mapping they had cached
+    keyMapIO.invalidateKeyMap(tableSchema.tableName)
+
+    if conf.NK_ENCODING == 'HASH':
+        dfl.writeKeyMap(
+            dataset=skDatasetName,
+            dimensionName=tableSchema.tableName,
+            desc='Write the SK/NK mapping as sorted arrays too, which ' +
+                 'the fact loads memory-map rather than read')
+
+    dfl.close()
 
 
 def concatenateNKs(row):
@@ -356,57 +412,20 @@ def bulkLoadFact(conf, tableSchema):
         dataset=tableSchema.tableName,
         desc='Collapse the audit columns into their NK')
 
-    # now join all nks to their respective dims sk/nk mappings, & load the fact
+    # now resolve all nks to their respective dims' sks, in one pass
 
+    fkColumns = {}
     for column in tableSchema.columns:
         if column.isFK:
-            keyMapTableName = 'sk_' + column.fkDimension
-            dfl.read(
-                tableName=keyMapTableName,
-                targetDataset=keyMapTableName + '.' + column.columnName,
-                dataLayer='LOD',
-                desc='Read the SK/NK mapping for column ' + column.columnName +
-                     '. Then (silently) rename the sk/nk mapping cols to ' +
-                     'match the fact table, join with the dim, assign all ' +
-                     'missing rows to -1 row, & drop the nk col from the fact')
-
             nkColName = column.columnName.replace('fk_', 'nk_')
+            fkColumns[column.columnName] = (nkColName, column.fkDimension)
 
-            dfl.renameColumns(
-                dataset=keyMapTableName + '.' + column.columnName,
-                columns={
-                    'sk': column.columnName,
-                    'nk': nkColName},
-                desc='Rename the columns of the ' + column.fkDimension + ' ' +
-                     'SK/NK mapping to match the fact table column names ' +
-                     ' (' + column.columnName + ')',
-                silent=True)
-
-            df = dfl.getDataFrames()
-            
-            dfl.join(
-                datasets=[
-                    tableSchema.tableName,
-                    keyMapTableName + '.' + column.columnName],
-                targetDataset=tableSchema.tableName,
-                joinCol=nkColName,
-                how='left',
-                desc="Merging dim's SK with fact for column " +
-                     column.columnName,
-                silent=True)
-
-            dfl.setNulls(
-                dataset=tableSchema.tableName,
-                columns={column.columnName: -1},
-                desc='Assigning all missing rows to default -1 row (' +
-                     column.columnName + ')',
-                silent=True)
-
-            dfl.dropColumns(
-                dataset=tableSchema.tableName,
-                colsToDrop=[nkColName],
-                desc='Dropping the natural key column: ' + nkColName,
-                silent=True)
+    dfl.resolveSurrogateKeys(
+        dataset=tableSchema.tableName,
+        fkColumns=fkColumns,
+        desc='Read the SK/NK mapping of each dimension the fact ' +
+             'references, look up the SK of every FK column, assign all ' +
+             'missing rows to -1 row, & drop the nk cols from the fact')
 
     # WRITE DATA
 
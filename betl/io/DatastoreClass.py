@@ -9,3 +9,7 @@ class Datastore():
         self.datatoreID = datastoreID
         self.datastoreType = datastoreType
         self.isSrcSys = isSrcSys
+
+    def close(self):
+        # Datastores that hold connections or open files release them here
+        pass
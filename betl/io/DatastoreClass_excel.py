@@ -20,20 +20,50 @@ class ExcelDatastore(Datastore):
         self.ssID = ssID
         self.path = path
         self.filename = filename
-        self.conn = self.getExcelConnection()
-        self.worksheets = self.getWorksheets()
+
+        # We don't open the workbook until something needs it
+        self.workbook = None
+        self.workbookWorksheets = None
+
+    @property
+    def conn(self):
+        if self.workbook is None:
+            self.workbook = self.getExcelConnection()
+        return self.workbook
+
+    @property
+    def worksheets(self):
+        if self.workbookWorksheets is None:
+            self.getWorksheets()
+        return self.workbookWorksheets
+
+    def getFilePath(self, tableName):
+        # Every table (worksheet) is in the same file
+        return self.path + self.filename
 
     def getExcelConnection(self):
-        return load_workbook(filename=self.path + self.filename)
+        # Read-only mode parses sheets lazily, as their rows are iterated,
+        # and skips cell styles. data_only gives us the values of formula
+        # cells (as last calculated by Excel), not the formulas
+        return load_workbook(filename=self.path + self.filename,
+                             read_only=True,
+                             data_only=True)
 
     def getWorksheets(self):
 
         worksheets = {}
         for ws in self.conn.worksheets:
             worksheets[ws.title] = ws
-        self.worksheets = worksheets
+        self.workbookWorksheets = worksheets
         return worksheets
 
+    def close(self):
+        # Read-only workbooks hold the file open until they're closed
+        if self.workbook is not None:
+            self.workbook.close()
+            self.workbook = None
+            self.workbookWorksheets = None
+
     def __str__(self):
         string = ('\n\n' + '*** Datastore: ' +
                   self.ssID + ' (' + self.datastoreType + ', ' +
@@ -4,6 +4,7 @@ from .DatastoreClass import Datastore
 class FileDatastore(Datastore):
 
     def __init__(self, fileSysID, path, fileExt, delim, quotechar,
+                 parallelParseThresholdMB=None, parallelParseProcesses=None,
                  isSrcSys=False):
 
         Datastore.__init__(self,
@@ -16,3 +17,11 @@ class FileDatastore(Datastore):
         self.fileExt = fileExt
         self.delim = delim
         self.quotechar = quotechar
+
+        # Files at least this big are split into byte ranges and parsed
+        # in a pool of processes. None means we never parse in parallel
+        self.parallelParseThresholdMB = parallelParseThresholdMB
+        self.parallelParseProcesses = parallelParseProcesses
+
+    def getFilePath(self, tableName):
+        return self.path + tableName + self.fileExt
@@ -1,9 +1,6 @@
 from .DatastoreClass import Datastore
-
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from apiclient.discovery import build
-import httplib2
+from . import cacheIO
+from . import gsheetClient
 
 
 class GsheetDatastore(Datastore):
@@ -14,7 +11,10 @@ class GsheetDatastore(Datastore):
                  apiKey,
                  filename,
                  isSrcSys=False,
-                 isSchemaDesc=False):
+                 isSchemaDesc=False,
+                 cachePath=None,
+                 cacheMaxSizeMB=None,
+                 client=None):
 
         Datastore.__init__(self,
                            datastoreID=ssID,
@@ -22,42 +22,231 @@ class GsheetDatastore(Datastore):
                            isSrcSys=isSrcSys,
                            isSchemaDesc=isSchemaDesc)
 
-        # TODO don't do all this on init, it slows down the start
-        # of the job, which has a diproportionate effect on dev time.
         self.ssID = ssID
         self.apiScope = apiScope
         self.apiKey = apiKey
         self.filename = filename
-        self.conn = self.getGsheetConnection()
-        self.worksheets = self.getWorksheets()
-        self.gdriveConn = self.getGdriveConnection()
-        self.lastModifiedTime = self.getLastModifiedTime()
+
+        # If we have a cachePath, worksheet contents are cached on disk,
+        # keyed on the spreadsheet's modifiedTime
+        self.cachePath = cachePath
+        self.cacheMaxSizeMB = cacheMaxSizeMB
+
+        # All our requests to Google go through a client shared with the
+        # other GSHEET datastores, which batches, rate limits and retries
+        if client is None:
+            client = gsheetClient.getClient(apiKey, apiScope)
+        self.client = client
+
+        # Every one of these is at least one request to Google, so we don't
+        # make them until they're needed, and then only once
+        self.gsheetConn = None
+        self.gsheetWorksheets = None
+        self.gsheetVersion = None
+        # We find the spreadsheet by name once, then use its ID, so the
+        # cache is keyed on the same spreadsheet we read
+        self.spreadsheetId = None
+
+    @property
+    def conn(self):
+        if self.gsheetConn is None:
+            self.gsheetConn = self.getGsheetConnection()
+        return self.gsheetConn
+
+    @property
+    def worksheets(self):
+        if self.gsheetWorksheets is None:
+            self.getWorksheets()
+        return self.gsheetWorksheets
+
+    # The spreadsheet's (ID, Drive modifiedTime), which key our cached
+    # reads. Getting it costs one request to Google, made once per datastore
+    # (so once per run, as Conf keeps its datastores) and again after each
+    # of our writes
+    @property
+    def version(self):
+        if self.gsheetVersion is None:
+            self.gsheetVersion = self.getVersion()
+        return self.gsheetVersion
+
+    @property
+    def lastModifiedTime(self):
+        return self.version[1]
 
     def getGsheetConnection(self):
-        _client = gspread.authorize(
-            ServiceAccountCredentials.from_json_keyfile_name(
-                self.apiKey,
-                self.apiScope))
-        return _client.open(self.filename)
-
-    def getGdriveConnection(self):
-        creds = ServiceAccountCredentials.from_json_keyfile_name(
-            self.apiKey,
-            'https://www.googleapis.com/auth/drive.metadata.readonly')
-        return build('drive', 'v3', http=creds.authorize(httplib2.Http()))
+        if self.spreadsheetId is not None:
+            return self.client.openSpreadsheetById(self.spreadsheetId)
+        spreadsheet = self.client.openSpreadsheet(self.filename)
+        self.spreadsheetId = spreadsheet.id
+        return spreadsheet
 
+    # Always fetches the worksheet list, so call this (rather than use
+    # .worksheets) when you need to see worksheets added since
     def getWorksheets(self):
         worksheets = {}
-        for ws in self.conn.worksheets():
+        for ws in self.client.getWorksheets(self.conn):
             worksheets[ws.title] = ws
-        self.worksheets = worksheets
+        self.gsheetWorksheets = worksheets
         return worksheets
 
-    def getLastModifiedTime(self):
-        result = self.gdriveConn.files().get(
-            fileId=self.conn.id,
-            fields='modifiedTime').execute()
-        return result['modifiedTime']
+    # The contents of a worksheet, as a list of rows (like get_all_values)
+    # or a list of dicts (like get_all_records). They are served from the
+    # cache if the spreadsheet hasn't been modified since they were cached
+    def getWorksheetValues(self, worksheetTitle):
+        return self.getWorksheetsValues([worksheetTitle])[worksheetTitle]
+
+    def getWorksheetRecords(self, worksheetTitle):
+        return gsheetClient.valuesToRecords(
+            self.getWorksheetValues(worksheetTitle))
+
+    # As above, for many worksheets at once. Whatever isn't cached is
+    # fetched in batched requests (numThreads at a time), so prefer these to
+    # calling the above in a loop
+    def getWorksheetsValues(self, worksheetTitles, numThreads=1):
+
+        values = {}
+        cacheKeys = {}
+        if self.cachePath is not None:
+            for wsTitle in worksheetTitles:
+                cacheKeys[wsTitle] = cacheIO.getCacheKey(
+                    list(self.version), wsTitle)
+                cachedValues = cacheIO.readCachedJson(
+                    self.cachePath, cacheKeys[wsTitle])
+                if cachedValues is not None:
+                    values[wsTitle] = cachedValues
+
+        titlesToFetch = [t for t in worksheetTitles if t not in values]
+        if len(titlesToFetch) == 0:
+            return values
+        fetchedValues = self.client.batchGetValues(
+            self.conn,
+            [gsheetClient.quoteWorksheetTitle(t) for t in titlesToFetch],
+            numThreads=numThreads)
+
+        for wsTitle, wsValues in zip(titlesToFetch, fetchedValues):
+            values[wsTitle] = wsValues
+            if self.cachePath is not None:
+                cacheIO.writeCachedJson(
+                    cachePath=self.cachePath,
+                    cacheKey=cacheKeys[wsTitle],
+                    content=wsValues,
+                    maxAgeDays=None,
+                    maxSizeMB=self.cacheMaxSizeMB)
+
+        return values
+
+    def getWorksheetsRecords(self, worksheetTitles, numThreads=1):
+        values = self.getWorksheetsValues(worksheetTitles, numThreads)
+        return {wsTitle: gsheetClient.valuesToRecords(values[wsTitle])
+                for wsTitle in values}
+
+    # The first row of each worksheet (e.g. to read the column headings of
+    # every table in a source system), in one request
+    def getWorksheetsHeaderRows(self, worksheetTitles):
+        headerRows = self.client.batchGetValues(
+            self.conn,
+            [gsheetClient.quoteWorksheetTitle(t) + '!1:1'
+             for t in worksheetTitles])
+        return {wsTitle: (rows[0] if len(rows) > 0 else [])
+                for wsTitle, rows in zip(worksheetTitles, headerRows)}
+
+    # Rows firstRow to lastRow (one-based, inclusive) of a worksheet, in
+    # one request. Never cached, because it's only part of the worksheet
+    def getWorksheetRows(self, worksheetTitle, firstRow, lastRow):
+        return self.client.batchGetValues(
+            self.conn,
+            [gsheetClient.quoteWorksheetTitle(worksheetTitle) + '!' +
+             str(firstRow) + ':' + str(lastRow)])[0]
+
+    # A generator of the rows of a worksheet (up to lastRow), a page of
+    # pageRows rows per request. The API doesn't return trailing empty rows,
+    # so we hold back a page's missing rows until we know there's more data
+    # below them. Rows are not padded to the same length
+    def getWorksheetPages(self, worksheetTitle, pageRows, lastRow=None):
+
+        rowCount = self.worksheets[worksheetTitle].row_count
+        if lastRow is not None:
+            rowCount = min(rowCount, lastRow)
+
+        emptyRows = 0
+        for firstRow in range(1, rowCount + 1, pageRows):
+            pageLastRow = min(firstRow + pageRows - 1, rowCount)
+            rows = self.getWorksheetRows(worksheetTitle, firstRow, pageLastRow)
+            if len(rows) > 0:
+                yield [[] for i in range(emptyRows)] + rows
+                emptyRows = 0
+            emptyRows += pageLastRow - firstRow + 1 - len(rows)
+
+    # Replace the contents of existing worksheets with valuesByTitle
+    # (worksheet title: list of rows), all in one request. If resize, the
+    # worksheets are resized to fit their new contents
+    def writeWorksheets(self, valuesByTitle, resize=False):
+
+        requests = []
+        for wsTitle, rows in valuesByTitle.items():
+            sheetId = self.worksheets[wsTitle].id
+            if resize:
+                requests.append(gsheetClient.getResizeRequest(
+                    sheetId,
+                    rowCount=max(1, len(rows)),
+                    columnCount=max([1] + [len(row) for row in rows])))
+            requests.append(gsheetClient.getClearCellsRequest(sheetId))
+            requests.append(gsheetClient.getUpdateCellsRequest(sheetId, rows))
+
+        self.client.batchUpdate(self.conn, requests)
+        self.resetLastModifiedTime()
+
+    def writeWorksheet(self, worksheetTitle, rows, resize=False):
+        self.writeWorksheets({worksheetTitle: rows}, resize=resize)
+
+    # Add new worksheets, sized to and populated with valuesByTitle
+    # (worksheet title: list of rows), in one request
+    def addWorksheets(self, valuesByTitle):
+
+        nextSheetId = max(
+            [ws.id for ws in self.worksheets.values()], default=0) + 1
+
+        requests = []
+        for wsTitle, rows in valuesByTitle.items():
+            requests.append(gsheetClient.getAddSheetRequest(
+                nextSheetId,
+                wsTitle,
+                rowCount=max(1, len(rows)),
+                columnCount=max([1] + [len(row) for row in rows])))
+            requests.append(
+                gsheetClient.getUpdateCellsRequest(nextSheetId, rows))
+            nextSheetId += 1
+
+        self.client.batchUpdate(self.conn, requests)
+        self.gsheetWorksheets = None
+        self.resetLastModifiedTime()
+
+    def deleteWorksheets(self, worksheetTitles):
+
+        requests = [
+            gsheetClient.getDeleteSheetRequest(self.worksheets[t].id)
+            for t in worksheetTitles]
+
+        self.client.batchUpdate(self.conn, requests)
+        self.gsheetWorksheets = None
+        self.resetLastModifiedTime()
+
+    # Called after writing to the spreadsheet, so that later reads don't
+    # come from the cache
+    def resetLastModifiedTime(self):
+        self.gsheetVersion = None
+
+    # If we don't know the spreadsheet's ID yet, we look it up by name on
+    # Drive, which gives us its ID and modifiedTime without opening it
+    # (which is itself two requests). So reads that are all cache hits cost
+    # this one request. After that we ask for the ID's modifiedTime
+    def getVersion(self):
+        if self.spreadsheetId is None:
+            self.spreadsheetId, modifiedTime = \
+                self.client.getSpreadsheetVersion(self.filename)
+            return (self.spreadsheetId, modifiedTime)
+        return (self.spreadsheetId,
+                self.client.getModifiedTime(self.spreadsheetId))
 
     def __str__(self):
         string = ('\n\n' + '*** Datastore: ' +
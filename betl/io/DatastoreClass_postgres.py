@@ -2,13 +2,40 @@ from .DatastoreClass import Datastore
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 import sqlalchemy
+import threading
+import time
+
+# Connections and engines are shared by every PostgresDatastore in the
+# process (i.e. across Conf objects and DataFlows), keyed on the database
+# and whether the connection is read-only
+CONNECTION_POOLS = {}
+ENGINES = {}
+POOLS_LOCK = threading.Lock()
+
+# Databases we've already checked exist (or created), so we only make the
+# temporary connection to the postgres DB once per database per process.
+# Each database gets its own lock for the check, so a slow connection to one
+# server doesn't hold up every other datastore waiting on POOLS_LOCK
+CHECKED_DATABASES = set()
+CHECK_DATABASE_LOCKS = {}
+
+DEFAULT_POOL_SIZE = 10
+# No more than this many connections are open from one pool at once. When
+# they're all in use, getConnection waits up to DEFAULT_POOL_TIMEOUT seconds
+# for one to be released
+DEFAULT_POOL_MAX_OPEN = 50
+DEFAULT_POOL_TIMEOUT = 60
 
 
 class PostgresDatastore(Datastore):
 
     def __init__(self, dbId, host, dbName, user, password, schema=None,
                  createIfNotFound=False,
-                 isSrcSys=False):
+                 isSrcSys=False,
+                 partitionedReads=None,
+                 poolSize=DEFAULT_POOL_SIZE,
+                 poolMaxOpen=DEFAULT_POOL_MAX_OPEN,
+                 poolTimeout=DEFAULT_POOL_TIMEOUT):
 
         Datastore.__init__(self,
                            datastoreID=dbId,
@@ -21,21 +48,19 @@ class PostgresDatastore(Datastore):
         self.user = user
         self.password = password
         self.schema = schema
-        self.conn = self.getDBConnection(createIfNotFound, isSrcSys)
-
-        schemaDict = None
-        if schema is not None:
-            schemaDict = {'options': '-csearch_path={}'.format(self.schema)}
-
-        self.eng = sqlalchemy.create_engine(
-            r'postgresql://'
-            + self.user
-            + ':' + self.password
-            + '@'
-            + self.host
-            + '/'
-            + self.dbName,
-            connect_args=schemaDict)
+        self.createIfNotFound = createIfNotFound
+        # Tables to read over several connections at once, as a dict of
+        # tableName: (partition column, number of partitions)
+        if partitionedReads is None:
+            partitionedReads = {}
+        self.partitionedReads = partitionedReads
+        self.poolSize = poolSize
+        self.poolMaxOpen = poolMaxOpen
+        self.poolTimeout = poolTimeout
+
+        # We don't connect until something needs the connection or engine
+        self.datastoreConn = None
+        self.datastoreEng = None
 
         # @sqlalchemy.event.listens_for(self.eng, 'before_cursor_execute')
         # def receive_before_cursor_execute(conn, cursor, statement, params, context, executemany):
@@ -44,6 +69,41 @@ class PostgresDatastore(Datastore):
         #         cursor.fast_executemany = True
         #         cursor.commit()
 
+    # The datastore's own connection, checked out of the pool the first time
+    # it's used and held until close(). Conf.closeDatastores() closes every
+    # datastore at the end of each task, so the connection goes back to the
+    # pool and the next task checks out a fresh one
+    @property
+    def conn(self):
+        if self.datastoreConn is None:
+            self.datastoreConn = self.getConnection(readonly=self.isSrcSys)
+        return self.datastoreConn
+
+    # SQLAlchemy engines pool their own connections, so we share one engine
+    # per database across the process
+    @property
+    def eng(self):
+        if self.datastoreEng is None:
+            self.checkDatabaseExists()
+            key = (self.host, self.dbName, self.user, self.schema)
+            with POOLS_LOCK:
+                if key not in ENGINES:
+                    schemaDict = None
+                    if self.schema is not None:
+                        schemaDict = {
+                            'options': '-csearch_path={}'.format(self.schema)}
+                    ENGINES[key] = sqlalchemy.create_engine(
+                        r'postgresql://'
+                        + self.user
+                        + ':' + self.password
+                        + '@'
+                        + self.host
+                        + '/'
+                        + self.dbName,
+                        connect_args=schemaDict)
+                self.datastoreEng = ENGINES[key]
+        return self.datastoreEng
+
     def commit(self):
         self.conn.commit()
 
@@ -53,22 +113,137 @@ class PostgresDatastore(Datastore):
     def cursor(self):
         return self.conn.cursor()
 
-    def getDBConnection(self, createIfNotFound, isSrcSys):
+    def close(self):
+        # Hand the datastore's connection back to the pool
+        if self.datastoreConn is not None:
+            self.releaseConnection(self.datastoreConn)
+            self.datastoreConn = None
+
+    def getConnection(self, readonly=False):
+        # A connection from the pool (opened if the pool has none idle), in
+        # addition to self.conn (e.g. for reading a table over several
+        # connections at once). Give it back with releaseConnection()
+        self.checkDatabaseExists()
+        return self.getPool(readonly).getConnection()
+
+    def releaseConnection(self, conn):
+        self.getPool(bool(conn.readonly)).releaseConnection(conn)
+
+    def getPool(self, readonly):
+        key = (self.host, self.dbName, self.user, self.schema, readonly)
+        with POOLS_LOCK:
+            if key not in CONNECTION_POOLS:
+                CONNECTION_POOLS[key] = PostgresConnectionPool(
+                    host=self.host,
+                    dbName=self.dbName,
+                    user=self.user,
+                    password=self.password,
+                    schema=self.schema,
+                    readonly=readonly,
+                    poolSize=self.poolSize,
+                    maxOpen=self.poolMaxOpen,
+                    timeout=self.poolTimeout)
+            return CONNECTION_POOLS[key]
+
+    def checkDatabaseExists(self):
         # We will temporarily connect to the postgres database, to check
-        # whether configDetails['DBNAME'] exists yet
+        # whether configDetails['DBNAME'] exists yet. We only need to do
+        # this if we're going to create it, and only once
+
+        if not self.createIfNotFound:
+            return
+
+        key = (self.host, self.dbName)
+        with POOLS_LOCK:
+            if key in CHECKED_DATABASES:
+                return
+            if key not in CHECK_DATABASE_LOCKS:
+                CHECK_DATABASE_LOCKS[key] = threading.Lock()
+            checkLock = CHECK_DATABASE_LOCKS[key]
+
+        with checkLock:
+            # Someone else may have checked while we waited for the lock
+            with POOLS_LOCK:
+                if key in CHECKED_DATABASES:
+                    return
+
+            tempConn = psycopg2.connect(host=self.host,
+                                        database='postgres',
+                                        user=self.user,
+                                        password=self.password)
+            try:
+                tempDBCursor = tempConn.cursor()
+                tempDBCursor.execute("SELECT * FROM pg_database " +
+                                     "WHERE datname = '" + self.dbName + "'")
+                dbs = tempDBCursor.fetchall()
+
+                if len(dbs) == 0:
+                    tempConn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                    tempDBCursor.execute('CREATE DATABASE ' + self.dbName)
+            finally:
+                tempConn.close()
+
+            with POOLS_LOCK:
+                CHECKED_DATABASES.add(key)
+
+
+class PostgresConnectionPool():
 
-        tempConn = psycopg2.connect(host=self.host,
-                                    database='postgres',
-                                    user=self.user,
-                                    password=self.password)
-        tempDBCursor = tempConn.cursor()
-        tempDBCursor.execute("SELECT * FROM pg_database " +
-                             "WHERE datname = '" + self.dbName + "'")
-        dbs = tempDBCursor.fetchall()
+    # Connections are opened lazily, when nothing idle is available. Up to
+    # poolSize connections are kept idle for reuse; any more are closed when
+    # they're released. No more than maxOpen are open at once: when they're
+    # all checked out, getConnection waits (up to timeout seconds) for one
+    # to be released
 
-        if(len(dbs) == 0 and createIfNotFound):
-            tempConn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-            tempDBCursor.execute('CREATE DATABASE ' + self.dbName)
+    def __init__(self, host, dbName, user, password, schema, readonly,
+                 poolSize, maxOpen=DEFAULT_POOL_MAX_OPEN,
+                 timeout=DEFAULT_POOL_TIMEOUT):
+
+        self.host = host
+        self.dbName = dbName
+        self.user = user
+        self.password = password
+        self.schema = schema
+        self.readonly = readonly
+        self.poolSize = poolSize
+        self.maxOpen = maxOpen
+        self.timeout = timeout
+
+        self.idleConns = []
+        # Connections checked out or idle, plus any being opened
+        self.openCount = 0
+        self.lock = threading.Lock()
+        self.released = threading.Condition(self.lock)
+
+    def getConnection(self):
+
+        deadline = time.time() + self.timeout
+        with self.lock:
+            while True:
+                while len(self.idleConns) > 0:
+                    conn = self.idleConns.pop()
+                    if not conn.closed:
+                        return conn
+                    self.openCount -= 1
+                if self.openCount < self.maxOpen:
+                    self.openCount += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise ValueError(
+                        'Timed out waiting for a connection to ' +
+                        self.dbName + ': all ' + str(self.maxOpen) +
+                        ' are in use. Release connections when you are ' +
+                        'done with them, or raise DB_POOL_MAX_OPEN')
+                self.released.wait(remaining)
+
+        try:
+            return self.openConnection()
+        except BaseException:
+            self.connectionClosed()
+            raise
+
+    def openConnection(self):
 
         options = None
         if self.schema is not None:
@@ -79,7 +254,46 @@ class PostgresDatastore(Datastore):
                                 user=self.user,
                                 password=self.password,
                                 options=options)
-        if isSrcSys:
+        if self.readonly:
             conn.set_session(readonly=True)
 
         return conn
+
+    def releaseConnection(self, conn):
+
+        if conn.closed:
+            self.connectionClosed()
+            return
+
+        # Whoever had the connection may have left a transaction open or
+        # changed the session (e.g. the isolation level), so we put it back
+        # as we found it
+        try:
+            conn.rollback()
+            readonly = 'DEFAULT'
+            if self.readonly:
+                readonly = True
+            conn.set_session(isolation_level='DEFAULT',
+                             readonly=readonly,
+                             deferrable='DEFAULT',
+                             autocommit=False)
+        except psycopg2.Error:
+            conn.close()
+            self.connectionClosed()
+            return
+
+        with self.lock:
+            if len(self.idleConns) < self.poolSize:
+                self.idleConns.append(conn)
+                self.released.notify()
+                return
+
+        conn.close()
+        self.connectionClosed()
+
+    def connectionClosed(self):
+
+        # Makes room for someone waiting to open a new connection
+        with self.lock:
+            self.openCount -= 1
+            self.released.notify()
@@ -14,6 +14,7 @@ class SqliteDatastore(Datastore):
         self.dbId = dbId
         self.path = path
         self.filename = filename
+        self.schema = None
         # NOTE: you're supposed to be able to connect in read-only mode using:
         # readOnlyString = ''
         # if isSrcSys:
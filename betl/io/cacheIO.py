@@ -0,0 +1,281 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import hashlib
+import json
+import os
+import time
+from betl.io import fileIO
+
+
+# How much of a file we hash at a time
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+CACHE_FILE_EXT = '.parquet'
+JSON_CACHE_FILE_EXT = '.json'
+
+
+def getFileFingerprint(filePath, lastFingerprints=()):
+
+    # Size and mtime are free, but a file can be rewritten with the same
+    # size inside the mtime's resolution, so we hash the content too.
+    # Hashing is a sequential read, far cheaper than parsing the file, but
+    # still a read of the whole file. So if one of lastFingerprints (ones
+    # we took earlier) has the file's current size and mtime, we reuse its
+    # hash. If they have changed we hash again, because a file that has
+    # only been touched (or copied over with the same content) hasn't
+    # really changed
+    stat = os.stat(filePath)
+    fingerprint = {
+        'path': os.path.abspath(filePath),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns}
+
+    for lastFingerprint in lastFingerprints:
+        if isinstance(lastFingerprint, dict) and 'hash' in lastFingerprint \
+                and all(lastFingerprint.get(key) == fingerprint[key]
+                        for key in fingerprint):
+            fingerprint['hash'] = lastFingerprint['hash']
+            return fingerprint
+
+    contentHash = hashlib.sha256()
+    with open(filePath, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            contentHash.update(block)
+
+    fingerprint['hash'] = contentHash.hexdigest()
+    return fingerprint
+
+
+def getCacheKey(fingerprint, tableName):
+
+    # One file can hold many tables (e.g. an Excel workbook's worksheets)
+    keyText = json.dumps([fingerprint, tableName], sort_keys=True)
+    return hashlib.sha256(keyText.encode('utf-8')).hexdigest()
+
+
+def readCachedData(cachePath, cacheKey):
+
+    # Returns None if there's nothing cached under this key
+    filePath = cachePath + '/' + cacheKey + CACHE_FILE_EXT
+    if not os.path.exists(filePath):
+        return None
+
+    df = cachedTableToDataFrame(pq.read_table(filePath))
+
+    # Eviction goes by the time an entry was last used
+    os.utime(filePath)
+
+    return df
+
+
+def cachedTableToDataFrame(table):
+
+    # Integer columns with nulls come back as objects (ints and Nones), as
+    # they were parsed, rather than as floats
+    return table.to_pandas(integer_object_nulls=True)
+
+
+def writeCachedData(cachePath, cacheKey, df, maxAgeDays, maxSizeMB):
+
+    # Returns df as a cache hit will give it back (e.g. a column of mixed
+    # ints and strings comes back as strings), so the caller can carry on
+    # with the same data it'll get from the cache next time
+
+    if not os.path.exists(cachePath):
+        os.makedirs(cachePath, exist_ok=True)
+
+    # Write to a temp file and rename it into place, so a concurrent reader
+    # never sees half a file
+    filePath = cachePath + '/' + cacheKey + CACHE_FILE_EXT
+    tmpFilePath = filePath + '.' + str(os.getpid()) + '.tmp'
+    table = fileIO.dataFrameToArrowTable(df)
+    pq.write_table(table, tmpFilePath)
+    os.replace(tmpFilePath, filePath)
+
+    evictCachedData(cachePath, maxAgeDays, maxSizeMB)
+
+    return cachedTableToDataFrame(table)
+
+
+def readCachedDataInChunks(cachePath, cacheKey, chunkSize):
+
+    # As readCachedData, but a generator of dataframes of at most chunkSize
+    # rows, read from the file a batch at a time. Returns None if there's
+    # nothing cached under this key
+    filePath = cachePath + '/' + cacheKey + CACHE_FILE_EXT
+    if not os.path.exists(filePath):
+        return None
+
+    parquetFile = pq.ParquetFile(filePath)
+    os.utime(filePath)
+
+    return iterCachedDataChunks(parquetFile, chunkSize)
+
+
+def iterCachedDataChunks(parquetFile, chunkSize):
+
+    chunkCount = 0
+    for batch in parquetFile.iter_batches(batch_size=chunkSize):
+        chunkCount += 1
+        yield cachedTableToDataFrame(batch)
+
+    # As with the source readers, no rows still gives one (empty) chunk
+    if chunkCount == 0:
+        yield cachedTableToDataFrame(parquetFile.schema_arrow.empty_table())
+
+
+class CachedDataWriter():
+
+    # Writes a cache entry a chunk at a time, for extracts that stream their
+    # source. If a later chunk's columns can't take the types of the first
+    # chunk's (e.g. an Excel column of numbers that later holds text), we
+    # give up on caching the file, rather than on the extract. As with
+    # writeCachedData, write() returns each chunk as a cache hit will give
+    # it back (or unchanged, once we've given up)
+
+    def __init__(self, cachePath, cacheKey, maxAgeDays, maxSizeMB):
+        self.cachePath = cachePath
+        self.filePath = cachePath + '/' + cacheKey + CACHE_FILE_EXT
+        self.tmpFilePath = self.filePath + '.' + str(os.getpid()) + '.tmp'
+        self.maxAgeDays = maxAgeDays
+        self.maxSizeMB = maxSizeMB
+        self.writer = None
+        self.abandoned = False
+
+    def write(self, df):
+
+        if self.abandoned:
+            return df
+
+        table = fileIO.dataFrameToArrowTable(df)
+        if self.writer is None:
+            if not os.path.exists(self.cachePath):
+                os.makedirs(self.cachePath, exist_ok=True)
+            self.writer = pq.ParquetWriter(self.tmpFilePath, table.schema)
+        elif not table.schema.equals(self.writer.schema):
+            try:
+                table = table.cast(self.writer.schema)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError,
+                    ValueError):
+                self.abandon()
+                return df
+
+        self.writer.write_table(table)
+        return cachedTableToDataFrame(table)
+
+    def close(self):
+
+        if self.abandoned or self.writer is None:
+            return
+
+        self.writer.close()
+        os.replace(self.tmpFilePath, self.filePath)
+
+        evictCachedData(self.cachePath, self.maxAgeDays, self.maxSizeMB)
+
+    def abandon(self):
+
+        if self.writer is not None:
+            self.writer.close()
+            removeCacheFile(self.tmpFilePath)
+        self.abandoned = True
+
+
+def readCachedJson(cachePath, cacheKey):
+
+    # As readCachedData, for content that isn't a dataframe (e.g. the
+    # values of a Google worksheet)
+    filePath = cachePath + '/' + cacheKey + JSON_CACHE_FILE_EXT
+    if not os.path.exists(filePath):
+        return None
+
+    with open(filePath, 'r') as f:
+        content = json.load(f)
+
+    os.utime(filePath)
+
+    return content
+
+
+def writeCachedJson(cachePath, cacheKey, content, maxAgeDays, maxSizeMB):
+
+    if not os.path.exists(cachePath):
+        os.makedirs(cachePath, exist_ok=True)
+
+    filePath = cachePath + '/' + cacheKey + JSON_CACHE_FILE_EXT
+    tmpFilePath = filePath + '.' + str(os.getpid()) + '.tmp'
+    with open(tmpFilePath, 'w') as f:
+        json.dump(content, f)
+    os.replace(tmpFilePath, filePath)
+
+    evictCachedData(cachePath, maxAgeDays, maxSizeMB, JSON_CACHE_FILE_EXT)
+
+
+def evictCachedData(cachePath, maxAgeDays, maxSizeMB,
+                    fileExt=CACHE_FILE_EXT):
+
+    # Delete entries not used for maxAgeDays (if given), then the least
+    # recently used entries until the cache fits in maxSizeMB
+
+    entries = []
+    for filename in os.listdir(cachePath):
+        if not filename.endswith(fileExt):
+            continue
+        filePath = cachePath + '/' + filename
+        try:
+            stat = os.stat(filePath)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, filePath))
+
+    oldestAllowed = None
+    if maxAgeDays is not None:
+        oldestAllowed = time.time() - maxAgeDays * 24 * 60 * 60
+    totalSize = 0
+    toKeep = []
+    for lastUsed, size, filePath in sorted(entries, reverse=True):
+        if oldestAllowed is not None and lastUsed < oldestAllowed:
+            removeCacheFile(filePath)
+        else:
+            toKeep.append((size, filePath))
+            totalSize += size
+
+    maxSize = maxSizeMB * 1024 * 1024
+    while totalSize > maxSize and len(toKeep) > 0:
+        size, filePath = toKeep.pop()
+        removeCacheFile(filePath)
+        totalSize -= size
+
+
+def removeCacheFile(filePath):
+
+    # Another process may have got there first
+    try:
+        os.remove(filePath)
+    except FileNotFoundError:
+        pass
+
+
+def readExtractState(statePath, stateKey):
+
+    # Returns what was saved for this key on the last successful extract,
+    # or None
+    filePath = statePath + '/' + stateKey + '.json'
+    if not os.path.exists(filePath):
+        return None
+    with open(filePath, 'r') as f:
+        return json.load(f)
+
+
+def writeExtractState(statePath, stateKey, state):
+
+    # One small file per key, so concurrent extract tasks never write to
+    # the same file
+    if not os.path.exists(statePath):
+        os.makedirs(statePath, exist_ok=True)
+
+    filePath = statePath + '/' + stateKey + '.json'
+    tmpFilePath = filePath + '.' + str(os.getpid()) + '.tmp'
+    with open(tmpFilePath, 'w') as f:
+        json.dump(state, f, sort_keys=True)
+    os.replace(tmpFilePath, filePath)
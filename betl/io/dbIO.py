@@ -1,47 +1,843 @@
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import psycopg2
+import csv
 import io
+import math
+import numbers
+import queue
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 
 
-def readDataFromDB(tableName, dataStore, cols='*', limitdata=None):
+# The number of rows we serialise at a time when COPYing a dataframe to
+# the database, and how much text psycopg2 asks for per read
+COPY_BATCH_SIZE = 50000
+COPY_READ_SIZE = 1024 * 1024
+
+# How much of a COPY out of the database we hold in memory before spooling
+# it to disk
+COPY_SPOOL_SIZE = 64 * 1024 * 1024
+
+# How many serialised batches a pipelined COPY can hold ready to send
+COPY_PIPELINE_DEPTH = 2
+
+# Written in place of NaNs when empty strings must not become NULL
+COPY_NULL_MARKER = '__BETL_NULL__'
+
+COPY_FORMATS = ['CSV', 'BINARY']
+
+# The pyarrow type we parse each Postgres type (by OID) into when we COPY a
+# result set out as CSV, so columns come back typed as pd.read_sql would
+# give them. Any other type (text, varchar, json...) is read as a string
+POSTGRES_COPY_READ_TYPES = {
+    16: pa.bool_(),                     # bool
+    20: pa.int64(),                     # int8
+    21: pa.int64(),                     # int2
+    23: pa.int64(),                     # int4
+    26: pa.int64(),                     # oid
+    700: pa.float64(),                  # float4
+    701: pa.float64(),                  # float8
+    1700: pa.float64(),                 # numeric (read_sql coerces to float)
+    1082: pa.date32(),                  # date
+    1114: pa.timestamp('us'),           # timestamp
+    1184: pa.timestamp('us', tz='UTC')  # timestamptz
+}
+
+# Postgres' binary COPY format: a signature, flags and header extension
+# length, then one tuple per row, then a trailer. Each field in a tuple is
+# its length (or -1 for NULL) followed by the value in Postgres' binary
+# representation
+BINARY_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+BINARY_COPY_TRAILER = struct.pack('!h', -1)
+BINARY_COPY_NULL = struct.pack('!i', -1)
+
+# Dates and timestamps are sent as days / microseconds since this date
+BINARY_COPY_EPOCH = pd.Timestamp('2000-01-01')
+
+# The data types (from the logical schema) that we can send in binary
+# format, mapped to how we encode them. A table with any other data type
+# is COPYed as CSV
+BINARY_COPY_TYPES = {
+    'SMALLINT': 'INT2',
+    'INT2': 'INT2',
+    'INTEGER': 'INT4',
+    'INT': 'INT4',
+    'INT4': 'INT4',
+    'SERIAL': 'INT4',
+    'BIGINT': 'INT8',
+    'INT8': 'INT8',
+    'BIGSERIAL': 'INT8',
+    'REAL': 'FLOAT4',
+    'FLOAT4': 'FLOAT4',
+    'DOUBLE PRECISION': 'FLOAT8',
+    'FLOAT8': 'FLOAT8',
+    'FLOAT': 'FLOAT8',
+    'DATE': 'DATE',
+    'TIMESTAMP': 'TIMESTAMP',
+    'TEXT': 'TEXT',
+    'VARCHAR': 'TEXT',
+    'CHARACTER VARYING': 'TEXT'
+}
+
+# The big-endian numpy dtype for each of the fixed-width binary encodings
+BINARY_COPY_FIXED_WIDTH_DTYPES = {
+    'INT2': '>i2',
+    'INT4': '>i4',
+    'INT8': '>i8',
+    'FLOAT4': '>f4',
+    'FLOAT8': '>f8',
+    'DATE': '>i4',
+    'TIMESTAMP': '>i8'
+}
+
+
+def readDataFromDB(tableName, dataStore, cols='*', limitdata=None,
+                   conn=None):
+
+    sql = getSelectStatement(tableName, dataStore, cols, limitdata)
+
+    # By default we read on the datastore's own connection
+    if conn is None:
+        conn = dataStore.conn
+
+    # From Postgres, we COPY the result set out as CSV and parse it a column
+    # at a time, rather than have the driver build a Python tuple per row
+    if dataStore.datastoreType == 'POSTGRES':
+        colTypes = getQueryColumnTypes(sql, conn)
+        copyBuffer = copyQueryToBuffer(sql, conn)
+        try:
+            return readCopyBuffer(copyBuffer, colTypes)
+        finally:
+            copyBuffer.close()
+
+    return pd.read_sql(sql, con=conn)
+
+
+def readDataFromDBInChunks(tableName,
+                           dataStore,
+                           chunkSize,
+                           cols='*',
+                           limitdata=None):
+
+    # A generator of dataframes, each of (at most) chunkSize rows. We always
+    # give at least one chunk, so an empty table still comes back with its
+    # columns. From Postgres, the COPY output is spooled to disk (beyond
+    # COPY_SPOOL_SIZE) and parsed a block at a time. SQLite cursors already
+    # fetch lazily.
+
+    sql = getSelectStatement(tableName, dataStore, cols, limitdata)
+
+    if dataStore.datastoreType == 'POSTGRES':
+        colTypes = getQueryColumnTypes(sql, dataStore.conn)
+        copyBuffer = copyQueryToBuffer(sql, dataStore.conn)
+        try:
+            for chunk in readCopyBufferInChunks(copyBuffer, chunkSize,
+                                                colTypes):
+                yield chunk
+        finally:
+            copyBuffer.close()
+        return
+
+    cursor = dataStore.cursor()
+    cursor.execute(sql)
+
+    chunkCount = 0
+    while True:
+        rows = cursor.fetchmany(chunkSize)
+        if len(rows) == 0 and chunkCount > 0:
+            break
+        columns = [column[0] for column in cursor.description]
+        yield pd.DataFrame(rows, columns=columns)
+        chunkCount += 1
+        if len(rows) < chunkSize:
+            break
+
+    cursor.close()
+
+
+def readDataFromDBInParallel(tableName,
+                             dataStore,
+                             partitionCol,
+                             numPartitions,
+                             cols='*'):
+
+    # Splits the table into numPartitions ranges of partitionCol (which must
+    # be numeric) and reads each range on its own pooled, read-only
+    # connection, all at once. The COPYs spend most of their time waiting on the database
+    # or in pyarrow, neither of which holds the GIL, so threads are enough
+
+    schema = ''
+    if dataStore.schema is not None:
+        schema = dataStore.schema + '.'
+
+    cursor = dataStore.cursor()
+    cursor.execute('SELECT MIN(' + partitionCol + '), ' +
+                   'MAX(' + partitionCol + ') FROM ' + schema + tableName)
+    minValue, maxValue = cursor.fetchone()
+    cursor.close()
+
+    if minValue is None:
+        return readDataFromDB(tableName, dataStore, cols)
+
+    if not (isinstance(minValue, numbers.Number) and
+            isinstance(maxValue, numbers.Number)):
+        raise ValueError('Partitioned reads need a numeric partition ' +
+                         'column, but ' + tableName + '.' + partitionCol +
+                         ' is not')
+
+    wheres = getPartitionWhereClauses(
+        partitionCol, minValue, maxValue, numPartitions)
+
+    def readPartition(where):
+        conn = dataStore.getConnection(readonly=True)
+        try:
+            sql = getSelectStatement(tableName, dataStore, cols, where=where)
+            colTypes = getQueryColumnTypes(sql, conn)
+            copyBuffer = copyQueryToBuffer(sql, conn)
+            try:
+                return readCopyBuffer(copyBuffer, colTypes)
+            finally:
+                copyBuffer.close()
+        finally:
+            dataStore.releaseConnection(conn)
+
+    with ThreadPoolExecutor(max_workers=len(wheres)) as executor:
+        dfs = list(executor.map(readPartition, wheres))
+
+    return pd.concat(dfs, ignore_index=True)
+
+
+def readDataFromDBWithSnapshot(tableNames,
+                               dataStore,
+                               numConnections,
+                               cols='*',
+                               limitdata=None):
+
+    # A generator of (tableName, dataframe), in the order the reads finish.
+    # We export a snapshot of the database once, then read the tables
+    # concurrently over a pool of numConnections read-only connections,
+    # each of which imports that snapshot. So every table is read as at the
+    # same moment, however long the extract takes. The snapshot stays
+    # valid for as long as the exporting transaction is open.
+
+    snapshotConn = dataStore.getConnection(readonly=True)
+    snapshotConn.set_session(isolation_level='REPEATABLE READ',
+                             readonly=True)
+    cursor = snapshotConn.cursor()
+    cursor.execute('SELECT pg_export_snapshot()')
+    snapshotId = cursor.fetchone()[0]
+    cursor.close()
+
+    # Each worker thread opens one connection, on its first read, and
+    # reuses it (and its snapshot transaction) for the rest of its reads
+    workerConns = []
+    workerConnsLock = threading.Lock()
+    workerState = threading.local()
+
+    def readTable(tableName):
+        if not hasattr(workerState, 'conn'):
+            workerState.conn = \
+                openSnapshotConnection(dataStore, snapshotId)
+            with workerConnsLock:
+                workerConns.append(workerState.conn)
+        return readDataFromDB(tableName=tableName,
+                              dataStore=dataStore,
+                              cols=cols,
+                              limitdata=limitdata,
+                              conn=workerState.conn)
+
+    executor = ThreadPoolExecutor(max_workers=numConnections)
+    futures = {}
+    try:
+        for tableName in tableNames:
+            futures[executor.submit(readTable, tableName)] = tableName
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+        for conn in workerConns:
+            dataStore.releaseConnection(conn)
+        dataStore.releaseConnection(snapshotConn)
+
+
+def openSnapshotConnection(dataStore, snapshotId):
+
+    # A read-only connection whose (open) transaction sees the database as
+    # at an exported snapshot. SET TRANSACTION SNAPSHOT must be the first
+    # statement of a REPEATABLE READ transaction
+    conn = dataStore.getConnection(readonly=True)
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    cursor = conn.cursor()
+    cursor.execute('SET TRANSACTION SNAPSHOT %s', (snapshotId,))
+    cursor.close()
+    return conn
+
+
+def getPartitionWhereClauses(partitionCol, minValue, maxValue, numPartitions):
+
+    # Equal-width ranges from minValue to maxValue. The first partition
+    # also picks up any NULLs, and the last is closed at maxValue
+    numPartitions = max(1, int(numPartitions))
+    width = (maxValue - minValue) / numPartitions
+
+    bounds = [minValue + width * i for i in range(1, numPartitions)]
+    if isinstance(minValue, numbers.Integral):
+        bounds = sorted(set(int(math.ceil(bound)) for bound in bounds))
+
+    wheres = []
+    lower = None
+    for upper in bounds + [None]:
+        clauses = []
+        if lower is not None:
+            clauses.append(partitionCol + ' >= ' + str(lower))
+        if upper is not None:
+            clauses.append(partitionCol + ' < ' + str(upper))
+        where = ' AND '.join(clauses)
+        if lower is None:
+            if where == '':
+                where = 'TRUE'
+            else:
+                where = '(' + where + ' OR ' + partitionCol + ' IS NULL)'
+        wheres.append(where)
+        lower = upper
+
+    return wheres
+
+
+def getTableStats(tableName, dataStore):
+
+    # Postgres' cumulative row counters for the table, plus its filenode
+    # (which changes on TRUNCATE). Any write to the table changes these, so
+    # they're a cheap fingerprint of its content. Returns None if Postgres
+    # has no stats for the table
+    schema = dataStore.schema
+    if schema is None:
+        schema = 'public'
+
+    cursor = dataStore.cursor()
+    cursor.execute('SELECT n_tup_ins, n_tup_upd, n_tup_del, n_live_tup, ' +
+                   'pg_relation_filenode(relid) ' +
+                   'FROM pg_stat_user_tables ' +
+                   'WHERE schemaname = %s AND relname = %s',
+                   (schema, tableName))
+    stats = cursor.fetchone()
+    cursor.close()
+
+    if stats is None:
+        return None
+    return list(stats)
+
+
+def getSelectStatement(tableName, dataStore, cols='*', limitdata=None,
+                       where=None):
 
     if limitdata is not None:
         limitText = ' LIMIT ' + str(limitdata)
     else:
         limitText = ''
 
-    conn = dataStore.conn
+    whereText = ''
+    if where is not None:
+        whereText = ' WHERE ' + where
 
     schema = ''
     if dataStore.schema is not None:
         schema = dataStore.schema + '.'
 
-    return pd.read_sql('SELECT ' + cols + ' FROM ' + schema +
-                       tableName + limitText, con=conn)
+    return 'SELECT ' + cols + ' FROM ' + schema + tableName + whereText + \
+        limitText
+
+
+def getQueryColumnTypes(sql, conn):
+
+    # The pyarrow type of each of the query's result columns (by name). We
+    # only plan the query, with LIMIT 0, to get the type OIDs from the
+    # cursor's description
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT * FROM (' + sql + ') AS q LIMIT 0')
+        return {column[0]: POSTGRES_COPY_READ_TYPES.get(column[1],
+                                                        pa.string())
+                for column in cursor.description}
+    finally:
+        cursor.close()
+
+
+def copyQueryToBuffer(sql, conn):
+
+    # Returns a file, positioned at the start, holding the query's result
+    # set as CSV (with a header row). It's held in memory up to
+    # COPY_SPOOL_SIZE bytes, and on disk beyond that
+
+    copyBuffer = tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_SIZE)
+    cursor = conn.cursor()
+    try:
+        cursor.copy_expert('COPY (' + sql + ') TO STDOUT ' +
+                           '(FORMAT \'csv\', HEADER true)',
+                           copyBuffer,
+                           size=COPY_READ_SIZE)
+    except Exception:
+        copyBuffer.close()
+        raise
+    finally:
+        cursor.close()
+
+    copyBuffer.seek(0)
+    return copyBuffer
+
+
+def readCopyBuffer(copyBuffer, colTypes=None):
+
+    reader = openCopyBuffer(copyBuffer, colTypes)
+    if isinstance(reader, pd.DataFrame):
+        return reader
+
+    return pa.Table.from_batches(list(reader), schema=reader.schema) \
+        .to_pandas()
+
+
+def readCopyBufferInChunks(copyBuffer, chunkSize, colTypes=None):
+
+    reader = openCopyBuffer(copyBuffer, colTypes)
+    if isinstance(reader, pd.DataFrame):
+        yield reader
+        return
+
+    # Pyarrow's batches are sized in bytes, so we re-slice them into
+    # chunks of chunkSize rows
+    pending = reader.schema.empty_table()
+    chunkCount = 0
+    for batch in reader:
+        pending = pa.concat_tables([pending, pa.Table.from_batches([batch])])
+        while pending.num_rows >= chunkSize:
+            yield pending.slice(0, chunkSize).to_pandas()
+            chunkCount += 1
+            pending = pending.slice(chunkSize)
+
+    if pending.num_rows > 0 or chunkCount == 0:
+        yield pending.to_pandas()
+
+
+def openCopyBuffer(copyBuffer, colTypes=None):
+
+    # Returns a streaming pyarrow CSV reader over the buffer, or an empty
+    # dataframe (with the right columns) if the result set is empty - which
+    # pyarrow won't parse.
+
+    # In COPY's CSV format, NULLs are unquoted empty values and empty
+    # strings are quoted, so we can tell them apart. Columns are parsed as
+    # the types in colTypes (see getQueryColumnTypes); any column not in
+    # colTypes comes back as text, as it does from our CSV temp files.
+    colNames = next(csv.reader([copyBuffer.readline().decode('utf-8')]))
 
+    columnTypes = {colName: pa.string() for colName in colNames}
+    if colTypes is not None:
+        columnTypes.update(colTypes)
 
-def writeDataToDB(df, tableName, eng, if_exists,
-                  emptyStringToNaN=True, dtype=None):
+    bodyStart = copyBuffer.tell()
+    if len(copyBuffer.read(1)) == 0:
+        return pa.schema([(colName, columnTypes[colName])
+                          for colName in colNames]) \
+            .empty_table().to_pandas()
+    copyBuffer.seek(bodyStart)
 
-    if emptyStringToNaN:
-        df.replace('', np.nan, inplace=True)
+    return pacsv.open_csv(
+        copyBuffer,
+        read_options=pacsv.ReadOptions(
+            use_threads=True,
+            column_names=colNames),
+        parse_options=pacsv.ParseOptions(newlines_in_values=True),
+        convert_options=pacsv.ConvertOptions(
+            column_types=columnTypes,
+            null_values=[''],
+            true_values=['t'],
+            false_values=['f'],
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False))
+
+
+def writeDataToDB(df, tableName, dataStore, if_exists,
+                  emptyStringToNaN=True, dtype=None,
+                  batchSize=COPY_BATCH_SIZE,
+                  pipelined=True,
+                  copyFormat='CSV',
+                  colDataTypes=None):
+
+    # We stream the dataframe into a single COPY, serialising it a batch of
+    # rows at a time, so we never hold the whole frame in serialised form.
+    # If pipelined, the serialising happens on a background thread, so the
+    # next batch is being serialised while the last one is being sent.
+
+    # The COPY is CSV unless we've been asked for BINARY and we have a
+    # logical data type we can encode for every column (colDataTypes is a
+    # dict of columnName: dataType). Binary COPY saves Postgres from parsing
+    # text into integers and dates
+    binaryTypes = None
+    if copyFormat == 'BINARY' and len(df) > 0:
+        binaryTypes = getBinaryCopyTypes(list(df.columns), colDataTypes)
+
+    startTime = time.time()
+
+    # The COPY gets its own connection from the datastore's pool, and hands
+    # it back (rolled back, if the COPY failed) when it's done
+    connection = dataStore.getConnection()
+    try:
+        try:
+            copyStats = copyDataFrame(connection, df, tableName, binaryTypes,
+                                      emptyStringToNaN, batchSize, pipelined)
+        except BinaryCopyEncodingError:
+            # Some values can't be encoded in binary (e.g. timestamps with
+            # a time zone, or dates in more than one format), but Postgres
+            # may still be able to parse them from text. Nothing has been
+            # committed, so we start again with a CSV COPY
+            connection.rollback()
+            copyStats = copyDataFrame(connection, df, tableName, None,
+                                      emptyStringToNaN, batchSize, pipelined)
+    finally:
+        dataStore.releaseConnection(connection)
+
+    # Throughput stats, for the dataflow to log
+    copyStats['seconds'] = time.time() - startTime
+    return copyStats
+
+
+def copyDataFrame(connection, df, tableName, binaryTypes, emptyStringToNaN,
+                  batchSize, pipelined):
 
-    connection = eng.raw_connection()
     cur = connection.cursor()
-    output = io.StringIO()
-    df.to_csv(output, sep=',', quotechar='"', header=False, index=False)
-    output.seek(0)
-    sql = 'COPY ' + tableName + ' FROM STDIN (FORMAT \'csv\', DELIMITER \',\', QUOTE \'"\')'
-    cur.copy_expert(sql, output)
+
+    if binaryTypes is not None:
+        copyStream = DataFrameBinaryCopyStream(
+            df, batchSize, binaryTypes, emptyStringToNaN, pipelined)
+        colList = ', '.join(['"' + str(col) + '"' for col in df.columns])
+        sql = 'COPY ' + tableName + ' (' + colList + ') ' + \
+              'FROM STDIN (FORMAT \'binary\')'
+    else:
+        # In COPY's CSV format, an unquoted empty value is NULL, and to_csv
+        # writes both NaNs and empty strings as unquoted empty values. So
+        # empty strings become NULL without us having to touch the
+        # dataframe. If we want to keep them as empty strings, we write NaNs
+        # with a marker instead and tell COPY that the marker is NULL
+        nullMarker = ''
+        if not emptyStringToNaN:
+            nullMarker = COPY_NULL_MARKER
+        copyStream = DataFrameCopyStream(
+            df, batchSize, nullMarker, pipelined)
+        sql = 'COPY ' + tableName + ' FROM STDIN (FORMAT \'csv\', ' + \
+              'DELIMITER \',\', QUOTE \'"\', NULL \'' + nullMarker + '\')'
+
+    try:
+        cur.copy_expert(sql, copyStream, size=COPY_READ_SIZE)
+    except Exception:
+        if getattr(copyStream, 'encodingError', None) is not None:
+            raise copyStream.encodingError
+        raise
+    finally:
+        copyStream.close()
+        cur.close()
     # cur.copy_from(output, tableName, sep='~', null='')
     connection.commit()
-    cur.close()
     # df.to_sql(tableName,
     #           eng,
     #           if_exists=if_exists,
     #           index=False)
 
+    return {
+        'rows': len(df),
+        'bytes': copyStream.byteCount}
+
+
+def getBinaryCopyTypes(colNames, colDataTypes):
+
+    # Returns a dict of columnName: binary encoding, or None if any of the
+    # columns can't be sent in binary format
+    if colDataTypes is None:
+        return None
+
+    binaryTypes = {}
+    for colName in colNames:
+        if colName not in colDataTypes:
+            return None
+        # e.g. VARCHAR(255) -> VARCHAR
+        dataType = colDataTypes[colName].upper().split('(')[0].strip()
+        if dataType not in BINARY_COPY_TYPES:
+            return None
+        binaryTypes[colName] = BINARY_COPY_TYPES[dataType]
+
+    return binaryTypes
+
+
+class DataFrameCopyStream():
+
+    # A read-only, file-like view of a dataframe as CSV text, for
+    # copy_expert. Rows are serialised in batches, as COPY asks for them.
+    # If pipelined, a producer thread serialises batches into a small
+    # queue ahead of COPY, so serialising overlaps with sending
+
+    def __init__(self, df, batchSize, nullMarker, pipelined=False):
+
+        self.df = df
+        self.batchSize = batchSize
+        self.nullMarker = nullMarker
+        self.nextRow = 0
+        self.batchText = self.newBuffer()
+        self.finished = False
+
+        # Bytes handed to COPY (which encodes our text as UTF-8)
+        self.byteCount = 0
+
+        self.batchQueue = None
+        self.stopped = threading.Event()
+        if pipelined:
+            self.batchQueue = queue.Queue(maxsize=COPY_PIPELINE_DEPTH)
+            self.producer = threading.Thread(target=self.produceBatches,
+                                             daemon=True)
+            self.producer.start()
+
+    def read(self, size=-1):
+
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                text = self.read(COPY_READ_SIZE)
+                if len(text) == 0:
+                    return self.newBuffer().read().join(chunks)
+                chunks.append(text)
+
+        text = self.batchText.read(size)
+        while len(text) == 0 and not self.finished:
+            batch = self.getNextBatch()
+            if batch is None:
+                self.finished = True
+            else:
+                self.batchText = self.newBuffer(batch)
+                text = self.batchText.read(size)
+
+        if isinstance(text, str):
+            self.byteCount += len(text.encode('utf-8'))
+        else:
+            self.byteCount += len(text)
+        return text
+
+    def getNextBatch(self):
+
+        if self.batchQueue is None:
+            if self.nextRow >= len(self.df):
+                return None
+            return self.serialiseNextBatch()
+
+        # The producer puts None on the queue when it's done, or the
+        # exception if it failed
+        batch = self.batchQueue.get()
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+    def produceBatches(self):
+
+        try:
+            while self.nextRow < len(self.df) and not self.stopped.is_set():
+                self.putBatch(self.serialiseNextBatch())
+            self.putBatch(None)
+        except Exception as e:
+            self.putBatch(e)
+
+    def putBatch(self, batch):
+
+        # If COPY fails, nothing will ever read the queue again, so we
+        # can't block on a full queue indefinitely
+        while not self.stopped.is_set():
+            try:
+                self.batchQueue.put(batch, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def serialiseNextBatch(self):
+
+        batch = self.df.iloc[self.nextRow:self.nextRow + self.batchSize]
+        self.nextRow += self.batchSize
+        if self.needsQuotedBatch(batch):
+            return self.serialiseQuotedBatch(batch)
+        return batch.to_csv(sep=',',
+                            quotechar='"',
+                            header=False,
+                            index=False,
+                            na_rep=self.nullMarker)
+
+    def needsQuotedBatch(self, batch):
+
+        # COPY only reads an unquoted value as NULL, but to_csv only quotes
+        # values when it has to. So a value that equals our null marker
+        # would be read as NULL. And the csv module always quotes a row's
+        # only field if it's empty, so in a one-column table an empty value
+        # would be read as an empty string, not NULL
+        if self.nullMarker == '':
+            return len(batch.columns) == 1
+        return bool((batch == self.nullMarker).any().any())
+
+    def serialiseQuotedBatch(self, batch):
+
+        # Slower than to_csv, but these batches are rare: every value is
+        # quoted, except the NULLs
+        isNull = batch.isnull()
+        if self.nullMarker == '':
+            isNull = isNull | (batch == '')
+
+        lines = []
+        for values, nulls in zip(batch.itertuples(index=False, name=None),
+                                 isNull.itertuples(index=False, name=None)):
+            lines.append(','.join(
+                [self.nullMarker if valueIsNull
+                 else '"' + str(value).replace('"', '""') + '"'
+                 for value, valueIsNull in zip(values, nulls)]) + '\n')
+
+        return ''.join(lines)
+
+    def newBuffer(self, batch=''):
+
+        return io.StringIO(batch)
+
+    def close(self):
+
+        self.stopped.set()
+
+
+class BinaryCopyEncodingError(ValueError):
+    pass
+
+
+class DataFrameBinaryCopyStream(DataFrameCopyStream):
+
+    # As DataFrameCopyStream, but in Postgres' binary COPY format.
+    # binaryTypes is a dict of columnName: binary encoding (see
+    # BINARY_COPY_TYPES)
+
+    def __init__(self, df, batchSize, binaryTypes, emptyStringToNaN,
+                 pipelined=False):
+
+        # These must be set before the base class starts the producer
+        self.binaryTypes = binaryTypes
+        self.encodingError = None
+        self.emptyStringToNaN = emptyStringToNaN
+        self.tupleHeader = struct.pack('!h', len(df.columns))
+
+        DataFrameCopyStream.__init__(self, df, batchSize, None, pipelined)
+
+    def serialiseNextBatch(self):
+
+        batch = self.df.iloc[self.nextRow:self.nextRow + self.batchSize]
+        isFirstBatch = self.nextRow == 0
+        self.nextRow += self.batchSize
+        isLastBatch = self.nextRow >= len(self.df)
+
+        # Encode a column at a time, then interleave the fields into rows
+        colFields = []
+        for colName in batch.columns:
+            try:
+                colFields.append(encodeBinaryCopyColumn(
+                    batch[colName],
+                    self.binaryTypes[colName],
+                    self.emptyStringToNaN))
+            except (ValueError, TypeError, OverflowError) as e:
+                # Kept, because psycopg2 may report it as its own error
+                self.encodingError = BinaryCopyEncodingError(
+                    'Cannot encode column ' + str(colName) + ' as ' +
+                    self.binaryTypes[colName] + ' for a binary COPY: ' +
+                    str(e))
+                raise self.encodingError
+
+        tuples = [self.tupleHeader + b''.join(rowFields)
+                  for rowFields in zip(*colFields)]
+
+        if isFirstBatch:
+            tuples.insert(0, BINARY_COPY_HEADER)
+        if isLastBatch:
+            tuples.append(BINARY_COPY_TRAILER)
+
+        return b''.join(tuples)
+
+    def newBuffer(self, batch=b''):
+
+        return io.BytesIO(batch)
+
+
+def encodeBinaryCopyColumn(series, binaryType, emptyStringToNaN):
+
+    # Returns a list with one field (length + value) per row
+
+    if binaryType == 'TEXT':
+        isNull = series.isnull()
+        if emptyStringToNaN:
+            isNull = isNull | (series == '')
+        fields = []
+        for value, valueIsNull in zip(series.tolist(), isNull.tolist()):
+            if valueIsNull:
+                fields.append(BINARY_COPY_NULL)
+            else:
+                valueBytes = str(value).encode('utf-8')
+                fields.append(struct.pack('!i', len(valueBytes)) + valueBytes)
+        return fields
+
+    # Everything else is fixed width. Our data is often text (e.g. read from
+    # a CSV), in which case an empty string is a NULL
+    if series.dtype == object or pd.api.types.is_string_dtype(series):
+        series = series.replace('', np.nan)
+
+    if binaryType in ('DATE', 'TIMESTAMP'):
+        dateTimes = pd.to_datetime(series)
+        isNull = dateTimes.isnull().to_numpy()
+        unit = pd.Timedelta(days=1)
+        if binaryType == 'TIMESTAMP':
+            unit = pd.Timedelta(microseconds=1)
+        values = ((dateTimes - BINARY_COPY_EPOCH) // unit).fillna(0)
+    elif binaryType in ('INT2', 'INT4', 'INT8'):
+        # Parsed as nullable ints, not floats, so a column with NULLs
+        # doesn't lose precision (a float64 can't hold every INT8)
+        values = pd.to_numeric(series, dtype_backend='numpy_nullable')
+        isNull = values.isna().to_numpy()
+        if pd.api.types.is_float_dtype(values):
+            if (values[~isNull] % 1 != 0).any():
+                raise ValueError('Cannot COPY non-integer values to ' +
+                                 'integer column ' + str(series.name))
+            values = values.astype('Int64')
+        values = values.fillna(0).astype('int64')
+    else:
+        values = pd.to_numeric(series)
+        isNull = values.isnull().to_numpy()
+        values = values.fillna(0)
+
+    dtype = np.dtype(BINARY_COPY_FIXED_WIDTH_DTYPES[binaryType])
+    if dtype.kind == 'i':
+        limits = np.iinfo(dtype)
+        if values.min() < limits.min or values.max() > limits.max:
+            raise ValueError('Values out of range for column ' +
+                             str(series.name))
+
+    # Build every field (length, then value) in one numpy array, then
+    # slice the bytes up into one field per row
+    fieldArray = np.empty(len(values), dtype=[('len', '>i4'), ('val', dtype)])
+    fieldArray['len'] = dtype.itemsize
+    fieldArray['val'] = values.to_numpy()
+    fieldBytes = fieldArray.tobytes()
+    fieldWidth = fieldArray.dtype.itemsize
+    fields = [fieldBytes[i:i + fieldWidth]
+              for i in range(0, len(fieldBytes), fieldWidth)]
+
+    for i in np.flatnonzero(isNull):
+        fields[i] = BINARY_COPY_NULL
+
+    return fields
+
 
 def truncateTable(tableName, datastore, schema):
     if schema is not None:
@@ -52,6 +848,28 @@ def truncateTable(tableName, datastore, schema):
     datastore.commit()
 
 
+def reserveSequenceValues(tableName, colName, count, datastore, schema):
+
+    # Takes count consecutive values from the sequence behind a SERIAL
+    # column and returns the first. nextval and setval run in one statement,
+    # but aren't atomic together, so nothing else may be taking values from
+    # the sequence at the same time (a bulk load owns its table)
+    if count == 0:
+        return None
+    if schema is not None:
+        tableName = schema + '.' + tableName
+    dbCursor = datastore.cursor()
+    dbCursor.execute(
+        'SELECT setval(pg_get_serial_sequence(%(table)s, %(col)s), ' +
+        'nextval(pg_get_serial_sequence(%(table)s, %(col)s)) + ' +
+        '%(count)s - 1)',
+        {'table': tableName, 'col': colName, 'count': count})
+    lastValue = dbCursor.fetchone()[0]
+    datastore.commit()
+
+    return lastValue - count + 1
+
+
 def customSQL(sql, datastore):
     dbCursor = datastore.cursor()
     dbCursor.execute(sql)
@@ -1,35 +1,125 @@
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from openpyxl import load_workbook
 
 
 def readDataFromWorksheet(worksheet, limitdata=None):
 
-    df = pd.DataFrame()
-    maxCol = 0
+    # We stream the rows (values only) into a list per column, rather than
+    # building a list per row and then transposing it into a dataframe.
+    # Rows can be ragged in read-only worksheets, so columns that first
+    # appear part way down are back-filled with Nones
 
     if limitdata is not None:
         rowLimit = limitdata
     else:
-        rowLimit = 0
+        rowLimit = None
 
-    tableData = []
-    for row in worksheet.iter_rows(min_row=1, max_row=rowLimit):
-        rowData = []
-        colIndex = 0
+    colBuffers = []
+    maxCol = 0
+    rowCount = 0
+    for row in worksheet.iter_rows(min_row=1,
+                                   max_row=rowLimit,
+                                   values_only=True):
         rowHasData = False
-        for cell in row:
-            colIndex += 1
-            if cell.value is not None:
+        for colIndex, value in enumerate(row):
+            if value is not None:
                 rowHasData = True
-                if colIndex > maxCol:
-                    maxCol = colIndex
-            rowData.append(cell.value)
-        if rowHasData:
-            tableData.append(rowData)
-        else:
+                if colIndex >= maxCol:
+                    maxCol = colIndex + 1
+        if not rowHasData:
             # If we find a completely empty row, stop
             break
 
-    df = pd.DataFrame(tableData)
-    df = df.iloc[1:, 0:maxCol]
-    df.columns = tableData[0][0:maxCol]
+        while len(colBuffers) < len(row):
+            colBuffers.append([None] * rowCount)
+        for colIndex, colBuffer in enumerate(colBuffers):
+            if colIndex < len(row):
+                colBuffer.append(row[colIndex])
+            else:
+                colBuffer.append(None)
+        rowCount += 1
+
+    # The first row is the header
+    colBuffers = colBuffers[0:maxCol]
+    df = pd.DataFrame(
+        {colIndex: colBuffer[1:]
+         for colIndex, colBuffer in enumerate(colBuffers)})
+    df.columns = [colBuffer[0] for colBuffer in colBuffers]
     return df
+
+
+def readDataFromWorksheetInChunks(worksheet, chunkSize, limitdata=None):
+
+    # A generator of dataframes, each of (at most) chunkSize rows. Unlike
+    # readDataFromWorksheet, we can't look at every row before we build the
+    # first dataframe, so the columns are taken from the header row (up to
+    # its last non-empty cell)
+
+    rows = worksheet.iter_rows(min_row=1, values_only=True)
+
+    headerRow = list(next(rows, []))
+    maxCol = 0
+    for colIndex, value in enumerate(headerRow):
+        if value is not None:
+            maxCol = colIndex + 1
+    colNames = headerRow[0:maxCol]
+
+    rowCount = 0
+    chunkData = []
+    for row in rows:
+        if limitdata is not None and rowCount >= limitdata - 1:
+            break
+        rowData = list(row[0:maxCol])
+        # If we find a completely empty row, stop
+        if all(value is None for value in row):
+            break
+        rowData += [None] * (maxCol - len(rowData))
+        chunkData.append(rowData)
+        rowCount += 1
+        if len(chunkData) == chunkSize:
+            yield pd.DataFrame(chunkData, columns=colNames)
+            chunkData = []
+
+    if len(chunkData) > 0 or rowCount == 0:
+        yield pd.DataFrame(chunkData, columns=colNames)
+
+
+def readDataFromWorksheetsInParallel(filePath,
+                                     worksheetTitles,
+                                     numProcesses=None,
+                                     limitdata=None):
+
+    # A generator of (worksheetTitle, dataframe), in the order the reads
+    # finish. Parsing a worksheet is CPU-bound, so each is read in its own
+    # process. Each process opens the workbook read-only, which only reads
+    # the zip's directory and shared strings up front, then parses just the
+    # one sheet it was given
+
+    executor = ProcessPoolExecutor(max_workers=numProcesses)
+    futures = {}
+    try:
+        for worksheetTitle in worksheetTitles:
+            future = executor.submit(readDataFromWorkbookSheet,
+                                     filePath,
+                                     worksheetTitle,
+                                     limitdata)
+            futures[future] = worksheetTitle
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def readDataFromWorkbookSheet(filePath, worksheetTitle, limitdata=None):
+
+    workbook = load_workbook(filename=filePath,
+                             read_only=True,
+                             data_only=True)
+    try:
+        return readDataFromWorksheet(workbook[worksheetTitle], limitdata)
+    finally:
+        workbook.close()
@@ -1,5 +1,27 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.ipc as ipc
+import pyarrow.csv as pacsv
+import csv
+import io
 import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+# The file extension used for each of the temp data formats
+TMP_DATA_FILE_EXTS = {
+    'CSV': '.csv',
+    'PARQUET': '.parquet',
+    'ARROW': '.arrow'
+}
+
+TMP_DATA_COMPRESSIONS = ['ZSTD', 'LZ4', 'NONE']
+
+CSV_ENGINES = ['PANDAS', 'PYARROW']
+
+# How much of a file we read at a time when looking for row boundaries
+CSV_SCAN_BLOCK_SIZE = 64 * 1024 * 1024
 
 
 def readDataFromCsv(conf,
@@ -10,31 +32,12 @@ def readDataFromCsv(conf,
                     nrows=None,
                     isTmpData=True,
                     limitdata=None,
-                    getFirstRow=False):
+                    getFirstRow=False,
+                    engine=None):
 
     _filename = filename
     if isTmpData:
-        if filename not in conf.FILE_NAME_MAP:
-            conf.populateTempDataFileNameMap()
-        if filename not in conf.FILE_NAME_MAP:
-            raise ValueError('Data needed for this operation (' +
-                             filename + ') cannot be found in the temp ' +
-                             'data directory')
-        else:
-            _filename = conf.FILE_NAME_MAP[filename]
-
-    # We need to force it to read everything as text. Only way I can
-    # see to do this is to read the headers and create a dtype for each
-    headersDf = pd.read_csv(path + _filename,
-                            sep=sep,
-                            quotechar=quotechar,
-                            nrows=1,
-                            na_filter=False)
-
-    headerList = headersDf.columns.values
-    dtype = {}
-    for header in headerList:
-        dtype[header] = str
+        _filename = getTmpDataFileName(conf, filename)
 
     if limitdata is not None:
         nrows = limitdata
@@ -43,26 +46,231 @@ def readDataFromCsv(conf,
     if getFirstRow:
         nrows = 1
 
-    return pd.read_csv(path + _filename,
+    if engine is None:
+        engine = conf.CSV_ENGINE
+
+    # We need to force it to read everything as text, and we want to do
+    # that in a single pass of the file
+    if engine == 'PANDAS':
+        return pd.read_csv(path + _filename,
+                           sep=sep,
+                           quotechar=quotechar,
+                           dtype=str,
+                           na_filter=False,
+                           nrows=nrows)
+    elif engine == 'PYARROW':
+        return readDataFromCsvWithPyarrow(path + _filename,
+                                          sep=sep,
+                                          quotechar=quotechar,
+                                          nrows=nrows)
+    else:
+        raise ValueError('Unhandled CSV engine: ' + engine)
+
+
+def readDataFromCsvInChunks(path,
+                            filename,
+                            chunkSize,
+                            sep=',',
+                            quotechar='"',
+                            limitdata=None):
+
+    # Returns an iterator of dataframes, each of (at most) chunkSize rows,
+    # all text. A file with no rows still gives one (empty) chunk
+    return pd.read_csv(path + filename,
                        sep=sep,
                        quotechar=quotechar,
-                       dtype=dtype,
+                       dtype=str,
                        na_filter=False,
-                       nrows=nrows)
+                       nrows=limitdata,
+                       chunksize=chunkSize)
 
 
-def writeDataToCsv(conf, df, path, filename, headers, mode):
+def readDataFromCsvWithPyarrow(filePath, sep, quotechar, nrows=None):
 
-    _filename = ''
+    # Pyarrow's CSV reader parses blocks of the file on multiple threads.
+    # It has no "read everything as text" option, so we take the column
+    # names from the header line and type each one as a string. Reading
+    # the header line is not a parse of the file, so we still only parse
+    # the body once.
+    # Pyarrow errors on rows with fewer values than the header, where pandas
+    # pads them with empty values, so if pyarrow can't parse the file we
+    # fall back to pandas (which pads short rows, or raises its own error)
+    colNames = readCsvHeader(filePath, sep, quotechar)
+    if len(colNames) == 0:
+        return pd.DataFrame()
 
-    if filename in conf.FILE_NAME_MAP:
-        _filename = conf.FILE_NAME_MAP[filename]
+    try:
+        return readCsvBodyWithPyarrow(filePath, sep, quotechar, colNames,
+                                      nrows)
+    except pa.ArrowInvalid:
+        return pd.read_csv(filePath,
+                           sep=sep,
+                           quotechar=quotechar,
+                           dtype=str,
+                           na_filter=False,
+                           nrows=nrows)
+
+
+def readCsvBodyWithPyarrow(filePath, sep, quotechar, colNames, nrows):
+
+    readOptions = pacsv.ReadOptions(
+        use_threads=True,
+        column_names=colNames,
+        skip_rows=1)
+    # Quoted values can contain line breaks, as they can with pandas
+    parseOptions = pacsv.ParseOptions(
+        delimiter=sep,
+        quote_char=quotechar,
+        newlines_in_values=True)
+    # Empty values stay as empty strings, as with pandas' na_filter=False
+    convertOptions = pacsv.ConvertOptions(
+        column_types={colName: pa.string() for colName in colNames},
+        null_values=[],
+        strings_can_be_null=False,
+        quoted_strings_can_be_null=False)
+
+    if nrows is None:
+        table = pacsv.read_csv(filePath,
+                               read_options=readOptions,
+                               parse_options=parseOptions,
+                               convert_options=convertOptions)
     else:
-        prefix = \
-            str(conf.NEXT_FILE_PREFIX).zfill(conf.FILE_PREFIX_LENGTH)
-        _filename = prefix + "-" + filename
-        conf.NEXT_FILE_PREFIX += 1
-        conf.FILE_NAME_MAP[filename] = _filename
+        # With a row limit, we stream the file and stop once we have enough
+        batches = []
+        rowCount = 0
+        reader = pacsv.open_csv(filePath,
+                                read_options=readOptions,
+                                parse_options=parseOptions,
+                                convert_options=convertOptions)
+        for batch in reader:
+            batches.append(batch)
+            rowCount += batch.num_rows
+            if rowCount >= nrows:
+                break
+        table = pa.Table.from_batches(batches, schema=reader.schema)
+        table = table.slice(0, nrows)
+
+    return table.to_pandas()
+
+
+def readCsvHeader(filePath, sep, quotechar):
+    # An empty file has no columns
+    with open(filePath, newline='') as _file:
+        reader = csv.reader(_file, delimiter=sep, quotechar=quotechar)
+        return next(reader, [])
+
+
+# Very large source files can be parsed in parallel: we split the file into
+# byte ranges that start and end on row boundaries, parse each range in a
+# separate process, then concatenate the results in file order
+def readDataFromCsvInParallel(filePath, sep, quotechar, numProcesses=None):
+
+    if numProcesses is None:
+        numProcesses = os.cpu_count()
+
+    colNames = readCsvHeader(filePath, sep, quotechar)
+    byteRanges = getCsvByteRanges(filePath, quotechar, numProcesses)
+
+    with ProcessPoolExecutor(max_workers=numProcesses) as executor:
+        dfs = list(executor.map(
+            readCsvByteRange,
+            [filePath] * len(byteRanges),
+            [byteRange[0] for byteRange in byteRanges],
+            [byteRange[1] for byteRange in byteRanges],
+            [colNames] * len(byteRanges),
+            [sep] * len(byteRanges),
+            [quotechar] * len(byteRanges)))
+
+    if len(dfs) == 0:
+        return pd.DataFrame(columns=colNames, dtype=str)
+
+    return pd.concat(dfs, ignore_index=True)
+
+
+def readCsvByteRange(filePath, start, end, colNames, sep, quotechar):
+
+    with open(filePath, 'rb') as _file:
+        _file.seek(start)
+        data = _file.read(end - start)
+
+    return pd.read_csv(io.BytesIO(data),
+                       sep=sep,
+                       quotechar=quotechar,
+                       header=None,
+                       names=colNames,
+                       dtype=str,
+                       na_filter=False)
+
+
+def getCsvByteRanges(filePath, quotechar, numRanges):
+
+    # A newline only ends a row if it's not inside a quoted value, and we
+    # can only tell that by counting the quotechars since the start of the
+    # file (an escaped quote is two quotechars, so it doesn't change the
+    # count's parity). So we scan the whole file once, in blocks, looking
+    # for the first unquoted newline after each of our target offsets. The
+    # first target is the start of the file, which gives us the end of the
+    # header row
+
+    fileSize = os.path.getsize(filePath)
+    quote = quotechar.encode()
+
+    rowBoundaries = []
+    targets = [0]
+    inQuotes = False
+    blockStart = 0
+
+    with open(filePath, 'rb') as _file:
+        while len(targets) > 0:
+            block = _file.read(CSV_SCAN_BLOCK_SIZE)
+            if len(block) == 0:
+                break
+
+            # i is how far through the block we've counted quotechars
+            i = 0
+            while len(targets) > 0 and targets[0] < blockStart + len(block):
+                t = max(targets[0] - blockStart, i)
+                inQuotes ^= block.count(quote, i, t) % 2 == 1
+                i = t
+                newline = block.find(b'\n', i)
+                if newline == -1:
+                    break
+                inQuotes ^= block.count(quote, i, newline) % 2 == 1
+                i = newline + 1
+                if inQuotes:
+                    # The newline is inside a quoted value: keep looking
+                    targets[0] = blockStart + i
+                    continue
+                rowBoundaries.append(blockStart + i)
+                targets.pop(0)
+                if len(rowBoundaries) == 1:
+                    # We've found the end of the header row, so now we can
+                    # split the rest of the file into equal ranges
+                    rangeSize = (fileSize - rowBoundaries[0]) / numRanges
+                    targets = [int(rowBoundaries[0] + rangeSize * n)
+                               for n in range(1, numRanges)]
+                targets = [max(target, blockStart + i) for target in targets]
+
+            inQuotes ^= block.count(quote, i) % 2 == 1
+            blockStart += len(block)
+
+    if len(rowBoundaries) == 0:
+        # The file is just a header row (with no trailing newline)
+        return []
+
+    rowBoundaries.append(fileSize)
+
+    byteRanges = []
+    for start, end in zip(rowBoundaries[:-1], rowBoundaries[1:]):
+        if end > start:
+            byteRanges.append((start, end))
+
+    return byteRanges
+
+
+def writeDataToCsv(conf, df, path, filename, headers, mode):
+
+    _filename = mapTmpDataFileName(conf, filename)
 
     _file = open(path + _filename, mode)
 
@@ -74,11 +282,305 @@ def writeDataToCsv(conf, df, path, filename, headers, mode):
     df.to_csv(_file, header=colHeaders, index=False)
 
 
+# The temp data that is handed between data layers can be held on disk as
+# CSV (human-readable, but everything comes back as text) or in a typed,
+# columnar format: Parquet or Arrow IPC. The format is set app-wide in
+# appConfig.ini, so the dataflows call these functions rather than the
+# format-specific ones.
+# Typed temp data keeps numbers, dates and bools typed, so code that joins
+# columns into text (e.g. natural keys) must convert them itself (see
+# keyMapIO.nkComponentToStr). Text columns come back as they would from a
+# CSV, with empty strings for nulls
+def readDataFromTmpFile(conf, path, filename):
+
+    if conf.TMP_DATA_FORMAT == 'CSV':
+        return readDataFromCsv(conf=conf,
+                               path=path,
+                               filename=filename,
+                               sep=',',
+                               quotechar='"')
+
+    _filename = getTmpDataFileName(conf, filename)
+
+    # truncateFile leaves a typed file with its columns but no rows, so an
+    # empty file means a write didn't finish
+    if os.path.getsize(path + _filename) == 0:
+        raise ValueError('Temp data file ' + path + _filename + ' is ' +
+                         'empty: it was not written completely')
+
+    table = readTmpDataTable(conf, path + _filename)
+
+    return arrowTableToDataFrame(table)
+
+
+def readTmpDataTable(conf, filePath):
+
+    try:
+        if conf.TMP_DATA_FORMAT == 'PARQUET':
+            return pq.read_table(filePath)
+        elif conf.TMP_DATA_FORMAT == 'ARROW':
+            return readArrowStreams(filePath)
+    except (pa.ArrowInvalid, OSError) as e:
+        raise ValueError('Temp data file ' + filePath + ' cannot be ' +
+                         'read (it may be truncated): ' + str(e))
+
+    raise ValueError('Unhandled temp data format: ' + conf.TMP_DATA_FORMAT)
+
+
+# Integer columns stay integers when they have nulls, rather than becoming
+# floats (which can't hold every int64)
+NULLABLE_INT_TYPES = {
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+    pa.uint8(): pd.UInt8Dtype(),
+    pa.uint16(): pd.UInt16Dtype(),
+    pa.uint32(): pd.UInt32Dtype(),
+    pa.uint64(): pd.UInt64Dtype()}
+
+
+def arrowTableToDataFrame(table):
+
+    df = table.to_pandas(types_mapper=NULLABLE_INT_TYPES.get)
+    for field in table.schema:
+        if pa.types.is_string(field.type) or \
+                pa.types.is_large_string(field.type):
+            df[field.name] = df[field.name].fillna('')
+    return df
+
+
+def writeDataToTmpFile(conf, df, path, filename, headers, mode):
+
+    if conf.TMP_DATA_FORMAT == 'CSV':
+        writeDataToCsv(conf=conf,
+                       df=df,
+                       path=path,
+                       filename=filename,
+                       headers=headers,
+                       mode=mode)
+        return
+
+    _filename = mapTmpDataFileName(conf, filename)
+    filePath = path + _filename
+
+    fileHasData = os.path.exists(filePath) and os.path.getsize(filePath) > 0
+
+    table = dataFrameToArrowTable(df)
+
+    if conf.TMP_DATA_FORMAT == 'PARQUET':
+        # Parquet files can't be appended to, so we have to rewrite the
+        # whole file. This is fine for the small appends we do (e.g. default
+        # rows), but ARROW is the better format for large appends
+        if mode == 'a' and fileHasData:
+            table = pa.concat_tables(
+                [pq.read_table(filePath), table],
+                promote_options='default')
+        compression = conf.TMP_DATA_COMPRESSION.lower()
+        pq.write_table(table, filePath, compression=compression)
+
+    elif conf.TMP_DATA_FORMAT == 'ARROW':
+        # We write Arrow IPC streams, not IPC files, because a stream can be
+        # appended to the end of another stream on disk (see
+        # readArrowStreams)
+        fileMode = 'wb'
+        if mode == 'a':
+            fileMode = 'ab'
+        with open(filePath, fileMode) as _file:
+            with ipc.new_stream(_file, table.schema,
+                                options=getIpcWriteOptions(conf)) as w:
+                w.write_table(table)
+
+    else:
+        raise ValueError('Unhandled temp data format: ' +
+                         conf.TMP_DATA_FORMAT)
+
+
+def getIpcWriteOptions(conf):
+    compression = None
+    if conf.TMP_DATA_COMPRESSION != 'NONE':
+        compression = conf.TMP_DATA_COMPRESSION.lower()
+    return ipc.IpcWriteOptions(compression=compression)
+
+
+class TmpDataStreamWriter():
+
+    # Writes a temp data file a chunk at a time (e.g. for a streaming
+    # extract), keeping the file open until close(). Appending to a Parquet
+    # file with writeDataToTmpFile rewrites the whole file, so here we keep
+    # one ParquetWriter open and add each chunk as a row group. Arrow chunks
+    # all go into one IPC stream, and CSV chunks are appended as usual.
+    # Every chunk is cast to the first chunk's column types. A column with
+    # no values in the first chunk has no type, so we write it as text
+
+    def __init__(self, conf, path, filename):
+
+        self.conf = conf
+        self.path = path
+        self.filename = filename
+        self.chunkCount = 0
+        self.schema = None
+        self.writer = None
+        self.file = None
+
+    def write(self, df):
+
+        if self.conf.TMP_DATA_FORMAT == 'CSV':
+            mode = 'w'
+            if self.chunkCount > 0:
+                mode = 'a'
+            writeDataToCsv(conf=self.conf,
+                           df=df,
+                           path=self.path,
+                           filename=self.filename,
+                           headers=True,
+                           mode=mode)
+            self.chunkCount += 1
+            return
+
+        table = dataFrameToArrowTable(df)
+
+        if self.writer is None:
+            self.schema = pa.schema([
+                field.with_type(pa.string()) if pa.types.is_null(field.type)
+                else field
+                for field in table.schema])
+            self.open()
+
+        if not table.schema.equals(self.schema):
+            try:
+                table = table.cast(self.schema)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError,
+                    ValueError) as e:
+                raise ValueError(
+                    'Chunk ' + str(self.chunkCount + 1) + ' of ' +
+                    self.filename + ' does not have the same columns ' +
+                    '(or column types) as the first chunk: ' + str(e))
+
+        self.writer.write_table(table)
+        self.chunkCount += 1
+
+    def open(self):
+
+        filePath = self.path + mapTmpDataFileName(self.conf, self.filename)
+
+        if self.conf.TMP_DATA_FORMAT == 'PARQUET':
+            self.writer = pq.ParquetWriter(
+                filePath,
+                self.schema,
+                compression=self.conf.TMP_DATA_COMPRESSION.lower())
+        elif self.conf.TMP_DATA_FORMAT == 'ARROW':
+            self.file = open(filePath, 'wb')
+            self.writer = ipc.new_stream(self.file,
+                                         self.schema,
+                                         options=getIpcWriteOptions(self.conf))
+        else:
+            raise ValueError('Unhandled temp data format: ' +
+                             self.conf.TMP_DATA_FORMAT)
+
+    def close(self):
+
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def readArrowStreams(filePath):
+
+    # Each append to an Arrow temp file adds a complete IPC stream, so we
+    # read streams until we reach the end of the file
+    tables = []
+    with pa.OSFile(filePath, 'rb') as _file:
+        fileSize = _file.size()
+        while _file.tell() < fileSize:
+            tables.append(ipc.open_stream(_file).read_all())
+
+    return pa.concat_tables(tables, promote_options='default')
+
+
+def dataFrameToArrowTable(df):
+
+    # Arrow needs a single type per column, but our dataframes often hold
+    # object columns of mixed types (e.g. ints and strings from the same
+    # source column). Where Arrow can't find one type that holds all the
+    # values (ints and floats are fine, as floats), the whole column is
+    # written as text, as it would be in a CSV. So a column that mixes 1
+    # and 'a' comes back as '1' and 'a'
+    df = df.copy(deep=False)
+    for colName in df.columns:
+        if df[colName].dtype == object:
+            try:
+                pa.array(df[colName], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                df[colName] = df[colName].where(
+                    df[colName].isnull(),
+                    df[colName].astype(str))
+
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def getTmpDataFileName(conf, filename):
+
+    if filename not in conf.FILE_NAME_MAP:
+        conf.populateTempDataFileNameMap()
+    if filename not in conf.FILE_NAME_MAP:
+        raise ValueError('Data needed for this operation (' +
+                         filename + ') cannot be found in the temp ' +
+                         'data directory')
+    return conf.FILE_NAME_MAP[filename]
+
+
+def mapTmpDataFileName(conf, filename):
+
+    if filename in conf.FILE_NAME_MAP:
+        _filename = conf.FILE_NAME_MAP[filename]
+    else:
+        prefix = \
+            str(conf.NEXT_FILE_PREFIX).zfill(conf.FILE_PREFIX_LENGTH)
+        _filename = prefix + "-" + filename
+        conf.NEXT_FILE_PREFIX += 1
+        conf.FILE_NAME_MAP[filename] = _filename
+
+    return _filename
+
+
 def truncateFile(conf, path, filename):
 
     _filename = ''
     if filename in conf.FILE_NAME_MAP:
         _filename = conf.FILE_NAME_MAP[filename]
         if os.path.exists(path + _filename):
-            _file = open(path + _filename, 'w')
-            _file.close()
+            if conf.TMP_DATA_FORMAT != 'CSV' and \
+                    os.path.getsize(path + _filename) > 0:
+                # A typed file keeps its columns (and their types), so
+                # reading it back gives an empty dataset, not an error
+                writeEmptyTmpFile(conf, path + _filename)
+            else:
+                _file = open(path + _filename, 'w')
+                _file.close()
+
+
+def writeEmptyTmpFile(conf, filePath):
+
+    # Rewrites a typed temp data file with the same columns, but no rows
+    try:
+        if conf.TMP_DATA_FORMAT == 'PARQUET':
+            schema = pq.read_schema(filePath)
+        else:
+            with pa.OSFile(filePath, 'rb') as _file:
+                schema = ipc.open_stream(_file).schema
+    except (pa.ArrowInvalid, OSError) as e:
+        raise ValueError('Temp data file ' + filePath + ' cannot be ' +
+                         'read (it may be truncated): ' + str(e))
+
+    if conf.TMP_DATA_FORMAT == 'PARQUET':
+        pq.write_table(schema.empty_table(), filePath,
+                       compression=conf.TMP_DATA_COMPRESSION.lower())
+    else:
+        with open(filePath, 'wb') as _file:
+            with ipc.new_stream(_file, schema,
+                                options=getIpcWriteOptions(conf)) as w:
+                w.write_table(schema.empty_table())
@@ -0,0 +1,539 @@
+import math
+import numbers
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import gspread
+import numpy as np
+from gspread.exceptions import APIError
+from oauth2client.service_account import ServiceAccountCredentials
+from apiclient.discovery import build
+import httplib2
+
+# Every GsheetDatastore in the process talks to Google through a shared
+# GsheetClient (one per API key), so between them they stay within the
+# Sheets API quota, which is per user, not per spreadsheet
+CLIENTS = {}
+CLIENTS_LOCK = threading.Lock()
+
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_SECONDS = 1
+MAX_BACKOFF_SECONDS = 64
+
+# Quota exceeded, and Google's own transient errors
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# values:batchGet puts the ranges in the URL, so we can't send unlimited
+# numbers of them in one request
+BATCH_GET_MAX_RANGES = 100
+
+
+def getClient(apiKey, apiScope,
+              requestsPerMinute=DEFAULT_REQUESTS_PER_MINUTE,
+              maxRetries=DEFAULT_MAX_RETRIES):
+
+    with CLIENTS_LOCK:
+        if apiKey not in CLIENTS:
+            CLIENTS[apiKey] = GsheetClient(
+                backend=GspreadBackend(apiKey, apiScope),
+                requestsPerMinute=requestsPerMinute,
+                maxRetries=maxRetries)
+        return CLIENTS[apiKey]
+
+
+# Request counts and latencies of every client in the process, by operation
+def getStats():
+
+    stats = {}
+    with CLIENTS_LOCK:
+        clients = list(CLIENTS.values())
+    for client in clients:
+        for operation, opStats in client.getStats().items():
+            if operation not in stats:
+                stats[operation] = {
+                    'requests': 0, 'retries': 0, 'errors': 0, 'seconds': 0}
+            for stat in opStats:
+                stats[operation][stat] += opStats[stat]
+    return stats
+
+
+def quoteWorksheetTitle(worksheetTitle):
+    return "'" + worksheetTitle.replace("'", "''") + "'"
+
+
+# The API drops trailing empty cells and rows; get_all_values() pads every
+# row out to the same length, and so do we
+def fillGaps(rows):
+
+    width = max([len(row) for row in rows], default=0)
+    return [row + [''] * (width - len(row)) for row in rows]
+
+
+# The same conversion get_all_records() makes: a dict per row, keyed on the
+# header row, with numeric-looking strings converted to numbers
+def valuesToRecords(values):
+
+    if len(values) == 0:
+        return []
+    keys = values[0]
+    return [dict(zip(keys, gspread.utils.numericise_all(row)))
+            for row in values[1:]]
+
+
+def getCellData(value):
+    # Numbers and bools are written as such, so the sheet can sum or
+    # filter them. Nulls are written as empty cells. Anything else (e.g.
+    # dates) is written as text, as str() gives it
+    if value is None:
+        return {}
+    if isinstance(value, (bool, np.bool_)):
+        return {'userEnteredValue': {'boolValue': bool(value)}}
+    if isinstance(value, numbers.Real) and math.isnan(value):
+        return {}
+    if isinstance(value, numbers.Real) and math.isfinite(value):
+        if isinstance(value, numbers.Integral):
+            return {'userEnteredValue': {'numberValue': int(value)}}
+        return {'userEnteredValue': {'numberValue': float(value)}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+
+def getUpdateCellsRequest(sheetId, rows):
+    return {'updateCells': {
+        'start': {'sheetId': sheetId, 'rowIndex': 0, 'columnIndex': 0},
+        'rows': [{'values': [getCellData(value) for value in row]}
+                 for row in rows],
+        'fields': 'userEnteredValue'}}
+
+
+def getClearCellsRequest(sheetId):
+    # A range with only a sheetId is the whole sheet
+    return {'updateCells': {
+        'range': {'sheetId': sheetId},
+        'fields': 'userEnteredValue'}}
+
+
+def getResizeRequest(sheetId, rowCount, columnCount):
+    return {'updateSheetProperties': {
+        'properties': {
+            'sheetId': sheetId,
+            'gridProperties': {'rowCount': rowCount,
+                               'columnCount': columnCount}},
+        'fields': 'gridProperties(rowCount,columnCount)'}}
+
+
+def getAddSheetRequest(sheetId, title, rowCount, columnCount):
+    return {'addSheet': {'properties': {
+        'sheetId': sheetId,
+        'title': title,
+        'gridProperties': {'rowCount': rowCount,
+                           'columnCount': columnCount}}}}
+
+
+def getDeleteSheetRequest(sheetId):
+    return {'deleteSheet': {'sheetId': sheetId}}
+
+
+class TokenBucket():
+
+    # Allows bursts of up to capacity requests, refilled at rate requests a
+    # second. acquire() blocks until a token is available
+
+    def __init__(self, rate, capacity, clock=time.monotonic,
+                 sleep=time.sleep):
+
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+
+        self.tokens = capacity
+        self.lastRefill = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.lastRefill) * self.rate)
+                self.lastRefill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class GsheetClient():
+
+    # Every request to Google goes through request(), which waits for the
+    # rate limit, retries with exponential backoff when Google pushes back,
+    # and keeps count. The backend makes the actual calls, so we can swap in
+    # FakeGsheetBackend to run without Google
+
+    def __init__(self, backend,
+                 requestsPerMinute=DEFAULT_REQUESTS_PER_MINUTE,
+                 maxRetries=DEFAULT_MAX_RETRIES,
+                 clock=time.monotonic,
+                 sleep=time.sleep):
+
+        self.backend = backend
+        self.maxRetries = maxRetries
+        self.clock = clock
+        self.sleep = sleep
+        self.rateLimit = TokenBucket(
+            rate=requestsPerMinute / 60,
+            capacity=max(1, requestsPerMinute / 6),
+            clock=clock,
+            sleep=sleep)
+
+        self.stats = {}
+        self.statsLock = threading.Lock()
+
+    def request(self, operation, func, *args):
+
+        retries = 0
+        while True:
+            self.rateLimit.acquire()
+            start = self.clock()
+            try:
+                result = func(*args)
+            except Exception as e:
+                self.recordRequest(operation, start, error=True)
+                if (retries >= self.maxRetries or
+                        not self.backend.isRetryable(e)):
+                    raise
+                backoff = min(MAX_BACKOFF_SECONDS,
+                              BACKOFF_SECONDS * 2 ** retries)
+                retries += 1
+                self.recordRetry(operation)
+                self.sleep(backoff + random.uniform(0, backoff / 2))
+                continue
+            self.recordRequest(operation, start)
+            return result
+
+    def recordRequest(self, operation, start, error=False):
+        with self.statsLock:
+            if operation not in self.stats:
+                self.stats[operation] = {
+                    'requests': 0, 'retries': 0, 'errors': 0, 'seconds': 0}
+            self.stats[operation]['requests'] += 1
+            self.stats[operation]['seconds'] += self.clock() - start
+            if error:
+                self.stats[operation]['errors'] += 1
+
+    def recordRetry(self, operation):
+        with self.statsLock:
+            self.stats[operation]['retries'] += 1
+
+    def getStats(self):
+        with self.statsLock:
+            return {op: dict(opStats) for op, opStats in self.stats.items()}
+
+    def openSpreadsheet(self, filename):
+        return self.request('open', self.backend.openSpreadsheet, filename)
+
+    def openSpreadsheetById(self, spreadsheetId):
+        return self.request(
+            'open', self.backend.openSpreadsheetById, spreadsheetId)
+
+    def getWorksheets(self, spreadsheet):
+        return self.request(
+            'worksheets', self.backend.getWorksheets, spreadsheet)
+
+    def getModifiedTime(self, spreadsheetId):
+        return self.request(
+            'modifiedTime', self.backend.getModifiedTime, spreadsheetId)
+
+    # The (ID, modifiedTime) of the spreadsheet called filename, without
+    # opening it. Once you have the ID, use it (openSpreadsheetById,
+    # getModifiedTime) rather than the name, which needn't be unique
+    def getSpreadsheetVersion(self, filename):
+        return self.request(
+            'modifiedTime', self.backend.getSpreadsheetVersion, filename)
+
+    # The values of many ranges, in as few requests as we can (up to
+    # numThreads of them at once). Returns a list of rows for each range,
+    # in the order they were asked for
+    def batchGetValues(self, spreadsheet, ranges, numThreads=1):
+
+        batches = [ranges[i:i + BATCH_GET_MAX_RANGES]
+                   for i in range(0, len(ranges), BATCH_GET_MAX_RANGES)]
+
+        if numThreads > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=numThreads) as executor:
+                futures = [
+                    executor.submit(self.request,
+                                    'batchGet',
+                                    self.backend.batchGetValues,
+                                    spreadsheet,
+                                    batch)
+                    for batch in batches]
+                batchValues = [future.result() for future in futures]
+        else:
+            batchValues = [
+                self.request('batchGet',
+                             self.backend.batchGetValues,
+                             spreadsheet,
+                             batch)
+                for batch in batches]
+
+        return [fillGaps(rows) for values in batchValues for rows in values]
+
+    def batchUpdate(self, spreadsheet, requests):
+
+        if len(requests) == 0:
+            return
+        return self.request(
+            'batchUpdate', self.backend.batchUpdate, spreadsheet, requests)
+
+
+class GspreadBackend():
+
+    def __init__(self, apiKey, apiScope):
+
+        self.apiKey = apiKey
+        self.apiScope = apiScope
+
+        self.gspreadClient = None
+        self.gdriveConn = None
+        self.lock = threading.Lock()
+
+    def getGspreadClient(self):
+        with self.lock:
+            if self.gspreadClient is None:
+                self.gspreadClient = gspread.authorize(
+                    ServiceAccountCredentials.from_json_keyfile_name(
+                        self.apiKey,
+                        self.apiScope))
+            return self.gspreadClient
+
+    def getGdriveConn(self):
+        with self.lock:
+            if self.gdriveConn is None:
+                creds = ServiceAccountCredentials.from_json_keyfile_name(
+                    self.apiKey,
+                    'https://www.googleapis.com/auth/drive.metadata.readonly')
+                self.gdriveConn = build(
+                    'drive', 'v3', http=creds.authorize(httplib2.Http()))
+            return self.gdriveConn
+
+    def openSpreadsheet(self, filename):
+        return self.getGspreadClient().open(filename)
+
+    def openSpreadsheetById(self, spreadsheetId):
+        return self.getGspreadClient().open_by_key(spreadsheetId)
+
+    def getWorksheets(self, spreadsheet):
+        return spreadsheet.worksheets()
+
+    def getModifiedTime(self, spreadsheetId):
+        result = self.getGdriveConn().files().get(
+            fileId=spreadsheetId,
+            fields='modifiedTime',
+            supportsAllDrives=True).execute()
+        return result['modifiedTime']
+
+    def getSpreadsheetVersion(self, filename):
+        # Finds the spreadsheet by name, as gspread's open() does, but in
+        # one Drive request for just the fields we need. Spreadsheets in the
+        # bin keep their names, so we leave them out
+        query = 'mimeType="application/vnd.google-apps.spreadsheet" ' + \
+            'and name = "' + filename.replace('"', '\\"') + '" ' + \
+            'and trashed = false'
+        result = self.getGdriveConn().files().list(
+            q=query,
+            fields='files(id,modifiedTime)',
+            includeItemsFromAllDrives=True,
+            supportsAllDrives=True).execute()
+        if len(result['files']) == 0:
+            raise gspread.exceptions.SpreadsheetNotFound(filename)
+        return (result['files'][0]['id'], result['files'][0]['modifiedTime'])
+
+    def batchGetValues(self, spreadsheet, ranges):
+        response = spreadsheet.values_batch_get(ranges)
+        return [valueRange.get('values', [])
+                for valueRange in response['valueRanges']]
+
+    def batchUpdate(self, spreadsheet, requests):
+        return spreadsheet.batch_update({'requests': requests})
+
+    def isRetryable(self, exception):
+        if not isinstance(exception, APIError):
+            return False
+        response = getattr(exception, 'response', None)
+        return getattr(response, 'status_code', None) in RETRY_STATUS_CODES
+
+
+# The worksheet title and (zero-based, end-exclusive) row bounds of an A1
+# range like 'title'!A1:C10 or 'title'!1:1. Columns are ignored: the fake
+# always returns whole rows
+def parseA1Range(a1Range):
+
+    quoteEnd = a1Range.rfind("'")
+    title = a1Range[1:quoteEnd].replace("''", "'")
+    firstRow = 0
+    lastRow = None
+    if quoteEnd + 1 < len(a1Range):
+        match = re.match(r'^([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$',
+                         a1Range[quoteEnd + 2:])
+        if match.group(2) != '':
+            firstRow = int(match.group(2)) - 1
+        if match.group(4) is None:
+            lastRow = firstRow + 1
+        elif match.group(4) != '':
+            lastRow = int(match.group(4))
+    return title, firstRow, lastRow
+
+
+class GsheetRequestError(Exception):
+
+    def __init__(self, status):
+        Exception.__init__(self, 'Google Sheets request failed: ' +
+                           str(status))
+        self.status = status
+
+
+class FakeGsheetBackend():
+
+    # An in-memory stand-in for Google, for running (and testing) without
+    # network access. Spreadsheets are dicts of worksheet title: rows.
+    # failures is a list of HTTP statuses to fail the next requests with
+
+    def __init__(self, spreadsheets=None):
+
+        self.spreadsheets = {}
+        self.failures = []
+        self.calls = []
+        for filename, worksheets in (spreadsheets or {}).items():
+            self.addSpreadsheet(filename, worksheets)
+
+    def addSpreadsheet(self, filename, worksheets):
+        spreadsheet = FakeSpreadsheet(filename)
+        for title, rows in worksheets.items():
+            spreadsheet.addWorksheet(title, rows)
+        self.spreadsheets[filename] = spreadsheet
+
+    def call(self, name):
+        self.calls.append(name)
+        if len(self.failures) > 0:
+            raise GsheetRequestError(self.failures.pop(0))
+
+    def openSpreadsheet(self, filename):
+        self.call('openSpreadsheet')
+        return self.spreadsheets[filename]
+
+    def openSpreadsheetById(self, spreadsheetId):
+        self.call('openSpreadsheetById')
+        return self.getSpreadsheetById(spreadsheetId)
+
+    def getSpreadsheetById(self, spreadsheetId):
+        for spreadsheet in self.spreadsheets.values():
+            if spreadsheet.id == spreadsheetId:
+                return spreadsheet
+        raise gspread.exceptions.SpreadsheetNotFound(spreadsheetId)
+
+    def getWorksheets(self, spreadsheet):
+        self.call('getWorksheets')
+        return list(spreadsheet.worksheetsById.values())
+
+    def getModifiedTime(self, spreadsheetId):
+        self.call('getModifiedTime')
+        return str(self.getSpreadsheetById(spreadsheetId).version)
+
+    def getSpreadsheetVersion(self, filename):
+        self.call('getSpreadsheetVersion')
+        spreadsheet = self.spreadsheets[filename]
+        return (spreadsheet.id, str(spreadsheet.version))
+
+    def batchGetValues(self, spreadsheet, ranges):
+        self.call('batchGetValues')
+        values = []
+        for a1Range in ranges:
+            title, firstRow, lastRow = parseA1Range(a1Range)
+            rows = spreadsheet.getWorksheet(title).rows[firstRow:lastRow]
+            # Like the API, trailing empty cells and rows are dropped
+            rows = [list(row) for row in rows]
+            for row in rows:
+                while len(row) > 0 and row[-1] == '':
+                    row.pop()
+            while len(rows) > 0 and len(rows[-1]) == 0:
+                rows.pop()
+            values.append(rows)
+        return values
+
+    def batchUpdate(self, spreadsheet, requests):
+        self.call('batchUpdate')
+        for request in requests:
+            spreadsheet.applyRequest(request)
+        spreadsheet.version += 1
+
+    def isRetryable(self, exception):
+        return (isinstance(exception, GsheetRequestError) and
+                exception.status in RETRY_STATUS_CODES)
+
+
+class FakeSpreadsheet():
+
+    def __init__(self, title):
+        self.id = 'fake-' + title
+        self.title = title
+        self.version = 1
+        self.worksheetsById = {}
+
+    def getWorksheet(self, title):
+        for ws in self.worksheetsById.values():
+            if ws.title == title:
+                return ws
+        raise ValueError('No worksheet called ' + title)
+
+    def addWorksheet(self, title, rows, sheetId=None):
+        if sheetId is None:
+            sheetId = max(self.worksheetsById, default=-1) + 1
+        self.worksheetsById[sheetId] = FakeWorksheet(sheetId, title, rows)
+
+    def applyRequest(self, request):
+        if 'addSheet' in request:
+            properties = request['addSheet']['properties']
+            self.addWorksheet(properties['title'], [],
+                              properties.get('sheetId'))
+        elif 'deleteSheet' in request:
+            del self.worksheetsById[request['deleteSheet']['sheetId']]
+        elif 'updateSheetProperties' in request:
+            properties = request['updateSheetProperties']['properties']
+            ws = self.worksheetsById[properties['sheetId']]
+            ws.rows = ws.rows[:properties['gridProperties']['rowCount']]
+        elif 'updateCells' in request:
+            updateCells = request['updateCells']
+            if 'range' in updateCells:
+                ws = self.worksheetsById[updateCells['range']['sheetId']]
+                ws.rows = [[''] * len(row) for row in ws.rows]
+            else:
+                ws = self.worksheetsById[updateCells['start']['sheetId']]
+                for i, row in enumerate(updateCells['rows']):
+                    values = [cell['userEnteredValue']['stringValue']
+                              for cell in row['values']]
+                    while len(ws.rows) <= i:
+                        ws.rows.append([])
+                    ws.rows[i] = values + ws.rows[i][len(values):]
+        else:
+            raise ValueError('FakeGsheetBackend does not support ' +
+                             str(list(request)))
+
+
+class FakeWorksheet():
+
+    def __init__(self, sheetId, title, rows):
+        self.id = sheetId
+        self.title = title
+        self.rows = [list(row) for row in rows]
+
+    @property
+    def row_count(self):
+        return len(self.rows)
@@ -1,9 +1,87 @@
 import pandas as pd
 
+# Rows fetched per request when we page through a whole worksheet
+PAGE_ROWS = 5000
 
-def readDataFromWorksheet(worksheet, limitdata=None):
 
-    data = worksheet.get_all_values()
+def readDataFromGsheet(datastore, worksheetTitle, limitdata=None,
+                       pageRows=PAGE_ROWS):
+
+    # With a row limit we only request the rows we need. If the datastore
+    # has a cache we read the whole worksheet, which may already be cached.
+    # Otherwise we page through the worksheet, appending each page to a list
+    # per column, so we never hold the whole worksheet's nested lists in
+    # memory
+
+    if limitdata is not None:
+        return worksheetValuesToDataFrame(
+            datastore.getWorksheetRows(worksheetTitle, 1, limitdata),
+            limitdata)
+
+    if datastore.cachePath is not None:
+        return worksheetValuesToDataFrame(
+            datastore.getWorksheetValues(worksheetTitle))
+
+    # Rows can be ragged (each page is only as wide as its widest row), so
+    # columns that first appear part way down are back-filled with ''
+    colBuffers = []
+    rowCount = 0
+    for page in datastore.getWorksheetPages(worksheetTitle, pageRows):
+        for row in page:
+            while len(colBuffers) < len(row):
+                colBuffers.append([''] * rowCount)
+            for colIndex, colBuffer in enumerate(colBuffers):
+                if colIndex < len(row):
+                    colBuffer.append(row[colIndex])
+                else:
+                    colBuffer.append('')
+            rowCount += 1
+
+    # The first row is the header
+    df = pd.DataFrame(
+        {colIndex: colBuffer[1:]
+         for colIndex, colBuffer in enumerate(colBuffers)})
+    df.columns = [colBuffer[0] for colBuffer in colBuffers]
+    return df
+
+
+def readDataFromGsheetInChunks(datastore, worksheetTitle, chunkSize,
+                               limitdata=None):
+
+    # A generator of dataframes, one per page of chunkSize rows (plus any
+    # empty rows held back from the pages before). As with
+    # excelIO.readDataFromWorksheetInChunks, the columns are taken from the
+    # header row (up to its last non-empty cell)
+
+    colNames = None
+    rowCount = 0
+    for page in datastore.getWorksheetPages(worksheetTitle,
+                                            chunkSize,
+                                            lastRow=limitdata):
+        if colNames is None:
+            headerRow = page[0]
+            maxCol = 0
+            for colIndex, value in enumerate(headerRow):
+                if value != '':
+                    maxCol = colIndex + 1
+            colNames = headerRow[0:maxCol]
+            page = page[1:]
+
+        chunkData = []
+        for row in page:
+            rowData = row[0:maxCol]
+            rowData += [''] * (maxCol - len(rowData))
+            chunkData.append(rowData)
+        rowCount += len(chunkData)
+        if len(chunkData) > 0:
+            yield pd.DataFrame(chunkData, columns=colNames)
+
+    if rowCount == 0:
+        yield pd.DataFrame(columns=colNames)
+
+
+def worksheetValuesToDataFrame(data, limitdata=None):
+
     if limitdata is not None:
         rowLimit = limitdata
     else:
@@ -0,0 +1,303 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from betl.io import fileIO
+
+# The SK given to fact rows whose NK isn't in the dimension
+DEFAULT_SK = -1
+
+# STRING NKs are the NK columns' values joined with '_'. HASH NKs are a
+# 64-bit integer hashed from the same values, which are much smaller and
+# faster to look up
+NK_ENCODINGS = ['STRING', 'HASH']
+
+# DB SKs are assigned by Postgres (SERIAL) as the dimension is written, so
+# bulkLoadDimension has to read the table back to get the SK/NK mapping.
+# CLIENT SKs are reserved from the same sequence, as one range, and assigned
+# to the dataset before it is written, so the mapping comes straight from
+# the dataset
+SK_GENERATION_MODES = ['DB', 'CLIENT']
+
+# In HASH mode, bulkLoadDimension also writes each dimension's mapping as
+# two .npy files - NK hashes, sorted, and their SKs - which fact loads
+# memory-map rather than read into memory
+KEY_MAP_ARRAYS_DIR = 'keyMaps'
+
+# Key maps already read, shared by every fact load in the process, keyed on
+# dimension name. Each entry is (file version, KeyMap), least recently used
+# first
+KEY_MAPS = OrderedDict()
+KEY_MAPS_LOCK = threading.Lock()
+
+
+def getKeyMapTableName(dimensionName):
+    return 'sk_' + dimensionName
+
+
+def getKeyMap(conf, dimensionName):
+
+    # The dimension's KeyMap, from memory if the mapping file(s) haven't
+    # been rewritten since we read them. The least recently used maps are
+    # dropped when the cache outgrows KEY_MAP_CACHE_SIZE_MB
+
+    arrayPaths = getKeyMapArrayPaths(conf, dimensionName)
+    useArrays = useKeyMapArrays(conf, dimensionName, arrayPaths)
+    if useArrays:
+        version = getFilesVersion(arrayPaths)
+    else:
+        version = getFilesVersion([getKeyMapFilePath(conf, dimensionName)])
+
+    with KEY_MAPS_LOCK:
+        if dimensionName in KEY_MAPS:
+            cachedVersion, keyMap = KEY_MAPS[dimensionName]
+            if cachedVersion == version:
+                KEY_MAPS.move_to_end(dimensionName)
+                return keyMap
+            del KEY_MAPS[dimensionName]
+
+    if useArrays:
+        keyMap = SortedKeyMap(*arrayPaths)
+    else:
+        keyMap = readKeyMap(conf, dimensionName)
+
+    with KEY_MAPS_LOCK:
+        KEY_MAPS[dimensionName] = (version, keyMap)
+        evictKeyMaps(conf.KEY_MAP_CACHE_SIZE_MB * 1024 * 1024)
+
+    return keyMap
+
+
+def getKeyMapFilePath(conf, dimensionName):
+    filename = fileIO.getTmpDataFileName(
+        conf,
+        getKeyMapTableName(dimensionName) + conf.TMP_DATA_FILE_EXT)
+    return conf.TMP_DATA_PATH + '/LOD/' + filename
+
+
+def getKeyMapArrayPaths(conf, dimensionName):
+    path = conf.TMP_DATA_PATH + '/LOD/' + KEY_MAP_ARRAYS_DIR + '/' + \
+        dimensionName
+    return (path + '.nks.npy', path + '.sks.npy')
+
+
+def useKeyMapArrays(conf, dimensionName, arrayPaths):
+
+    # Only if they were written after the mapping file, in case the
+    # dimension has since been loaded with NK_ENCODING = STRING
+    if conf.NK_ENCODING != 'HASH':
+        return False
+    if not all(os.path.exists(path) for path in arrayPaths):
+        return False
+    # getKeyMapFilePath raises if the mapping file hasn't been written
+    filePath = getKeyMapFilePath(conf, dimensionName)
+    return os.stat(arrayPaths[0]).st_mtime_ns >= os.stat(filePath).st_mtime_ns
+
+
+def getFilesVersion(paths):
+    version = []
+    for path in paths:
+        fileStat = os.stat(path)
+        version.append((path, fileStat.st_size, fileStat.st_mtime_ns))
+    return tuple(version)
+
+
+def evictKeyMaps(maxBytes):
+
+    # Call with KEY_MAPS_LOCK held. We always keep the most recent map, even
+    # if it's bigger than the budget on its own
+    totalBytes = sum(keyMap.memoryBytes for _, keyMap in KEY_MAPS.values())
+    while totalBytes > maxBytes and len(KEY_MAPS) > 1:
+        _, (_, keyMap) = KEY_MAPS.popitem(last=False)
+        totalBytes -= keyMap.memoryBytes
+
+
+def writeKeyMapArrays(conf, dimensionName, df):
+
+    # df has the dimension's hashed NKs and SKs (in columns nk and sk). We
+    # sort them by NK (stable, so we keep the first SK of any duplicate NK,
+    # as KeyMap does) and write each to a .npy file, via a temp file so that
+    # a concurrent reader never maps a half-written array
+
+    if 'nk' in df.columns:
+        nks = toHashedNKs(df['nk'])
+        sks = pd.to_numeric(df['sk']).to_numpy(dtype='int64')
+    else:
+        nks = np.array([], dtype='int64')
+        sks = np.array([], dtype='int64')
+
+    order = np.argsort(nks, kind='stable')
+    nks = nks[order]
+    sks = sks[order]
+    firsts = np.ones(len(nks), dtype=bool)
+    firsts[1:] = nks[1:] != nks[:-1]
+
+    arrayPaths = getKeyMapArrayPaths(conf, dimensionName)
+    os.makedirs(os.path.dirname(arrayPaths[0]), exist_ok=True)
+    for path, array in zip(arrayPaths, (nks[firsts], sks[firsts])):
+        with open(path + '.tmp', 'wb') as file:
+            np.save(file, array)
+        os.replace(path + '.tmp', path)
+
+    invalidateKeyMap(dimensionName)
+
+    return int(len(firsts) - firsts.sum())
+
+
+def invalidateKeyMap(dimensionName):
+
+    # Called when a dimension's mapping file is rewritten, in case the new
+    # file's size and modified time match the old one's
+    with KEY_MAPS_LOCK:
+        KEY_MAPS.pop(dimensionName, None)
+
+
+def hashNKs(df, colNames):
+
+    # A stable (across processes and runs) int64 per row, hashed from the
+    # values of colNames. Values are hashed as strings, as str() gives them,
+    # so that an NK read from a typed DB column hashes the same as one read
+    # from a text file (just as the STRING encoding would join them).
+    # Raises an error if two different NKs hash to the same integer
+
+    components = pd.DataFrame(
+        {i: nkComponentToStr(df[colName])
+         for i, colName in enumerate(colNames)},
+        index=df.index)
+
+    hashes = pd.util.hash_pandas_object(components, index=False) \
+        .to_numpy().view('int64')
+
+    # A collision can only be among rows whose hash isn't unique, so we
+    # only compare those rows' NKs (usually few: repeated NKs, in a fact)
+    isRepeated = pd.Series(hashes).duplicated(keep=False).to_numpy()
+    if isRepeated.any():
+        repeatedHashes = hashes[isRepeated]
+        repeatedNKs = components[isRepeated].assign(hash=repeatedHashes)
+        if len(pd.unique(repeatedHashes)) != \
+                len(repeatedNKs.drop_duplicates()):
+            raise ValueError('Two different natural keys in ' +
+                             str(colNames) + ' have the same hash. ' +
+                             'Use NK_ENCODING = STRING')
+
+    return hashes
+
+
+def nkComponentToStr(series):
+    # Typed temp data (and DB reads) give us NK columns that aren't text.
+    # We convert them as str() would, with nulls as empty strings (as they
+    # are in text temp data). astype(str) drops the time from midnight
+    # datetimes, where str() doesn't, so we match str() for those
+    if pd.api.types.is_datetime64_any_dtype(series):
+        strings = series.map(str)
+    else:
+        strings = series.astype(str)
+    return strings.where(series.notnull(), '')
+
+
+def readKeyMap(conf, dimensionName):
+
+    # The SK/NK mapping bulkLoadDimension wrote to the LOD layer
+    df = fileIO.readDataFromTmpFile(
+        conf=conf,
+        path=conf.TMP_DATA_PATH + '/LOD/',
+        filename=getKeyMapTableName(dimensionName) + conf.TMP_DATA_FILE_EXT)
+
+    return KeyMap(df, hashedNKs=(conf.NK_ENCODING == 'HASH'))
+
+
+class KeyMap():
+
+    # A dimension's NKs, as a (hashed) pandas index, and their SKs, as an
+    # int64 array in the same order, so a whole column of NKs can be
+    # resolved to SKs in one vectorised lookup. Hashed NKs are held as int64
+    # (text temp data gives them to us as strings), and STRING NKs as text
+    # (typed temp data can give them to us as, e.g., ints)
+
+    def __init__(self, df, hashedNKs=False):
+
+        self.hashedNKs = hashedNKs
+
+        if 'nk' not in df.columns:
+            # An empty (truncated) mapping file
+            df = pd.DataFrame({'nk': [], 'sk': []})
+        if hashedNKs:
+            df = pd.DataFrame({'nk': toHashedNKs(df['nk']), 'sk': df['sk']})
+        else:
+            df = pd.DataFrame({'nk': nkComponentToStr(df['nk']),
+                               'sk': df['sk']})
+
+        # A dimension shouldn't have the same NK twice, but if it does, a
+        # join would duplicate the fact row; we take the first SK instead
+        duplicates = df['nk'].duplicated()
+        self.duplicateCount = int(duplicates.sum())
+        if self.duplicateCount > 0:
+            df = df[~duplicates]
+
+        self.nks = pd.Index(df['nk'])
+        self.sks = pd.to_numeric(df['sk']).to_numpy(dtype='int64')
+
+        self.memoryBytes = \
+            self.nks.memory_usage(deep=True) + self.sks.nbytes
+
+    def __len__(self):
+        return len(self.sks)
+
+    def lookup(self, nks):
+
+        # Returns the SKs of nks (DEFAULT_SK where not found), and the number
+        # not found
+        if self.hashedNKs:
+            nks = toHashedNKs(nks)
+        else:
+            nks = nkComponentToStr(pd.Series(nks))
+        positions = self.nks.get_indexer(nks)
+        found = positions >= 0
+
+        sks = np.full(len(positions), DEFAULT_SK, dtype='int64')
+        sks[found] = self.sks[positions[found]]
+
+        return sks, len(positions) - int(found.sum())
+
+
+def toHashedNKs(nks):
+    return pd.to_numeric(pd.Series(nks)).to_numpy(dtype='int64')
+
+
+class SortedKeyMap():
+
+    # A dimension's hashed NKs, sorted, and their SKs, memory-mapped from the
+    # .npy files writeKeyMapArrays wrote. Lookup is a binary search
+    # (searchsorted) over the whole column of NKs at once. The mapped pages
+    # live in the OS page cache, shared by every process loading facts, so
+    # they don't count towards KEY_MAP_CACHE_SIZE_MB
+
+    hashedNKs = True
+    duplicateCount = 0
+    memoryBytes = 0
+
+    def __init__(self, nksPath, sksPath):
+        self.nks = np.load(nksPath, mmap_mode='r')
+        self.sks = np.load(sksPath, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.sks)
+
+    def lookup(self, nks):
+
+        # Returns the SKs of nks (DEFAULT_SK where not found), and the number
+        # not found
+        nks = toHashedNKs(nks)
+        sks = np.full(len(nks), DEFAULT_SK, dtype='int64')
+        if len(self.nks) == 0:
+            return sks, len(nks)
+
+        positions = np.searchsorted(self.nks, nks)
+        np.minimum(positions, len(self.nks) - 1, out=positions)
+        found = self.nks[positions] == nks
+        sks[found] = self.sks[positions[found]]
+
+        return sks, len(nks) - int(found.sum())
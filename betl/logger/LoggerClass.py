@@ -176,6 +176,12 @@ class Logger():
         op += '                 --------------------------------------' + '\n'
         self.JOB_LOG.info(op)
 
+    def logSkipUnchangedSchemaDesc(self, dbId):
+        op = ''
+        op += '    - The schema descriptions for the ' + dbId
+        op += ' database have not changed since they were last refreshed'
+        self.JOB_LOG.info(op)
+
     def logLoadingDBSchemaDescsFromGsheets(self, dbId):
         op = ''
         op += '    - Extracting schema descriptions for the ' + dbId
@@ -471,6 +477,35 @@ class Logger():
 
         self.JOB_LOG.info(op)
 
+    def logSkipUnchangedExtract(self, tableName, srcSysID):
+
+        op = ''
+        op += '\n'
+        op += '  - Skipping the extract of ' + tableName + ': the source '
+        op += 'table in ' + srcSysID + ' has not changed since it was last '
+        op += 'extracted'
+        op += '\n'
+
+        self.JOB_LOG.info(op)
+
+    def logGsheetClientStats(self, stats):
+
+        if len(stats) == 0:
+            return
+
+        op = ''
+        op += '\n'
+        op += '  - Google Sheets requests:' + '\n'
+        for operation in sorted(stats):
+            opStats = stats[operation]
+            op += ('    - ' + operation + ': ' +
+                   str(opStats['requests']) + ' requests (' +
+                   str(opStats['retries']) + ' retries, ' +
+                   str(opStats['errors']) + ' errors) in ' +
+                   str(round(opStats['seconds'], 2)) + 's' + '\n')
+
+        self.JOB_LOG.info(op)
+
     def logRefreshDefaultRowsTxtFileFromGSheetStart(self):
         op = ''
         op += '  - Refreshing the default rows txt file from Google Sheets... '